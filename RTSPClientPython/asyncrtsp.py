@@ -0,0 +1,360 @@
+import asyncio, io, time
+
+from jitter import JitterBuffer
+from payload import DepacketizerRegistry, DEPACKETIZERS
+from playout import PlayoutClock
+from rtpparse import RTPParser
+from rtsp import Response, format_request
+from stats import ReceiveStats
+from session import VideoFrame
+
+class RTPProtocol(asyncio.DatagramProtocol):
+    '''Datagram protocol that hands every RTP packet received to an
+    AsyncConnection.
+    '''
+    def __init__(self, connection):
+        self.connection = connection
+
+    def datagram_received(self, data, addr):
+        self.connection.packet_received(data)
+
+    def error_received(self, exception):
+        self.connection.session.handle_exception(exception)
+
+class AsyncConnection:
+    def __init__(self, session, address, scheduler=None):
+        '''Creates a new connection with an RTSP server, driven by the running
+        event loop. The TCP connection itself is only established by
+        connect(), and no stream is set up at this point. If a scheduler
+        (such as a TimerWheel) is given, frame deliveries are registered
+        with it instead of running a playout task per connection.
+        '''
+        self.BUFFER_THRESHOLD = 120
+        self.BUFFER_CAPACITY = 1024
+        self.PLAYBACK_RATE = 1/25
+        self.DEPACKETIZERS = dict(DEPACKETIZERS)
+        self.session = session
+        self.address = address[0]
+        self.port = int(address[1])
+        self.cseq = 0
+        self.session_id = None
+        self.state = 'INIT'
+        self.reader = None
+        self.writer = None
+        self.request_lock = asyncio.Lock()
+        self.buffer = JitterBuffer(self.BUFFER_CAPACITY)
+        self.playout = PlayoutClock(self.PLAYBACK_RATE)
+        self.packet_event = asyncio.Event()
+        self.parser = RTPParser()
+        self.depacketizer = DepacketizerRegistry(self.DEPACKETIZERS)
+        self.stats = ReceiveStats()
+        self.rtp_transport = None
+        self.playout_task = None
+        self.scheduler = scheduler
+        self.playing = False
+        self.pending = None
+
+    async def connect(self):
+        '''Opens the TCP connection with the RTSP server.'''
+        self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+
+    async def read_response(self):
+        '''Reads a response, including any body announced by Content-Length,
+        from the stream and parses it into a Response.
+        '''
+        data = bytearray()
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError('Connection closed by the server')
+            data += line
+            if not line.strip():
+                break
+            name, _, value = line.decode().partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        if length:
+            data += await self.reader.readexactly(length)
+        return Response(io.BytesIO(data))
+
+    async def request(self, command, **parameters):
+        '''Sends an RTSP request and waits for its response. Requests are
+        serialized, so concurrent callers do not interleave on the stream.
+        '''
+        async with self.request_lock:
+            self.cseq += 1
+            request = format_request(command, self.session.video_name, self.cseq, **parameters)
+            self.writer.write(request.encode())
+            await self.writer.drain()
+            return await self.read_response()
+
+    def packet_received(self, data):
+        '''Parses an RTP packet and adds it to the jitter buffer.'''
+        packet = self.parser.parse(data)
+        if packet is None:
+            return
+        arrival = time.monotonic()
+        self.playout.observe(packet.timestamp, arrival)
+        self.stats.packet_received(packet.sequence_number, packet.timestamp, len(packet.payload),
+                                   arrival, self.playout.clock_rate)
+        self.buffer.insert(packet.sequence_number, packet.as_frame())
+        self.packet_event.set()
+        if self.scheduler and self.state == 'PLAYING' and self.pending is None:
+            self.schedule_next()
+
+    def schedule_next(self):
+        '''Takes the next frame from the jitter buffer and registers its
+        delivery with the scheduler. Does nothing while buffering; the
+        next packet received calls this again.
+        '''
+        self.pending = None
+        # a packet can complete two frames: the second is held back by the
+        # depacketizer and scheduled right after the first
+        frame = self.depacketizer.pop()
+        while frame is None:
+            if not self.playing:
+                if len(self.buffer) <= self.BUFFER_THRESHOLD / 2:
+                    return
+                self.playing = True
+                self.playout.restart()
+            entry = self.buffer.pop()
+            if entry is None:
+                self.playing = False
+                return
+            frame = self.depacketize(entry[1])
+        deadline = self.playout.deadline(frame[3])
+        self.pending = self.scheduler.schedule(deadline, self.deliver, frame, deadline)
+
+    def deliver(self, frame, deadline):
+        '''Scheduler callback that passes a frame to the session and
+        schedules the following one.
+        '''
+        self.playout.delivered(deadline, frame[2])
+        self.stats.frame_played(len(frame[4]))
+        self.session.process_frame(*frame)
+        self.schedule_next()
+
+    def depacketize(self, packet):
+        '''Passes a packet taken from the jitter buffer (None if it was lost)
+        to the depacketizer. Returns a complete frame or None.
+        '''
+        if packet is None:
+            self.depacketizer.lost()
+            return None
+        return self.depacketizer.push(packet)
+
+    async def process_frames(self):
+        '''Plays out the frames in the jitter buffer according to their
+        timestamps, once enough packets have been buffered.
+        '''
+        playing = False
+        while True:
+            if not playing and len(self.buffer) > self.BUFFER_THRESHOLD / 2:
+                playing = True
+                self.playout.restart()
+            if len(self.buffer) == 0:
+                playing = False
+            if not playing:
+                self.packet_event.clear()
+                await self.packet_event.wait()
+                continue
+
+            entry = self.buffer.pop()
+            if entry is None:
+                continue
+            frame = self.depacketize(entry[1])
+            # a packet can complete two frames: the second is held back by
+            # the depacketizer and played after the first
+            while frame is not None:
+                payload_type, marker, seq_num, timestamp, payload = frame
+                deadline = self.playout.deadline(timestamp)
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.playout.delivered(deadline, seq_num)
+                self.stats.frame_played(len(payload))
+                self.session.process_frame(payload_type, marker, seq_num, timestamp, payload)
+                frame = self.depacketizer.pop()
+
+    async def setup(self):
+        '''Creates the RTP datagram endpoint on a random UDP port and sends a
+        SETUP request announcing it.
+        '''
+        if self.state != 'INIT':
+            return
+        loop = asyncio.get_running_loop()
+        self.rtp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: RTPProtocol(self), local_addr=(self.address, 0))
+        self.rtp_port = self.rtp_transport.get_extra_info('sockname')[1]
+        self.cseq = 0
+        try:
+            resp = await self.request('SETUP', transport='RTP/UDP', port=self.rtp_port)
+        except Exception:
+            self.close_rtp()
+            raise
+        self.session_id = resp.session_id
+        self.buffer.clear()
+        self.playout = PlayoutClock(self.PLAYBACK_RATE)
+        self.parser = RTPParser()
+        self.depacketizer = DepacketizerRegistry(self.DEPACKETIZERS)
+        self.stats.reset()
+        self.stats.attach(self.buffer, self.playout, self.depacketizer, parser=self.parser)
+        self.state = 'READY'
+
+    async def play(self):
+        '''Sends a PLAY request and starts playing out received frames.'''
+        if self.state != 'READY':
+            return
+        if self.scheduler is None:
+            self.playout_task = asyncio.create_task(self.process_frames())
+        try:
+            await self.request('PLAY', session_id=self.session_id)
+        except Exception:
+            self.stop_playout()
+            raise
+        self.state = 'PLAYING'
+
+    async def pause(self):
+        '''Stops playing out frames and sends a PAUSE request.'''
+        if self.state != 'PLAYING':
+            return
+        self.stop_playout()
+        await self.request('PAUSE', session_id=self.session_id)
+        self.buffer.clear()
+        self.state = 'READY'
+
+    async def teardown(self):
+        '''Sends a TEARDOWN request and closes the RTP endpoint. A further
+        SETUP in the same connection is accepted afterwards.
+        '''
+        if self.state not in ('READY', 'PLAYING'):
+            return
+        self.stop_playout()
+        await self.request('TEARDOWN', session_id=self.session_id)
+        self.close_rtp()
+        self.state = 'INIT'
+
+    def stop_playout(self):
+        if self.playout_task:
+            self.playout_task.cancel()
+            self.playout_task = None
+        if self.pending:
+            self.pending.cancel()
+            self.pending = None
+        self.playing = False
+
+    def close_rtp(self):
+        if self.rtp_transport:
+            self.rtp_transport.close()
+            self.rtp_transport = None
+
+    async def close(self):
+        '''Closes the connection with the RTSP server and any RTP endpoint
+        still open.
+        '''
+        self.stop_playout()
+        self.close_rtp()
+        self.state = 'INIT'
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+class AsyncSession:
+    def __init__(self, address, queue_length=30, scheduler=None):
+        '''Creates a new RTSP session driven by asyncio. Call connect() before
+        any other method. Frames can be consumed with `async for`, or
+        through SessionListener objects as with Session. If frames are
+        not consumed, only the newest queue_length frames are kept.
+        '''
+        self.connection = AsyncConnection(self, address, scheduler)
+        self.video_name = None
+        self.listeners = []
+        self.frames = asyncio.Queue(queue_length)
+
+    async def connect(self):
+        await self.connection.connect()
+        return self
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        listener.video_name_changed(self.video_name)
+
+    async def open(self, video_name):
+        '''Opens a new video file. Unlike Session, errors are raised to the
+        caller as well as reported to listeners.
+        '''
+        self.video_name = video_name
+        await self.run(self.connection.setup())
+        for l in self.listeners:
+            l.video_name_changed(video_name)
+
+    async def play(self):
+        await self.run(self.connection.play())
+
+    async def pause(self):
+        await self.run(self.connection.pause())
+
+    async def teardown(self):
+        await self.run(self.connection.teardown())
+        self.video_name = None
+        self.end_frames()
+        for l in self.listeners:
+            l.frame_received(None)
+            l.video_name_changed(None)
+
+    async def close(self):
+        await self.run(self.connection.close())
+        self.end_frames()
+        for l in self.listeners:
+            l.video_name_changed(None)
+            l.frame_received(None)
+
+    async def run(self, coroutine):
+        try:
+            return await coroutine
+        except Exception as exception:
+            self.handle_exception(exception)
+            raise
+
+    def handle_exception(self, exception):
+        for l in self.listeners:
+            l.exception_thrown(exception)
+
+    def end_frames(self):
+        '''Wakes up consumers of the frame iterator so it finishes.'''
+        self.put_frame(None)
+
+    def put_frame(self, frame):
+        if self.frames.full():
+            self.frames.get_nowait()
+        self.frames.put_nowait(frame)
+
+    def process_frame(self, payload_type, marker, sequence_number, timestamp, payload):
+        '''Queues a frame for the async iterator and passes it to the
+        listeners.
+        '''
+        frame = VideoFrame(payload_type, marker, sequence_number, timestamp, payload)
+        if self.video_name:
+            self.put_frame(frame)
+            for l in self.listeners:
+                l.frame_received(frame)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        frame = await self.frames.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
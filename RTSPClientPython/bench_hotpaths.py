@@ -0,0 +1,286 @@
+#! /usr/bin/python3
+'''Microbenchmarks for the per-packet and per-frame code of the client. Every
+benchmark runs a deterministic synthetic stream (fixed random seed) through
+one hot path, without any network or server, and reports the best and
+median time per operation. Results can be saved as JSON and compared with
+a previous run, failing if anything got slower than a tolerance:
+
+    python3 bench_hotpaths.py --output base.json
+    python3 bench_hotpaths.py --compare base.json --tolerance 0.15
+'''
+import argparse, io, json, platform, random, statistics, subprocess, sys, time
+from threading import Event
+
+from jitter import JitterBuffer
+from jpeg import JPEG_PAYLOAD_TYPE
+from playout import PlayoutClock
+from rtpparse import RTPParser, RTP_HEADER
+from rtsp import Connection, Response
+import testserver
+
+SEED = 1234
+
+def rtp_packets(payloads, seq_num=0xFFF0, timestamp=0, ssrc=0x1234ABCD, frame_ticks=3600):
+    '''Wraps frames, given as lists of payloads, into RTP packets. The
+    sequence numbers start close to the wraparound on purpose.
+    '''
+    packets = []
+    for frame in payloads:
+        for i, payload in enumerate(frame):
+            marker = 0x80 if i == len(frame) - 1 else 0
+            packets.append(RTP_HEADER.pack(0x80, marker | JPEG_PAYLOAD_TYPE, seq_num, timestamp, ssrc) + payload)
+            seq_num = (seq_num + 1) & 0xFFFF
+        timestamp = (timestamp + frame_ticks) & 0xFFFFFFFF
+    return packets
+
+def reorder(items, rate, rng, distance=3):
+    '''Moves a fraction of the items up to distance places later.'''
+    items = list(items)
+    for i in range(len(items) - distance):
+        if rng.random() < rate:
+            j = i + rng.randint(1, distance)
+            items[i], items[j] = items[j], items[i]
+    return items
+
+class NoSleepClock(PlayoutClock):
+    '''Playout clock that computes deadlines but never sleeps.'''
+    def sleep_until(self, deadline, event=None):
+        pass
+
+class DrainedEvent(Event):
+    '''Play event that stops the playout loop the first time it would
+    wait for packets, that is, once the buffer is drained.
+    '''
+    def wait(self, timeout=None):
+        self.set()
+        return True
+
+class CountingSession:
+    '''Stands in for Session in the playout loop.'''
+    def __init__(self):
+        self.frames = 0
+        self.video_name = 'bench'
+
+    def process_frame(self, payload_type, marker, seq_num, timestamp, payload, trace=None):
+        self.frames += 1
+
+    def statistics_updated(self, statistics):
+        pass
+
+class BenchConnection(Connection):
+    '''Connection that does not open the RTSP connection, so that it can
+    be built by the normal constructor without a server.
+    '''
+    def connect(self):
+        self.socket = None
+        self.channel = None
+
+def bare_connection(capacity=1024):
+    '''Returns a Connection with its per-stream state but no sockets.'''
+    connection = BenchConnection(CountingSession(), ('127.0.0.1', 0))
+    connection.BUFFER_THRESHOLD = 0
+    # the stream state SETUP would create, with a clock that never sleeps
+    connection.buffer = JitterBuffer(capacity)
+    connection.playout = NoSleepClock(1/25, clock_rate=testserver.RTP_CLOCK_RATE)
+    connection.stats.attach(connection.buffer, connection.playout, connection.depacketizer)
+    return connection
+
+def measure(run, operations, repeat):
+    '''Calls run() repeat times; each call performs the given number of
+    operations. Returns the timings in nanoseconds per operation.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        run()
+        times.append((time.perf_counter_ns() - start) / operations)
+    return {
+        'operations': operations,
+        'best_ns': min(times),
+        'median_ns': statistics.median(times),
+        'ops_per_second': 1e9 / min(times),
+    }
+
+def bench_rtp_parse(packets, repeat):
+    '''RTP header parsing of one receive batch after another, as done by
+    listen_for_rtp.
+    '''
+    buffers = [bytearray(p) for p in packets]
+    views = [memoryview(b) for b in buffers]
+    batches = [views[i:i + 16] for i in range(0, len(views), 16)]
+    def run():
+        parser = RTPParser()
+        for batch in batches:
+            for packet in parser.parse_batch(batch):
+                packet.as_frame()
+    return measure(run, len(packets), repeat)
+
+def bench_insert_frame(packets, rate, depth, repeat):
+    '''Connection.insert_frame with the given reorder rate, keeping the
+    jitter buffer about depth packets deep.
+    '''
+    frames = [RTPParser(lock_ssrc=False).parse(p).as_frame() for p in packets]
+    frames = reorder(frames, rate, random.Random(SEED))
+    def run():
+        connection = bare_connection()
+        buffer = connection.buffer
+        for frame in frames:
+            connection.insert_frame(frame)
+            if len(buffer) > depth:
+                buffer.pop()
+    return measure(run, len(frames), repeat)
+
+def bench_process_frames(packets, frame_count, repeat):
+    '''The process_frames drain loop (reassembly, scheduling and delivery)
+    over a full buffer, with the sleeps stubbed out.
+    '''
+    frames = [RTPParser(lock_ssrc=False).parse(p).as_frame() for p in packets]
+    def run():
+        connection = bare_connection(len(frames))
+        connection.playEvent = DrainedEvent()
+        for frame in frames:
+            connection.insert_frame(frame)
+        connection.process_frames()
+        if connection.session.frames != frame_count:
+            raise AssertionError(f'{connection.session.frames} frames played instead of {frame_count}')
+    return measure(run, frame_count, repeat)
+
+def bench_response(repeat, count=1000):
+    '''Parsing of typical RTSP responses.'''
+    text = (b'RTSP/1.0 200 OK\r\nCSeq: 3\r\nSession: 123456;timeout=60\r\n'
+            b'Transport: RTP/AVP/TCP;unicast;interleaved=0-1\r\n'
+            b'Date: Thu, 01 Jan 2026 00:00:00 GMT\r\n\r\n')
+    data = text * count
+    def run():
+        reader = io.BytesIO(data)
+        for _ in range(count):
+            Response(reader)
+    return measure(run, count, repeat)
+
+def bench_video_frame(jpeg, size, repeat, count=20):
+    '''VideoFrame construction and decoding, at full size or decoded for
+    display at a smaller size.
+    '''
+    from session import VideoFrame
+    def run():
+        for i in range(count):
+            VideoFrame(JPEG_PAYLOAD_TYPE, 1, i, i * 3600, jpeg).decode(size)
+    return measure(run, count, repeat)
+
+def bench_get_image(jpeg, repeat, count=20):
+    '''VideoFrame.get_image, which also creates the Tk photo image. Needs a
+    display; returns None without one.
+    '''
+    import tkinter
+    from session import VideoFrame
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError:
+        return None
+    try:
+        def run():
+            for i in range(count):
+                VideoFrame(JPEG_PAYLOAD_TYPE, 1, i, i * 3600, jpeg).get_image()
+        return measure(run, count, repeat)
+    finally:
+        root.destroy()
+
+def run_benchmarks(options):
+    width, height = (int(v) // 8 * 8 for v in options.size.split('x'))
+    jpegs = testserver.synthetic_frames(options.frames, width, height, options.quality)
+    payloads = [testserver.packetize(testserver.scan_data(j), width, height, options.quality, options.packet_size)
+                for j in jpegs]
+    payloads = (payloads * (options.packets // sum(map(len, payloads)) + 1))
+    frame_payloads = []
+    total = 0
+    for frame in payloads:
+        if total >= options.packets:
+            break
+        frame_payloads.append(frame)
+        total += len(frame)
+    packets = rtp_packets(frame_payloads)
+
+    results = {}
+    def record(name, result):
+        results[name] = result
+        if not options.quiet:
+            if result is None:
+                print(f'{name:<40} skipped', file=sys.stderr)
+            else:
+                print(f'{name:<40} {result["best_ns"]:>12.0f} ns {result["ops_per_second"]:>14.0f}/s', file=sys.stderr)
+
+    record('rtp_parse', bench_rtp_parse(packets, options.repeat))
+    for rate in options.reorder:
+        for depth in options.depth:
+            record(f'insert_frame[reorder={rate},depth={depth}]',
+                   bench_insert_frame(packets, rate, depth, options.repeat))
+    record('process_frames', bench_process_frames(packets, len(frame_payloads), options.repeat))
+    record('response_parse', bench_response(options.repeat))
+    record('video_frame_decode', bench_video_frame(jpegs[0], None, options.repeat))
+    record('video_frame_decode[320x240]', bench_video_frame(jpegs[0], (320, 240), options.repeat))
+    if options.get_image:
+        record('video_frame_get_image', bench_get_image(jpegs[0], options.repeat))
+    return results
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance):
+    '''Returns a list of messages for the benchmarks more than tolerance
+    (a fraction) slower than in the baseline.
+    '''
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if result is None or before is None:
+            continue
+        ratio = result['best_ns'] / before['best_ns']
+        if ratio > 1 + tolerance:
+            regressions.append(f'{name}: {before["best_ns"]:.0f} ns -> {result["best_ns"]:.0f} ns ({ratio - 1:+.0%})')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--packets', type=int, default=5000, help='packets in the synthetic stream')
+    parser.add_argument('--repeat', type=int, default=7, help='runs of each benchmark; the best is kept')
+    parser.add_argument('--reorder', type=float, nargs='+', default=[0, 0.01, 0.1])
+    parser.add_argument('--depth', type=int, nargs='+', default=[16, 128, 1000], help='jitter buffer depths')
+    parser.add_argument('--size', default='640x480', help='frame size, WIDTHxHEIGHT')
+    parser.add_argument('--quality', type=int, default=75)
+    parser.add_argument('--frames', type=int, default=10, help='distinct frames in the stream')
+    parser.add_argument('--packet-size', type=int, default=1400)
+    parser.add_argument('--get-image', action='store_true', help='also time get_image (needs a display)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='slowdown allowed by --compare')
+    parser.add_argument('--quiet', action='store_true')
+    options = parser.parse_args()
+
+    random.seed(SEED)
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'parameters': {k: v for k, v in vars(options).items() if k not in ('output', 'compare', 'quiet')},
+        'results': run_benchmarks(options),
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(report['results'], json.load(baseline)['results'], options.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#! /usr/bin/python3
+'''Measures how the CPU cost per stream of a SessionManager scales with the
+number of concurrent streams. A minimal RTSP/RTP server runs in a child
+process on the loopback interface, so only the client's CPU time is
+measured.
+
+    python3 bench_manager.py --streams 1 10 50 100 200 --fps 25 --seconds 5
+'''
+import argparse, asyncio, json, multiprocessing, re, struct, time
+
+from manager import SessionManager
+
+class BenchServerProtocol(asyncio.Protocol):
+    '''Answers every request with 200 OK and streams small fake JPEG
+    frames over RTP while the stream is playing.
+    '''
+    def __init__(self, fps, payload):
+        self.fps = fps
+        self.payload = payload
+        self.buffer = b''
+        self.stream_task = None
+        self.rtp_port = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.host = transport.get_extra_info('peername')[0]
+
+    def data_received(self, data):
+        self.buffer += data
+        while b'\n\n' in self.buffer:
+            request, self.buffer = self.buffer.split(b'\n\n', 1)
+            self.handle(request.decode())
+
+    def handle(self, request):
+        command = request.split(' ', 1)[0]
+        cseq = re.search(r'(?i)cseq:\s*(\d+)', request).group(1)
+        if command == 'SETUP':
+            self.rtp_port = int(re.search(r'client_port=\s*(\d+)', request).group(1))
+        elif command == 'PLAY' and self.stream_task is None:
+            self.stream_task = asyncio.get_running_loop().create_task(self.stream())
+        elif command in ('PAUSE', 'TEARDOWN') and self.stream_task:
+            self.stream_task.cancel()
+            self.stream_task = None
+        self.transport.write(f'RTSP/1.0 200 OK\r\nCSeq: {cseq}\r\nSession: 1\r\n\r\n'.encode())
+
+    def connection_lost(self, exc):
+        if self.stream_task:
+            self.stream_task.cancel()
+
+    async def stream(self):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=(self.host, self.rtp_port))
+        start = time.monotonic()
+        try:
+            for i in range(1 << 30):
+                header = struct.pack('!BBHII', 0x80, 0x80 | 26, i & 0xFFFF, (i * 90000 // self.fps) & 0xFFFFFFFF, 1)
+                transport.sendto(header + self.payload)
+                await asyncio.sleep(max(0, start + (i + 1) / self.fps - time.monotonic()))
+        finally:
+            transport.close()
+
+def run_server(port_queue, fps, payload_size):
+    async def main():
+        payload = b'\xff\xd8' + bytes(payload_size - 4) + b'\xff\xd9'
+        server = await asyncio.get_running_loop().create_server(
+            lambda: BenchServerProtocol(fps, payload), '127.0.0.1', 0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+    asyncio.run(main())
+
+def measure(port, streams, seconds, threshold):
+    manager = SessionManager()
+    try:
+        ids = [manager.add(('127.0.0.1', port)) for _ in range(streams)]
+        for i in ids:
+            manager.sessions[i].connection.BUFFER_THRESHOLD = threshold
+        manager.open_all({i: f'bench{i}.Mjpeg' for i in ids})
+        # let every stream fill its buffer and start playing
+        time.sleep(threshold / 2 / 25 + 0.5)
+        frames_before = manager.stats()['frames']
+        cpu_before, wall_before = time.process_time(), time.monotonic()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu_before
+        wall = time.monotonic() - wall_before
+        stats = manager.stats()
+    finally:
+        manager.close()
+    frames = stats['frames'] - frames_before
+    return {
+        'streams': streams,
+        'cpu_percent': 100 * cpu / wall,
+        'cpu_ms_per_stream_second': 1000 * cpu / wall / streams,
+        'frames_per_second': frames / wall,
+        'late_frames': stats['late_frames'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 10, 50, 100])
+    parser.add_argument('--fps', type=int, default=25)
+    parser.add_argument('--payload', type=int, default=1000, help='bytes per packet')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--threshold', type=int, default=10, help='packets buffered before playout (x2)')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per line')
+    args = parser.parse_args()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_server, args=(port_queue, args.fps, args.payload), daemon=True)
+    server.start()
+    port = port_queue.get()
+    try:
+        if not args.json:
+            print(f'{"streams":>8} {"cpu %":>8} {"ms/stream/s":>12} {"frames/s":>10} {"late":>6}')
+        for streams in args.streams:
+            result = measure(port, streams, args.seconds, args.threshold)
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f'{result["streams"]:>8} {result["cpu_percent"]:>8.1f} '
+                      f'{result["cpu_ms_per_stream_second"]:>12.3f} '
+                      f'{result["frames_per_second"]:>10.1f} {result["late_frames"]:>6}')
+    finally:
+        server.terminate()
+
+if __name__ == '__main__':
+    main()
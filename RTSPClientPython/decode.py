@@ -0,0 +1,87 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
+
+class DecodePipeline:
+    def __init__(self, callback, size=None, workers=2, max_pending=4):
+        '''Decodes frames on a pool of worker threads, so that slow decodes
+        do not hold up the playout loop.
+
+        - callback: Called as callback(frame, image) with each decoded
+          frame, from a worker thread, in the order frames were submitted.
+        - size: (width, height) the images are displayed at. JPEG frames are
+          decoded directly at a reduced scale (PIL draft mode) and then
+          shrunk to fit, which is much cheaper than a full-size decode.
+          None decodes at full size. Can be changed at any time.
+        - workers: Number of decoding threads.
+        - max_pending: Most frames waiting or being decoded. When decoding
+          falls behind, the oldest frames not yet started are dropped.
+        '''
+        self.callback = callback
+        self.size = size
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='decode')
+        self.pending = deque()
+        self.lock = RLock()
+        self.decoded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, frame):
+        '''Queues a frame for decoding. Returns immediately.'''
+        with self.lock:
+            # decoded frames waiting for an earlier one are not counted
+            while sum(1 for entry in self.pending if not entry[2]) >= self.max_pending:
+                if not self.drop_stale():
+                    # every pending frame is being decoded
+                    self.dropped += 1
+                    return
+            entry = [frame, None, False]  # frame, image, done
+            self.pending.append(entry)
+            entry.append(self.executor.submit(self.decode, entry, self.size))
+
+    def drop_stale(self):
+        '''Drops the oldest frame whose decoding has not started. Must be
+        called with the lock held. Returns False if every pending frame is
+        already being decoded.
+        '''
+        for entry in self.pending:
+            if not entry[2] and entry[3].cancel():
+                self.pending.remove(entry)
+                self.dropped += 1
+                return True
+        return False
+
+    def decode(self, entry, size):
+        try:
+            entry[1] = entry[0].decode(size)
+        except Exception:
+            entry[1] = None
+        self.finished(entry)
+
+    def finished(self, entry):
+        '''Marks a frame as decoded and delivers, in order, every decoded
+        frame at the front of the queue.
+        '''
+        ready = []
+        with self.lock:
+            entry[2] = True
+            while self.pending and self.pending[0][2]:
+                ready.append(self.pending.popleft())
+            for frame, image, _, _ in ready:
+                if image is None:
+                    self.failed += 1
+                else:
+                    self.decoded += 1
+            # the lock is held while delivering so that frames are not
+            # reordered by two workers finishing at the same time
+            for frame, image, _, _ in ready:
+                if image is not None:
+                    self.callback(frame, image)
+
+    def close(self):
+        '''Drops the frames not yet decoded and stops the workers.'''
+        with self.lock:
+            while self.drop_stale():
+                pass
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,141 @@
+import traceback
+from collections import deque
+from threading import Thread, Condition
+
+# What a listener's queue does when a frame arrives and it is full:
+DROP_OLDEST = 'drop-oldest'        # drop the oldest queued frame
+DROP_TO_LATEST = 'drop-to-latest'  # drop every queued frame, keep the new one
+DROP_TO_MARKER = 'drop-to-marker'  # drop up to the next marker (key) frame
+POLICIES = (DROP_OLDEST, DROP_TO_LATEST, DROP_TO_MARKER)
+
+STOP = object()
+
+class ListenerDispatcher:
+    def __init__(self, listener, policy=DROP_OLDEST, max_queue=8):
+        '''Calls the methods of one session listener from its own thread,
+        through a bounded queue, so that a slow listener cannot hold up
+        playout or the other listeners. Only frames are ever dropped;
+        other events are always delivered, in order with the frames.
+        With policy None, methods are called directly on the caller's
+        thread instead.
+        '''
+        if policy is not None and policy not in POLICIES:
+            raise ValueError(f'Unknown policy {policy!r}, expected one of {", ".join(POLICIES)}')
+        self.listener = listener
+        self.policy = policy
+        self.max_queue = max_queue
+        self.queue = deque()       # (method name, arguments)
+        self.condition = Condition()
+        self.frames = 0            # frames in the queue
+        self.waiting_marker = False
+        self.closed = False
+
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+        self.thread = None
+        if policy is not None:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def post(self, method, *args):
+        '''Queues a call to a listener method. Never blocks.'''
+        if self.policy is None:
+            self.call(method, args)
+            return
+        frame = args[0] if method == 'frame_received' else None
+        with self.condition:
+            if self.closed:
+                return
+            if frame is not None:
+                if self.waiting_marker:
+                    if not frame.marker:
+                        self.dropped += 1
+                        return
+                    self.waiting_marker = False
+                if self.frames >= self.max_queue and not self.make_room(frame):
+                    self.dropped += 1
+                    return
+                self.frames += 1
+            self.queue.append((method, args))
+            if self.frames > self.max_depth:
+                self.max_depth = self.frames
+            self.condition.notify()
+
+    def make_room(self, frame):
+        '''Drops queued frames according to the policy. Must be called with
+        the lock held. Returns False if the new frame must be dropped too.
+        '''
+        frames = [i for i, (method, args) in enumerate(self.queue)
+                  if method == 'frame_received' and args[0] is not None]
+        if self.policy == DROP_OLDEST:
+            drop = frames[:1]
+        elif self.policy == DROP_TO_LATEST:
+            drop = frames
+        else:
+            keep = next((i for i in frames[1:] if self.queue[i][1][0].marker), None)
+            if keep is not None:
+                drop = [i for i in frames if i < keep]
+            else:
+                drop = frames
+                if not frame.marker:
+                    # nothing decodable left: wait for the next key frame
+                    self.waiting_marker = True
+        if drop:
+            drop = set(drop)
+            self.queue = deque(item for i, item in enumerate(self.queue) if i not in drop)
+            self.frames -= len(drop)
+            self.dropped += len(drop)
+        return not self.waiting_marker
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                method, args = self.queue.popleft()
+                if method is STOP:
+                    return
+                if method == 'frame_received' and args[0] is not None:
+                    self.frames -= 1
+            self.call(method, args)
+
+    def call(self, method, args):
+        if method == 'frame_received' and args[0] is not None and args[0].trace is not None:
+            args[0].trace.mark('dispatched')
+        try:
+            getattr(self.listener, method)(*args)
+        except Exception:
+            # a failing listener must not stop the others, nor its own queue
+            self.errors += 1
+            traceback.print_exc()
+            return
+        if method == 'frame_received' and args[0] is not None:
+            self.delivered += 1
+
+    def close(self, timeout=1.0):
+        '''Delivers the queued events and stops the thread, waiting at most
+        timeout seconds for it.
+        '''
+        if self.thread is None:
+            return
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.append((STOP, ()))
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def statistics(self):
+        return {
+            'listener': type(self.listener).__name__,
+            'policy': self.policy,
+            'queued': self.frames,
+            'max_queued': self.max_depth,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
@@ -0,0 +1,186 @@
+import struct
+
+H264_PAYLOAD_TYPE = 96  # dynamic; the usual choice of servers
+START_CODE = b'\x00\x00\x00\x01'
+
+# NAL unit types (RFC 6184 section 5.2 and H.264 table 7-1)
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_STAP_A = 24
+NAL_STAP_B = 25
+NAL_MTAP16 = 26
+NAL_MTAP24 = 27
+NAL_FU_A = 28
+NAL_FU_B = 29
+
+class H264Depacketizer:
+    def __init__(self, initial_size=0x40000, parameter_sets=None, wait_for_keyframe=True):
+        '''Reassembles H.264 access units carried over RTP as described in
+        RFC 6184 (non-interleaved mode: single NAL unit, STAP-A and FU-A
+        packets). Packets must be given in sequence order. Each NAL unit
+        is written, behind an Annex-B start code, directly into a buffer
+        that is reused from access unit to access unit and only grows.
+
+        - parameter_sets: SPS and PPS NAL units (bytes, without start
+          codes), for streams that only announce them out of band. They
+          are put in front of keyframes that do not carry their own.
+        - wait_for_keyframe: After a loss, and at the start, access units
+          are dropped until the next IDR picture, since they cannot be
+          decoded correctly without their references.
+
+        Delivered access units have the marker field set only if they
+        contain an IDR picture, so that consumers can tell keyframes.
+        '''
+        self.buffer = bytearray(initial_size)
+        self.parameter_sets = b''.join(START_CODE + bytes(p) for p in parameter_sets or ())
+        self.wait_for_keyframe = wait_for_keyframe
+        self.need_keyframe = wait_for_keyframe
+        self.reset()
+        self.frames = 0
+        self.dropped = 0
+        self.unsupported = 0
+
+    def reset(self):
+        '''Forgets any partially assembled access unit.'''
+        self.timestamp = None
+        self.end = 0
+        self.broken = True
+        self.fragment = False   # inside a FU-A fragmented NAL unit
+        self.keyframe = False
+        self.has_sps = False
+        self.seq_num = None     # of the last packet added
+        self.ready = None       # complete access unit held back by push
+
+    def lost(self):
+        '''Signals that a packet is missing, so the access unit being
+        assembled is discarded.
+        '''
+        if self.timestamp is not None and not self.broken:
+            self.broken = True
+            self.dropped += 1
+        self.need_keyframe = self.wait_for_keyframe
+
+    def push(self, frame):
+        '''Adds a packet (payload_type, marker, seq_num, timestamp, payload) to
+        the access unit being assembled. Returns the complete access unit,
+        with the same fields and an Annex-B byte stream as payload, once
+        its last packet (marker set) is received, and None otherwise. An
+        access unit whose last packet lacks the marker (as some servers
+        send them) is returned when the first packet of the next one
+        arrives; if that packet is a whole access unit by itself, it is
+        held back and returned by pop().
+        '''
+        payload_type, marker, seq_num, timestamp, payload = frame
+        result = None
+        if timestamp != self.timestamp:
+            if self.timestamp is not None and not self.broken:
+                if self.end and not self.fragment:
+                    result = self.finish(payload_type)
+                else:
+                    self.dropped += 1
+                    self.need_keyframe = self.wait_for_keyframe
+            self.timestamp = timestamp
+            self.end = 0
+            self.broken = False
+            self.fragment = False
+            self.keyframe = False
+            self.has_sps = False
+        if self.broken:
+            return result
+
+        try:
+            self.add(memoryview(payload))
+        except (ValueError, IndexError, struct.error):
+            self.broken = True
+            self.dropped += 1
+            self.need_keyframe = self.wait_for_keyframe
+            return result
+        self.seq_num = seq_num
+        if marker and not self.fragment:
+            if result is None:
+                result = self.finish(payload_type)
+            else:
+                self.ready = self.finish(payload_type)
+            self.timestamp = None
+        return result
+
+    def pop(self):
+        '''Returns the access unit held back by the last push, or None.'''
+        frame, self.ready = self.ready, None
+        return frame
+
+    def finish(self, payload_type):
+        '''Returns the assembled access unit as a frame tuple, or None if it
+        is dropped while waiting for a keyframe. Its sequence number is
+        that of its last packet.
+        '''
+        timestamp = self.timestamp
+        self.broken = True
+        if self.need_keyframe:
+            if not self.keyframe:
+                self.dropped += 1
+                return None
+            self.need_keyframe = False
+        self.frames += 1
+        data = memoryview(self.buffer)[:self.end]
+        if self.keyframe and self.parameter_sets and not self.has_sps:
+            return (payload_type, True, self.seq_num, timestamp, self.parameter_sets + data)
+        return (payload_type, self.keyframe, self.seq_num, timestamp, bytes(data))
+
+    def write(self, *parts):
+        '''Appends byte strings to the access unit.'''
+        end = self.end + sum(len(p) for p in parts)
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end, 2 * len(self.buffer)) - len(self.buffer)))
+        for part in parts:
+            self.buffer[self.end:self.end + len(part)] = part
+            self.end += len(part)
+
+    def nal_unit(self, nal_type):
+        if nal_type == NAL_IDR:
+            self.keyframe = True
+        elif nal_type == NAL_SPS:
+            self.has_sps = True
+
+    def add(self, payload):
+        '''Adds the NAL units carried by one RTP payload.'''
+        if not payload:
+            raise ValueError('Empty payload')
+        nal_type = payload[0] & 0x1F
+        if nal_type == NAL_FU_A:
+            indicator, header = payload[0], payload[1]
+            start, end = header & 0x80, header & 0x40
+            if start:
+                if self.fragment:
+                    raise ValueError('Fragmented NAL unit started twice')
+                self.nal_unit(header & 0x1F)
+                self.write(START_CODE, bytes(((indicator & 0xE0) | (header & 0x1F),)), payload[2:])
+                self.fragment = True
+            elif not self.fragment:
+                raise ValueError('Fragment of a NAL unit whose start was lost')
+            else:
+                self.write(payload[2:])
+            if end:
+                self.fragment = False
+        elif self.fragment:
+            raise ValueError('Fragmented NAL unit not ended')
+        elif nal_type == NAL_STAP_A:
+            pos = 1
+            while pos < len(payload):
+                size = struct.unpack_from('!H', payload, pos)[0]
+                pos += 2
+                if size == 0 or pos + size > len(payload):
+                    raise ValueError('Invalid aggregation packet')
+                self.nal_unit(payload[pos] & 0x1F)
+                self.write(START_CODE, payload[pos:pos + size])
+                pos += size
+        elif nal_type in (NAL_STAP_B, NAL_MTAP16, NAL_MTAP24, NAL_FU_B):
+            # interleaved mode packets
+            self.unsupported += 1
+            raise ValueError('Unsupported packetization mode')
+        elif 1 <= nal_type <= 23:
+            self.nal_unit(nal_type)
+            self.write(START_CODE, payload)
+        else:
+            raise ValueError(f'Invalid NAL unit type {nal_type}')
@@ -0,0 +1,181 @@
+#! /usr/bin/python3
+'''Plays a stream through Session without a GUI and reports throughput,
+end-to-end latency and CPU use as JSON. With --serve, a local stand-in
+server (testserver.py) is started first, so the whole pipeline can be
+measured on one machine:
+
+    python3 headless.py --serve --fps 30 --loss 0.01 --seconds 10 --decode
+'''
+import argparse, json, multiprocessing, sys, time
+
+from session import Session, SessionListener
+from tracing import LatencyTracer
+import testserver
+
+RTP_CLOCK_RATE = testserver.RTP_CLOCK_RATE
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class MeasuringListener(SessionListener):
+    def __init__(self, decode_size=None, decode=False):
+        '''Session listener that records the frames it receives and, if
+        decode is set, decodes them like the GUI would.
+        '''
+        self.decode = decode
+        self.decode_size = decode_size
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.decode_time = 0
+        self.exceptions = []
+        self.stalls = 0
+        self.stall_time = 0
+        self.losses = 0
+        self.recovery_time = 0
+
+    def playback_stalled(self, delay):
+        self.stalls += 1
+
+    def playback_resumed(self, stall, delay):
+        self.stall_time += stall
+
+    def connection_lost(self, reason):
+        self.losses += 1
+
+    def connection_recovered(self, seconds):
+        self.recovery_time += seconds
+
+    def frame_received(self, frame):
+        if frame is None:
+            return
+        now = time.time()
+        self.frames += 1
+        self.bytes += len(frame.payload)
+        # the stand-in server stamps frames with the wall clock at 90 kHz
+        delay = (int(now * RTP_CLOCK_RATE) - frame.timestamp) & 0xFFFFFFFF
+        if delay < 0x80000000:
+            self.latencies.append(delay / RTP_CLOCK_RATE)
+        if self.decode:
+            start = time.perf_counter()
+            frame.decode(self.decode_size)
+            self.decode_time += time.perf_counter() - start
+
+    def exception_thrown(self, exception):
+        self.exceptions.append(str(exception))
+
+def run_server(options, port_queue):
+    server = testserver.TestServer(options)
+    port_queue.put(server.port)
+    server.serve_forever()
+
+def measure(address, video_name, seconds, warmup, decode, decode_size, interleaved=False,
+            adaptive=False, min_delay=0.02, max_delay=1.0, trace=None, recover=False):
+    '''Plays a stream for warmup + seconds and returns a dict with the
+    measurements taken after the warmup. If trace is a file name, the
+    latency of each stage is traced, and the trace of the measured
+    period written there. If recover is set, lost connections are
+    recovered; latencies measured after a recovery are off by the
+    renumbering of the timestamps.
+    '''
+    tracer = LatencyTracer(warmup + seconds) if trace else None
+    session = Session(address, interleaved, adaptive, min_delay, max_delay, tracer=tracer, recover=recover)
+    listener = MeasuringListener(decode_size, decode)
+    session.add_listener(listener)
+    session.open(video_name)
+    session.play()
+    time.sleep(warmup)
+    frames, total_bytes = listener.frames, listener.bytes
+    listener.latencies = []
+    listener.stalls = listener.stall_time = 0
+    listener.losses = listener.recovery_time = 0
+    if tracer:
+        tracer.reset()
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    frames, total_bytes = listener.frames - frames, listener.bytes - total_bytes
+    statistics = session.statistics()
+    latencies = listener.latencies
+    session.teardown()
+    session.close()
+    if tracer:
+        tracer.dump(trace)
+    return {
+        'seconds': wall,
+        'frames': frames,
+        'frames_per_second': frames / wall,
+        'bits_per_second': 8 * total_bytes / wall,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_max': max(latencies) if latencies else None,
+        'cpu_percent': 100 * cpu / wall,
+        'statistics': statistics,
+        'stalls': listener.stalls,
+        'stall_seconds': listener.stall_time,
+        'connection_losses': listener.losses,
+        'recovery_seconds': listener.recovery_time,
+        'decode_seconds': listener.decode_time,
+        'exceptions': listener.exceptions,
+        'stages': tracer.statistics() if tracer else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('address', nargs='?', help='server as HOST:PORT (not needed with --serve)')
+    parser.add_argument('--video', default='movie.Mjpeg')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=5, help='seconds to play before measuring')
+    parser.add_argument('--decode', action='store_true', help='decode every frame')
+    parser.add_argument('--decode-size', help='decode at WIDTHxHEIGHT')
+    parser.add_argument('--interleaved', action='store_true', help='receive RTP over the RTSP connection (TCP)')
+    parser.add_argument('--adaptive', action='store_true', help='size the playout delay from the measured jitter')
+    parser.add_argument('--min-delay', type=float, default=0.02, help='smallest adaptive playout delay, in seconds')
+    parser.add_argument('--max-delay', type=float, default=1.0, help='largest adaptive playout delay, in seconds')
+    parser.add_argument('--serve', action='store_true', help='start a local stand-in server')
+    parser.add_argument('--trace', metavar='FILE', help='trace each stage and write a Chrome trace to FILE')
+    parser.add_argument('--recover', action='store_true', help='reconnect and resume when the connection is lost')
+    parser.add_argument('--min-fps', type=float, help='fail if fewer frames per second are played')
+    parser.add_argument('--max-latency', type=float, help='fail if the 95th percentile latency is higher')
+    parser.add_argument('--max-cpu', type=float, help='fail if the client uses more CPU (percent)')
+    testserver.add_arguments(parser.add_argument_group('stand-in server'))
+    options = parser.parse_args()
+
+    server = None
+    if options.serve:
+        port_queue = multiprocessing.Queue()
+        server = multiprocessing.Process(target=run_server, args=(options, port_queue), daemon=True)
+        server.start()
+        address = (options.host, port_queue.get())
+    elif options.address:
+        address = tuple(options.address.rsplit(':', 1))
+    else:
+        parser.error('an address or --serve is required')
+
+    decode_size = tuple(int(v) for v in options.decode_size.split('x')) if options.decode_size else None
+    try:
+        result = measure(address, options.video, options.seconds, options.warmup, options.decode, decode_size,
+                         options.interleaved, options.adaptive, options.min_delay, options.max_delay,
+                         options.trace, options.recover)
+    finally:
+        if server:
+            server.terminate()
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if options.min_fps is not None and result['frames_per_second'] < options.min_fps:
+        failures.append(f'frame rate {result["frames_per_second"]:.1f} below {options.min_fps}')
+    if options.max_latency is not None and (result['latency_p95'] is None or result['latency_p95'] > options.max_latency):
+        failures.append(f'95th percentile latency {result["latency_p95"]} above {options.max_latency}')
+    if options.max_cpu is not None and result['cpu_percent'] > options.max_cpu:
+        failures.append(f'CPU use {result["cpu_percent"]:.1f}% above {options.max_cpu}%')
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures or result['exceptions'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import re, struct
+
+INTERLEAVED_MARKER = 0x24  # '$'
+INTERLEAVED_HEADER = struct.Struct('!BBH')
+CONTENT_LENGTH = re.compile(rb'(?im)^content-length\s*:\s*(\d+)')
+
+class InterleavedReader:
+    def __init__(self, sock, buffer_size=0x40000):
+        '''Splits the byte stream of an RTSP connection carrying interleaved
+        RTP (RFC 2326 section 10.12) into binary packets and RTSP
+        messages. Data is received with large reads into one buffer, and
+        packets are returned as memoryviews over it, so they are not
+        copied; they stay valid until the next call to fill().
+        '''
+        self.socket = sock
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def fill(self):
+        '''Receives as much data as fits in the buffer, after moving any
+        incomplete message to its start. Raises ConnectionError when the
+        server closes the connection.
+        '''
+        pending = self.end - self.start
+        if pending == 0:
+            self.start = self.end = 0
+        elif self.start > 0 and self.end == len(self.buffer):
+            self.buffer[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        if self.end == len(self.buffer):
+            # a single message larger than the buffer; views handed out
+            # earlier keep the old buffer alive
+            buffer = bytearray(2 * len(self.buffer))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+            self.start, self.end = 0, pending
+        received = self.socket.recv_into(self.view[self.end:])
+        if received == 0:
+            raise ConnectionError('Connection closed by the server')
+        self.end += received
+
+    def messages(self):
+        '''Returns the complete messages in the buffer, as a list of
+        (channel, data) pairs. Binary packets have their channel number;
+        RTSP messages have channel None and their raw bytes as data.
+        '''
+        messages = []
+        buffer = self.buffer
+        while self.start < self.end:
+            start = self.start
+            if buffer[start] == INTERLEAVED_MARKER:
+                if self.end - start < INTERLEAVED_HEADER.size:
+                    break
+                _, channel, length = INTERLEAVED_HEADER.unpack_from(buffer, start)
+                end = start + INTERLEAVED_HEADER.size + length
+                if end > self.end:
+                    break
+                messages.append((channel, self.view[start + INTERLEAVED_HEADER.size:end]))
+            else:
+                crlf = buffer.find(b'\r\n\r\n', start, self.end)
+                lf = buffer.find(b'\n\n', start, self.end)
+                if crlf < 0 and lf < 0:
+                    break
+                if lf < 0 or 0 <= crlf < lf:
+                    header_end = crlf + 4
+                else:
+                    header_end = lf + 2
+                match = CONTENT_LENGTH.search(buffer, start, header_end)
+                end = header_end + (int(match.group(1)) if match else 0)
+                if end > self.end:
+                    break
+                messages.append((None, bytes(self.view[start:end])))
+            self.start = end
+        return messages
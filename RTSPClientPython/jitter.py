@@ -0,0 +1,136 @@
+from threading import Lock
+
+SEQ_MOD = 0x10000
+SEQ_HALF = 0x8000
+
+class JitterBuffer:
+    def __init__(self, capacity=1024):
+        '''Creates a reorder buffer for RTP packets. Packets are stored in a
+        ring indexed by their extended (wraparound-free) sequence number,
+        so both insertion and removal take constant time regardless of
+        how deep the buffer is. The capacity is the largest distance, in
+        sequence numbers, between the oldest and newest packet kept.
+        '''
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.lock = Lock()
+        self.count = 0
+        self.head = None       # extended sequence number of the next packet to play
+        self.highest = None    # highest extended sequence number received
+        self.started = False   # whether anything was popped since the last reset
+
+        # statistics counters
+        self.duplicates = 0
+        self.late = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return self.count
+
+    def extend(self, seq_num):
+        '''Converts a 16-bit RTP sequence number into an extended sequence
+        number, choosing the value closest to the highest sequence number
+        seen so far. Returns the number unchanged for the first packet.
+        '''
+        if self.highest is None:
+            return seq_num
+        delta = (seq_num - self.highest) & (SEQ_MOD - 1)
+        if delta >= SEQ_HALF:
+            delta -= SEQ_MOD
+        return self.highest + delta
+
+    def insert(self, seq_num, frame):
+        '''Adds a packet to the buffer. Returns False if the packet was
+        discarded because it is a duplicate or arrived after its slot was
+        already played out.
+        '''
+        with self.lock:
+            ext = self.extend(seq_num)
+            if self.head is None:
+                self.head = self.highest = ext
+            elif ext < self.head:
+                if self.started or self.highest - ext >= self.capacity:
+                    self.late += 1
+                    return False
+                # packet reordered before the first one received, and
+                # playout has not started yet: move the head back
+                self.head = ext
+
+            if ext - self.head >= self.capacity:
+                self.overflows += 1
+                self.skip_to(ext - self.capacity + 1)
+
+            index = ext % self.capacity
+            entry = self.slots[index]
+            if entry is not None and entry[0] == ext:
+                self.duplicates += 1
+                return False
+            self.slots[index] = (ext, frame)
+            self.count += 1
+            if ext > self.highest:
+                self.highest = ext
+            return True
+
+    def skip_to(self, ext):
+        '''Discards every packet older than the given extended sequence
+        number. Must be called with the lock held.
+        '''
+        if ext - self.head >= self.capacity:
+            self.slots = [None] * self.capacity
+            self.count = 0
+        else:
+            for e in range(self.head, ext):
+                index = e % self.capacity
+                if self.slots[index] is not None:
+                    self.slots[index] = None
+                    self.count -= 1
+        self.head = ext
+
+    def pop(self):
+        '''Removes the packet at the head of the buffer and returns a tuple
+        (extended sequence number, packet). The packet is None if the
+        corresponding sequence number was never received (lost or still
+        missing). Returns None if the buffer is empty.
+        '''
+        with self.lock:
+            if self.count == 0:
+                return None
+            ext = self.head
+            index = ext % self.capacity
+            entry = self.slots[index]
+            self.head += 1
+            self.started = True
+            if entry is None or entry[0] != ext:
+                return (ext, None)
+            self.slots[index] = None
+            self.count -= 1
+            return entry
+
+    def peek(self):
+        '''Returns the packet at the head of the buffer without removing it,
+        or None if it has not been received.
+        '''
+        with self.lock:
+            if self.head is None:
+                return None
+            entry = self.slots[self.head % self.capacity]
+            if entry is None or entry[0] != self.head:
+                return None
+            return entry[1]
+
+    def depth(self):
+        '''Number of sequence numbers between the head and the newest
+        packet, including gaps.
+        '''
+        if self.head is None or self.count == 0:
+            return 0
+        return self.highest - self.head + 1
+
+    def clear(self):
+        '''Removes every packet and forgets the sequence number history.'''
+        with self.lock:
+            self.slots = [None] * self.capacity
+            self.count = 0
+            self.head = None
+            self.highest = None
+            self.started = False
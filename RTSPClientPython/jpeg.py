@@ -0,0 +1,222 @@
+import struct
+
+JPEG_PAYLOAD_TYPE = 26
+JPEG_HEADER = struct.Struct('!BBHBBBB')  # type-specific, offset (24 bits), type, Q, width, height
+RESTART_HEADER = struct.Struct('!HH')
+QUANT_HEADER = struct.Struct('!BBH')
+JFIF_SOI = b'\xff\xd8'
+JFIF_EOI = b'\xff\xd9'
+
+# Tables from RFC 2435 appendix A (quantization, in zigzag order) and
+# JPEG annex K (Huffman).
+LUMA_QUANTIZER = (
+    16, 11, 12, 14, 12, 10, 16, 14, 13, 14, 18, 17, 16, 19, 24, 40,
+    26, 24, 22, 22, 24, 49, 35, 37, 29, 40, 58, 51, 61, 60, 57, 51,
+    56, 55, 64, 72, 92, 78, 64, 68, 87, 69, 55, 56, 80, 109, 81, 87,
+    95, 98, 103, 104, 103, 62, 77, 113, 121, 112, 100, 120, 92, 101, 103, 99)
+CHROMA_QUANTIZER = (
+    17, 18, 18, 24, 21, 24, 47, 26, 26, 47, 99, 66, 56, 66, 99, 99) + (99,) * 48
+
+LUM_DC_CODELENS = (0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0)
+LUM_DC_SYMBOLS = tuple(range(12))
+LUM_AC_CODELENS = (0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7d)
+LUM_AC_SYMBOLS = (
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+    0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08, 0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0,
+    0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0a, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+    0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+    0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7,
+    0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5,
+    0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+    0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf1, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa)
+CHM_DC_CODELENS = (0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0)
+CHM_DC_SYMBOLS = tuple(range(12))
+CHM_AC_CODELENS = (0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77)
+CHM_AC_SYMBOLS = (
+    0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+    0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91, 0xa1, 0xb1, 0xc1, 0x09, 0x23, 0x33, 0x52, 0xf0,
+    0x15, 0x62, 0x72, 0xd1, 0x0a, 0x16, 0x24, 0x34, 0xe1, 0x25, 0xf1, 0x17, 0x18, 0x19, 0x1a, 0x26,
+    0x27, 0x28, 0x29, 0x2a, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+    0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+    0x69, 0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+    0x88, 0x89, 0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5,
+    0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3,
+    0xc4, 0xc5, 0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda,
+    0xe2, 0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa)
+
+def make_tables(q):
+    '''Returns the luma and chroma quantization tables (64 bytes each, in
+    zigzag order) for a Q factor between 1 and 99, as in RFC 2435.
+    '''
+    factor = min(max(q, 1), 99)
+    scale = 5000 // factor if q < 50 else 200 - factor * 2
+    def scaled(table):
+        return bytes(min(max((v * scale + 50) // 100, 1), 255) for v in table)
+    return scaled(LUMA_QUANTIZER), scaled(CHROMA_QUANTIZER)
+
+def huffman_segment(codelens, symbols, table_class, table_id):
+    return (b'\xff\xc4' + struct.pack('!HB', 3 + len(codelens) + len(symbols), table_class << 4 | table_id)
+            + bytes(codelens) + bytes(symbols))
+
+HUFFMAN_SEGMENTS = (huffman_segment(LUM_DC_CODELENS, LUM_DC_SYMBOLS, 0, 0)
+                    + huffman_segment(LUM_AC_CODELENS, LUM_AC_SYMBOLS, 1, 0)
+                    + huffman_segment(CHM_DC_CODELENS, CHM_DC_SYMBOLS, 0, 1)
+                    + huffman_segment(CHM_AC_CODELENS, CHM_AC_SYMBOLS, 1, 1))
+
+def make_headers(jpeg_type, width, height, tables, precision=0, dri=0):
+    '''Builds the JFIF headers (SOI up to and including SOS) for a frame with
+    the given RTP/JPEG type, size in pixels and quantization tables.
+    tables holds the luma table followed by the chroma table, each 64
+    entries of 1 byte, or of 2 bytes if the corresponding bit of
+    precision is set.
+    '''
+    luma_size = 128 if precision & 1 else 64
+    header = bytearray(JFIF_SOI)
+    for table_id, (start, size) in enumerate(((0, luma_size), (luma_size, len(tables) - luma_size))):
+        table_precision = 1 if size == 128 else 0
+        header += b'\xff\xdb' + struct.pack('!HB', 3 + size, table_precision << 4 | table_id)
+        header += tables[start:start + size]
+    if dri:
+        header += b'\xff\xdd' + struct.pack('!HH', 4, dri)
+    sampling = 0x21 if jpeg_type & 0x3F == 0 else 0x22
+    header += b'\xff\xc0' + struct.pack('!HBHHB', 17, 8, height, width, 3)
+    header += bytes((0, sampling, 0, 1, 0x11, 1, 2, 0x11, 1))
+    header += HUFFMAN_SEGMENTS
+    header += b'\xff\xda' + struct.pack('!HB', 12, 3) + bytes((0, 0x00, 1, 0x11, 2, 0x11, 0, 63, 0))
+    return bytes(header)
+
+class JPEGDepacketizer:
+    def __init__(self, initial_size=0x40000):
+        '''Reassembles JPEG frames carried over RTP as described in RFC 2435.
+        Packets must be given in sequence order. Fragments are written
+        directly into a buffer that is reused from frame to frame and
+        only grows, and the JFIF headers stripped by the sender are rebuilt
+        (and cached while the stream parameters do not change). Payloads
+        that already are complete JPEG images, as sent by simple servers,
+        are passed through unchanged.
+        '''
+        self.buffer = bytearray(initial_size)
+        self.table_cache = {}
+        self.header_cache = {}
+        self.reset()
+        self.frames = 0
+        self.dropped = 0
+
+    def reset(self):
+        '''Forgets any partially assembled frame.'''
+        self.timestamp = None
+        self.start = 0       # length of the rebuilt headers in the buffer
+        self.next_offset = 0
+        self.broken = True
+
+    def lost(self):
+        '''Signals that a packet is missing, so the frame being assembled is
+        discarded.
+        '''
+        if self.timestamp is not None and not self.broken:
+            self.broken = True
+            self.dropped += 1
+
+    def push(self, frame):
+        '''Adds a packet (payload_type, marker, seq_num, timestamp, payload) to
+        the frame being assembled. Returns the complete frame, with the
+        same fields and a JPEG image as payload, once its last packet is
+        received, and None otherwise.
+        '''
+        payload_type, marker, seq_num, timestamp, payload = frame
+        if payload[:2] == JFIF_SOI:
+            self.lost()
+            self.timestamp = None
+            self.frames += 1
+            return frame
+        if timestamp != self.timestamp:
+            self.lost()
+            self.timestamp = timestamp
+            self.broken = False
+            self.next_offset = 0
+        if self.broken:
+            return None
+
+        try:
+            data, offset = self.parse(payload)
+        except (ValueError, struct.error):
+            self.lost()
+            return None
+        if offset != self.next_offset:
+            # a fragment is missing in the middle of the frame
+            self.lost()
+            return None
+
+        end = self.start + offset + len(data)
+        if end + 2 > len(self.buffer):
+            self.buffer.extend(bytes(max(end + 2, 2 * len(self.buffer)) - len(self.buffer)))
+        self.buffer[self.start + offset:end] = data
+        self.next_offset = offset + len(data)
+        if not marker:
+            return None
+
+        if self.buffer[end - 2:end] != JFIF_EOI:
+            self.buffer[end:end + 2] = JFIF_EOI
+            end += 2
+        self.timestamp = None
+        self.frames += 1
+        return (payload_type, marker, seq_num, timestamp, bytes(memoryview(self.buffer)[:end]))
+
+    def pop(self):
+        '''Returns a frame held back by push, or None: every frame is
+        returned by push itself.
+        '''
+        return None
+
+    def parse(self, payload):
+        '''Parses the RTP/JPEG headers of a packet. Returns the scan data it
+        carries and its offset in the frame. On the first fragment, writes
+        the rebuilt JFIF headers at the start of the buffer.
+        '''
+        _, offset_high, offset_low, jpeg_type, q, width, height = JPEG_HEADER.unpack_from(payload)
+        offset = offset_high << 16 | offset_low
+        pos = JPEG_HEADER.size
+        dri = 0
+        if 64 <= jpeg_type < 128:
+            dri = RESTART_HEADER.unpack_from(payload, pos)[0]
+            pos += RESTART_HEADER.size
+        if offset != 0:
+            return memoryview(payload)[pos:], offset
+
+        precision = 0
+        if q >= 128:
+            _, precision, length = QUANT_HEADER.unpack_from(payload, pos)
+            pos += QUANT_HEADER.size
+            if length:
+                tables = bytes(payload[pos:pos + length])
+                if len(tables) != length:
+                    raise ValueError('Truncated quantization tables')
+                pos += length
+                if q != 255:
+                    self.table_cache[q] = (tables, precision)
+            elif q in self.table_cache:
+                tables, precision = self.table_cache[q]
+            else:
+                raise ValueError('Quantization tables were never received')
+        else:
+            if q not in self.table_cache:
+                luma, chroma = make_tables(q)
+                self.table_cache[q] = (luma + chroma, 0)
+            tables, precision = self.table_cache[q]
+
+        key = (jpeg_type, width, height, dri, precision, tables)
+        header = self.header_cache.get(key)
+        if header is None:
+            if len(self.header_cache) > 16:
+                self.header_cache.clear()
+            header = make_headers(jpeg_type, width * 8, height * 8, tables, precision, dri)
+            self.header_cache[key] = header
+        if len(header) > len(self.buffer):
+            self.buffer.extend(bytes(len(header)))
+        self.buffer[:len(header)] = header
+        self.start = len(header)
+        return memoryview(payload)[pos:], offset
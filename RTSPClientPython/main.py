@@ -1,9 +1,13 @@
 #! /usr/bin/python3
 
+import argparse
 import tkinter as tk
+from queue import SimpleQueue, Empty
 from tkinter import simpledialog, messagebox
-from PIL import ImageTk, Image
 from session import Session, SessionListener
+from decode import DecodePipeline
+from render import RenderPump
+from tracing import LatencyTracer
 from os.path import expanduser, join
 
 class SelectServerDialog(simpledialog.Dialog):
@@ -36,7 +40,7 @@ class SelectServerDialog(simpledialog.Dialog):
     def validate(self):
         try:
             address = (self.ent_server.get(), self.ent_port.get())
-            self.result = Session(address)
+            self.result = Session(address, tracer=self.parent.tracer, recover=self.parent.recover)
             return True
         except Exception as exception:
             messagebox.showerror("Error", str(exception))
@@ -72,19 +76,37 @@ class VideoControlToolbar(tk.Frame):
         self.btn_disconnect.pack(side=tk.LEFT)
 
 class MainWindow(tk.Tk, SessionListener):
-    def __init__(self):
+    def __init__(self, trace=None, recover=False):
         super().__init__()
         self.session = None
+        self.recover = recover
+        self.trace = trace
+        self.tracer = LatencyTracer() if trace else None
+        self.tk_calls = SimpleQueue()
         self.title("RTSP Client")
 
         self.toolbar = VideoControlToolbar(self)
 
-        self.lbl_image = tk.Label(self)
+        # the frame's size does not follow the label's, so that showing a
+        # larger image does not make frames decode larger still
+        self.frm_image = tk.Frame(self, width=640, height=480)
+        self.frm_image.pack_propagate(False)
+        self.frm_image.pack(fill=tk.BOTH, expand=True)
+        self.frm_image.bind('<Configure>', self.image_resized)
+        self.lbl_image = tk.Label(self.frm_image)
         self.lbl_image.pack(fill=tk.BOTH, expand=True)
+        self.decoder = DecodePipeline(self.image_decoded)
+        self.renderer = RenderPump(self.lbl_image)
+        self.renderer.start()
         
         self.lbl_video_name = tk.Label(self)
-        self.video_name_changed(None)
+        self.show_video_name(None)
         self.lbl_video_name.pack()
+
+        self.lbl_status = tk.Label(self)
+        self.lbl_status.pack()
+        self.update_status()
+        self.run_tk_calls()
         
         self.connect()
 
@@ -102,13 +124,51 @@ class MainWindow(tk.Tk, SessionListener):
     def close_file(self):
         return self.session.teardown()
     
+    def in_tk(self, function, *args):
+        '''Has the Tk thread call function. May be called from any thread;
+        the session calls this window's listener methods from its
+        playout thread.
+        '''
+        self.tk_calls.put((function, args))
+
+    def run_tk_calls(self):
+        self.after(16, self.run_tk_calls)
+        while True:
+            try:
+                function, args = self.tk_calls.get_nowait()
+            except Empty:
+                return
+            function(*args)
+
     def exception_thrown(self, exception):
-        messagebox.showerror("Error", str(exception))
+        self.in_tk(messagebox.showerror, "Error", str(exception))
 
     def frame_received(self, frame):
-        self.lbl_image['image'] = self.image = frame.get_image() if frame else None
+        if frame:
+            self.decoder.submit(frame)
+        else:
+            self.renderer.clear()
+
+    def image_decoded(self, frame, image):
+        # called from a decoding thread; the image is shown by the Tk thread
+        self.renderer.post(image, frame.trace)
+
+    def update_status(self):
+        self.lbl_status['text'] = (f'Rendered {self.renderer.rendered}, dropped '
+                                   f'{self.renderer.dropped + self.decoder.dropped}')
+        self.after(1000, self.update_status)
+
+    def image_resized(self, event):
+        # decode frames at the size they are shown, once the window has one
+        border = 2 * sum(int(self.lbl_image[option]) for option in ('borderwidth', 'highlightthickness'))
+        width = event.width - border - 2 * int(self.lbl_image['padx'])
+        height = event.height - border - 2 * int(self.lbl_image['pady'])
+        self.decoder.size = (width, height) if width > 1 and height > 1 else None
 
     def video_name_changed(self, name):
+        self.in_tk(self.show_video_name, name)
+
+    def show_video_name(self, name):
         self.lbl_video_name['text'] = f'Video: {name}' if name else 'No video open'
 
     def connect(self):
@@ -117,12 +177,28 @@ class MainWindow(tk.Tk, SessionListener):
         if self.session is None:
             self.destroy()
         else:
-            self.session.add_listener(self)
+            # every handler only hands work to other threads or to the Tk
+            # thread, so it is called directly from the playout thread
+            self.session.add_listener(self, policy=None)
                 
     def destroy(self):
         if self.session: self.session.close()
+        self.decoder.close()
+        self.renderer.stop()
+        if self.tracer:
+            self.tracer.dump(self.trace)
         super().destroy()
 
-window = MainWindow()
-window.mainloop()
+def main():
+    parser = argparse.ArgumentParser(description='RTSP video client')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='trace the latency of each stage, and write a Chrome trace of the last 30 seconds to FILE on exit')
+    parser.add_argument('--recover', action='store_true',
+                        help='reconnect and resume the video when the connection to the server is lost')
+    options = parser.parse_args()
+    window = MainWindow(options.trace, options.recover)
+    window.mainloop()
+
+if __name__ == '__main__':
+    main()
 
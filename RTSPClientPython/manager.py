@@ -0,0 +1,185 @@
+import asyncio, itertools, time
+from threading import Thread
+
+from asyncrtsp import AsyncSession
+
+class TimerHandle:
+    '''A callback registered with a TimerWheel.'''
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerWheel:
+    def __init__(self, resolution=0.001, slots=512):
+        '''Creates a hashed timer wheel that fires callbacks at monotonic
+        deadlines, rounded down to the given resolution (in seconds), so
+        that they fire less than one tick early rather than up to one
+        tick late; the resolution should stay well below the playout
+        clock's tolerance (5 ms). All
+        streams in a SessionManager share one wheel, so playing out
+        hundreds of streams costs one wakeup per tick instead of one
+        timer per frame per stream.
+        '''
+        self.resolution = resolution
+        self.wheel = [[] for _ in range(slots)]
+        self.origin = time.monotonic()
+        self.current = 0  # next tick to be processed
+        self.count = 0
+        self.wakeup = None
+        self.fired = 0
+
+    def schedule(self, deadline, callback, *args):
+        '''Registers a callback to be called with args at the given deadline.
+        Deadlines in the past fire on the next tick. Returns a handle that
+        can be cancelled.
+        '''
+        tick = max(self.current, int((deadline - self.origin) / self.resolution))
+        handle = TimerHandle(tick, callback, args)
+        self.wheel[tick % len(self.wheel)].append(handle)
+        self.count += 1
+        if self.wakeup:
+            self.wakeup.set()
+        return handle
+
+    def advance(self, now):
+        '''Fires every callback due at or before the given monotonic time.'''
+        last = int((now - self.origin) / self.resolution)
+        while self.current <= last and self.count:
+            index = self.current % len(self.wheel)
+            slot = self.wheel[index]
+            if slot:
+                due = [h for h in slot if h.tick <= self.current]
+                if due:
+                    self.wheel[index] = [h for h in slot if h.tick > self.current]
+                    self.count -= len(due)
+                    for handle in due:
+                        if not handle.cancelled:
+                            self.fired += 1
+                            handle.callback(*handle.args)
+            self.current += 1
+        if not self.count:
+            self.current = max(self.current, last + 1)
+
+    async def run(self):
+        '''Drives the wheel from the running event loop until cancelled.'''
+        self.wakeup = asyncio.Event()
+        while True:
+            self.advance(time.monotonic())
+            if self.count:
+                delay = self.origin + self.current * self.resolution - time.monotonic()
+                await asyncio.sleep(max(0, delay))
+            else:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+class SessionManager:
+    def __init__(self, resolution=0.001, queue_length=1):
+        '''Creates a manager that multiplexes many RTSP sessions over one
+        event loop running in a background thread. Every session has its
+        own RTSP connection, RTP endpoint and jitter buffer, but all of
+        them share the loop's selector and a single playout timer wheel.
+        Listener methods are called from the manager's thread.
+        '''
+        self.wheel = TimerWheel(resolution)
+        self.queue_length = queue_length
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.wheel_task = self.run(self.start_wheel())
+
+    async def start_wheel(self):
+        return asyncio.get_running_loop().create_task(self.wheel.run())
+
+    def run(self, coroutine):
+        '''Runs a coroutine in the manager's loop and waits for its result.'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def add(self, address):
+        '''Connects a new session to the given server and returns its
+        identifier.
+        '''
+        session = AsyncSession(address, self.queue_length, self.wheel)
+        self.run(session.connect())
+        stream_id = next(self.ids)
+        self.sessions[stream_id] = session
+        return stream_id
+
+    def add_listener(self, stream_id, listener):
+        self.loop.call_soon_threadsafe(self.sessions[stream_id].add_listener, listener)
+
+    def open(self, stream_id, video_name):
+        self.run(self.sessions[stream_id].open(video_name))
+
+    def play(self, stream_id):
+        self.run(self.sessions[stream_id].play())
+
+    def pause(self, stream_id):
+        self.run(self.sessions[stream_id].pause())
+
+    def teardown(self, stream_id):
+        self.run(self.sessions[stream_id].teardown())
+
+    def remove(self, stream_id):
+        '''Closes a session and forgets about it.'''
+        session = self.sessions.pop(stream_id)
+        self.run(session.close())
+
+    def open_all(self, streams):
+        '''Opens and plays many streams concurrently. streams is a dict from
+        stream identifier to video name.
+        '''
+        async def start(session, video_name):
+            await session.open(video_name)
+            await session.play()
+        async def start_all():
+            await asyncio.gather(*(start(self.sessions[i], name) for i, name in streams.items()))
+        self.run(start_all())
+
+    def stream_stats(self, stream_id):
+        '''Returns a dict with the counters of one stream.'''
+        connection = self.sessions[stream_id].connection
+        result = connection.stats.snapshot()
+        result['state'] = connection.state
+        return result
+
+    def stats(self):
+        '''Returns a dict with counters aggregated over every stream, and the
+        per-stream counters under the key 'streams'.
+        '''
+        streams = {i: self.stream_stats(i) for i in list(self.sessions)}
+        total = {key: sum(s.get(key, 0) for s in streams.values())
+                 for key in ('packets', 'bytes', 'lost_packets', 'frames', 'late_frames', 'dropped_frames',
+                             'buffered_packets', 'duplicate_packets', 'late_packets', 'bitrate')}
+        total['sessions'] = len(streams)
+        total['playing'] = sum(1 for s in streams.values() if s['state'] == 'PLAYING')
+        total['timers_fired'] = self.wheel.fired
+        total['streams'] = streams
+        return total
+
+    def close(self):
+        '''Closes every session and stops the manager's loop.'''
+        for stream_id in list(self.sessions):
+            try:
+                self.remove(stream_id)
+            except Exception:
+                pass
+        self.run(self.stop_wheel())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def stop_wheel(self):
+        self.wheel_task.cancel()
+        try:
+            await self.wheel_task
+        except asyncio.CancelledError:
+            pass
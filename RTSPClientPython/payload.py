@@ -0,0 +1,77 @@
+from h264 import H264Depacketizer, H264_PAYLOAD_TYPE
+from jpeg import JPEGDepacketizer, JPEG_PAYLOAD_TYPE
+
+# Depacketizer class (or any callable returning one) for each payload type.
+# Dynamic payload types (96-127) are assigned per stream by the server; the
+# entries here are the usual ones and can be changed with
+# register_depacketizer.
+DEPACKETIZERS = {
+    JPEG_PAYLOAD_TYPE: JPEGDepacketizer,
+    H264_PAYLOAD_TYPE: H264Depacketizer,
+}
+
+def register_depacketizer(payload_type, factory):
+    '''Sets the depacketizer used for a payload type by the streams set up
+    from now on. A factory of None removes it, so packets of that type are
+    passed on unchanged.
+    '''
+    if factory is None:
+        DEPACKETIZERS.pop(payload_type, None)
+    else:
+        DEPACKETIZERS[payload_type] = factory
+
+class DepacketizerRegistry:
+    def __init__(self, factories=None):
+        '''Routes the packets of a stream to a depacketizer for their payload
+        type, creating it on first use. Every depacketizer has the
+        interface of JPEGDepacketizer: push(frame) returns a complete frame
+        or None, pop() returns a frame completed by the same push but held
+        back, if any, and lost() signals a missing packet. Packets of payload
+        types without a depacketizer are passed on unchanged, one frame
+        per packet.
+        '''
+        self.factories = dict(DEPACKETIZERS if factories is None else factories)
+        self.active = {}
+        self.current = None
+        self.passed = 0
+
+    def get(self, payload_type):
+        depacketizer = self.active.get(payload_type)
+        if depacketizer is None:
+            factory = self.factories.get(payload_type)
+            if factory is None:
+                return None
+            depacketizer = self.active[payload_type] = factory()
+        return depacketizer
+
+    def push(self, frame):
+        depacketizer = self.get(frame[0])
+        if depacketizer is not self.current and self.current is not None:
+            # the payload type changed: the frame in progress cannot end
+            self.current.lost()
+        self.current = depacketizer
+        if depacketizer is None:
+            self.passed += 1
+            return frame
+        return depacketizer.push(frame)
+
+    def pop(self):
+        if self.current is None:
+            return None
+        return self.current.pop()
+
+    def lost(self):
+        if self.current is not None:
+            self.current.lost()
+
+    def reset(self):
+        for depacketizer in self.active.values():
+            depacketizer.reset()
+
+    @property
+    def frames(self):
+        return self.passed + sum(d.frames for d in self.active.values())
+
+    @property
+    def dropped(self):
+        return sum(d.dropped for d in self.active.values())
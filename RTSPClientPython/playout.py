@@ -0,0 +1,306 @@
+import math, time
+from collections import deque
+from threading import Lock
+
+from jitter import SEQ_HALF, SEQ_MOD
+
+TS_MOD = 0x100000000
+TS_HALF = 0x80000000
+
+# Clock rates commonly used by RTP payload formats. Inferred rates close to
+# one of these are snapped to it.
+KNOWN_CLOCK_RATES = (1000, 8000, 16000, 32000, 44100, 48000, 90000)
+
+def unwrap_timestamp(timestamp, reference):
+    '''Converts a 32-bit RTP timestamp into an extended timestamp, choosing
+    the value closest to the (already extended) reference.
+    '''
+    delta = (timestamp - reference) & (TS_MOD - 1)
+    if delta >= TS_HALF:
+        delta -= TS_MOD
+    return reference + delta
+
+def snap_clock_rate(rate):
+    '''Rounds a measured clock rate to the nearest well-known rate, if it is
+    within 15% of it.
+    '''
+    for known in KNOWN_CLOCK_RATES:
+        if abs(rate / known - 1) < 0.15:
+            return known
+    return max(1, round(rate))
+
+class PlayoutClock:
+    def __init__(self, default_interval=1/25, clock_rate=None, inference_window=1.0,
+                 tolerance=0.005, max_lateness=1.0, max_wait=2.0):
+        '''Schedules frame playout from RTP timestamps. Each frame gets a
+        deadline on the monotonic clock computed from the timestamp
+        difference to the previous frame, and the player sleeps only
+        until that deadline, so time spent decoding and presenting frames
+        does not accumulate as drift.
+
+        - default_interval: Seconds between frames with different
+          timestamps while the clock rate is still unknown.
+        - clock_rate: RTP timestamp units per second. If None, it is
+          inferred from the arrival time of packets over the first
+          inference_window seconds.
+        - tolerance: Frames delivered later than this (in seconds) after
+          their deadline are counted as late.
+        - max_lateness, max_wait: A frame later than max_lateness, or due
+          more than max_wait in the future (a timestamp discontinuity),
+          resynchronizes the clock instead of skipping or stalling.
+        '''
+        self.default_interval = default_interval
+        self.clock_rate = clock_rate
+        self.fixed_rate = clock_rate is not None
+        self.inference_window = inference_window
+        self.tolerance = tolerance
+        self.max_lateness = max_lateness
+        self.max_wait = max_wait
+        self.on_frame = None
+
+        # clock rate inference
+        self.obs_start = None
+        self.obs_ts = None
+
+        # frame rate inference, in timestamp units between frames
+        self.intervals = deque(maxlen=32)
+
+        self.restart()
+        self.frames = 0
+        self.late_frames = 0
+        self.early_frames = 0
+        self.last_offset = 0.0
+        self.max_offset = 0.0
+
+    def restart(self):
+        '''Forgets the current schedule, so the next frame plays immediately.
+        Used whenever playout (re)starts after buffering.
+        '''
+        self.last_deadline = None
+        self.last_ts = None
+
+    def observe(self, timestamp, arrival=None):
+        '''Records the arrival of a packet with the given RTP timestamp. Used
+        to infer the clock rate of the stream if it was not given.
+        '''
+        if self.fixed_rate:
+            return
+        now = time.monotonic() if arrival is None else arrival
+        if self.obs_start is None:
+            self.obs_start = (now, timestamp)
+            self.obs_ts = timestamp
+            return
+        ts = unwrap_timestamp(timestamp, self.obs_ts)
+        if ts > self.obs_ts:
+            self.obs_ts = ts
+        elapsed = now - self.obs_start[0]
+        if elapsed >= self.inference_window and self.obs_ts > self.obs_start[1]:
+            self.clock_rate = snap_clock_rate((self.obs_ts - self.obs_start[1]) / elapsed)
+            self.fixed_rate = True
+
+    @property
+    def frame_rate(self):
+        '''Frame rate inferred from the timestamps of played frames, or None
+        if it is not known yet.
+        '''
+        if not self.clock_rate or not self.intervals:
+            return None
+        median = sorted(self.intervals)[len(self.intervals) // 2]
+        return self.clock_rate / median
+
+    def deadline(self, timestamp):
+        '''Returns the monotonic time at which the frame with the given
+        timestamp should be played. Frames must be passed in playout order.
+        '''
+        now = time.monotonic()
+        if self.last_deadline is None:
+            self.last_deadline = now
+            self.last_ts = timestamp
+            return now
+
+        ts = unwrap_timestamp(timestamp, self.last_ts)
+        delta = ts - self.last_ts
+        self.last_ts = ts
+        if delta > 0:
+            self.intervals.append(delta)
+            if self.clock_rate:
+                self.last_deadline += delta / self.clock_rate
+            else:
+                self.last_deadline += self.default_interval
+
+        if now - self.last_deadline > self.max_lateness or self.last_deadline - now > self.max_wait:
+            self.last_deadline = now
+        return self.last_deadline
+
+    def wait(self, timestamp, event=None):
+        '''Sleeps until the deadline of the frame with the given timestamp.
+        If an event is given, the wait is interrupted when it is set.
+        Returns the deadline.
+        '''
+        deadline = self.deadline(timestamp)
+        self.sleep_until(deadline, event)
+        return deadline
+
+    def sleep_until(self, deadline, event=None):
+        '''Sleeps until the given monotonic time, or until the event (if
+        any) is set.
+        '''
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            if event is not None:
+                event.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def delivered(self, deadline, seq_num=None):
+        '''Records that a frame was handed to the session, and how far from
+        its deadline that happened. Positive offsets are late deliveries.
+        Returns the offset in seconds.
+        '''
+        offset = time.monotonic() - deadline
+        self.frames += 1
+        self.last_offset = offset
+        if offset > self.tolerance:
+            self.late_frames += 1
+        elif offset < -self.tolerance:
+            self.early_frames += 1
+        if offset > self.max_offset:
+            self.max_offset = offset
+        if self.on_frame:
+            self.on_frame(seq_num, offset)
+        return offset
+
+class PlayoutDelay:
+    def __init__(self, min_delay=0.02, max_delay=1.0, jitter_factor=4.0, margin=0.005,
+                 decay=10.0, shrink_rate=0.05, underrun_step=0.05, base_window=10.0):
+        '''Adaptive playout delay. Frames are scheduled on the sender's
+        clock: a frame plays at its RTP time plus the smallest transit
+        time seen recently (base_window seconds) plus a delay sized from
+        the measured network conditions:
+
+            margin + jitter_factor * jitter + reorder depth * packet spacing
+
+        where jitter is the RFC 3550 interarrival jitter. Peaks of jitter
+        and reordering are held and forgotten over decay seconds, so the
+        delay grows at once on bursts and shrinks back, at most
+        shrink_rate seconds per second, when the network calms down. Each
+        underrun adds underrun_step seconds, also forgotten over decay
+        seconds. The delay always stays between min_delay and max_delay.
+        '''
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter_factor = jitter_factor
+        self.margin = margin
+        self.decay = decay
+        self.shrink_rate = shrink_rate
+        self.underrun_step = underrun_step
+        self.base_window = base_window
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        self.clock_rate = None
+        self.ts_ref = None
+        self.last_transit = None
+        self.jitter = 0.0
+        self.jitter_peak = 0.0
+        self.highest_seq = None
+        self.reorder_depth = 0.0
+        self.spacing = 0.0         # mean seconds between packets
+        self.frame_interval = None # mean seconds between frames
+        self.last_arrival = None
+        self.last_marker_ts = None
+        self.boost = 0.0
+        self.base = deque()        # (arrival, transit), increasing transit
+        self.marker_seen = False
+        self.current = None
+        self.last_update = None
+        self.underruns = 0
+
+    def observe(self, seq_num, timestamp, arrival, marker, clock_rate):
+        '''Records one received packet. Nothing is measured until the clock
+        rate of the stream is known.
+        '''
+        if not clock_rate:
+            return
+        with self.lock:
+            self.clock_rate = clock_rate
+            if self.ts_ref is None:
+                self.ts_ref = timestamp
+            ts = unwrap_timestamp(timestamp, self.ts_ref)
+            if ts > self.ts_ref:
+                self.ts_ref = ts
+            transit = arrival - ts / clock_rate
+
+            if self.last_arrival is not None:
+                factor = math.exp(-(arrival - self.last_arrival) / self.decay)
+                self.jitter_peak *= factor
+                self.reorder_depth *= factor
+                self.boost *= factor
+                self.spacing += (arrival - self.last_arrival - self.spacing) / 16
+            self.last_arrival = arrival
+            if self.last_transit is not None:
+                self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+            self.last_transit = transit
+            self.jitter_peak = max(self.jitter_peak, self.jitter)
+
+            if self.highest_seq is None:
+                self.highest_seq = seq_num
+            else:
+                delta = (seq_num - self.highest_seq) & (SEQ_MOD - 1)
+                if delta >= SEQ_HALF:
+                    self.reorder_depth = max(self.reorder_depth, SEQ_MOD - delta)
+                else:
+                    self.highest_seq = seq_num
+
+            if marker:
+                if self.last_marker_ts is not None and ts > self.last_marker_ts:
+                    interval = (ts - self.last_marker_ts) / clock_rate
+                    if self.frame_interval is None:
+                        self.frame_interval = interval
+                    else:
+                        self.frame_interval += (interval - self.frame_interval) / 8
+                self.last_marker_ts = ts
+                if not self.marker_seen:
+                    # frames are only complete with their last packet, so
+                    # the base transit is measured on those alone
+                    self.marker_seen = True
+                    self.base.clear()
+            if marker or not self.marker_seen:
+                base = self.base
+                while base and base[-1][1] >= transit:
+                    base.pop()
+                base.append((arrival, transit))
+                while base[0][0] < arrival - self.base_window:
+                    base.popleft()
+
+    @property
+    def target(self):
+        '''Playout delay in seconds for the current network conditions.'''
+        delay = (self.margin + self.jitter_factor * self.jitter_peak +
+                 self.reorder_depth * self.spacing + self.boost)
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def deadline(self, timestamp, now=None):
+        '''Returns the monotonic time at which the frame with the given RTP
+        timestamp should be played, or None if nothing is known about
+        the stream yet (the frame should be played at once).
+        '''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self.base:
+                return None
+            target = self.target
+            if self.current is None or target > self.current:
+                self.current = target
+            else:
+                self.current = max(target, self.current - self.shrink_rate * (now - self.last_update))
+            self.last_update = now
+            ts = unwrap_timestamp(timestamp, self.ts_ref)
+            return ts / self.clock_rate + self.base[0][1] + self.current
+
+    def underrun(self):
+        '''Records that playout ran out of frames, raising the delay.'''
+        with self.lock:
+            self.underruns += 1
+            self.boost = min(self.max_delay, self.boost + self.underrun_step)
@@ -0,0 +1,104 @@
+import selectors, socket, struct
+
+# Linux reports the number of datagrams dropped because the socket's receive
+# buffer was full as ancillary data, once this option is enabled.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)
+DROP_COUNTER = struct.Struct('=I')
+
+class RTPReceiver:
+    def __init__(self, sock, packet_size=0x10000, batch_size=16, receive_buffer=None):
+        '''Receives datagrams in batches into buffers allocated once, instead
+        of allocating a new bytes object per packet.
+
+        - sock: A bound datagram socket. It is switched to non-blocking
+          mode; its previous timeout applies to the wait for the first
+          packet of each batch.
+        - packet_size: Largest datagram expected. Longer datagrams are
+          truncated and counted in `truncated`.
+        - batch_size: Most datagrams returned by one call to recv_batch.
+        - receive_buffer: If given, the requested SO_RCVBUF size in bytes.
+          The size actually granted by the kernel is in `receive_buffer`.
+        '''
+        self.socket = sock
+        self.timeout = sock.gettimeout()
+        sock.setblocking(False)
+        # select.select cannot wait on descriptors above FD_SETSIZE (1024)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.packet_size = packet_size
+        self.buffers = [bytearray(packet_size) for _ in range(batch_size)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.packets = 0
+        self.batches = 0
+        self.truncated = 0
+        self.kernel_drops = 0
+
+        # read once: the socket may be closed before the last statistics
+        self.receive_buffer = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if receive_buffer:
+            self.set_receive_buffer(receive_buffer)
+
+        self.ancillary_size = 0
+        self.has_recvmsg = hasattr(sock, 'recvmsg_into')
+        if self.has_recvmsg:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self.ancillary_size = socket.CMSG_SPACE(DROP_COUNTER.size)
+            except OSError:
+                pass
+
+    def set_receive_buffer(self, size):
+        '''Requests a kernel receive buffer of the given size in bytes.
+        Returns the size granted, which may be capped by the system (on
+        Linux, by net.core.rmem_max) or doubled for bookkeeping.
+        '''
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        self.receive_buffer = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        return self.receive_buffer
+
+    def receive(self, index, flags):
+        '''Receives one datagram into the buffer at the given index. Returns
+        its length.
+        '''
+        if not self.has_recvmsg:
+            return self.socket.recv_into(self.buffers[index], self.packet_size, flags)
+        nbytes, ancdata, msg_flags, _ = self.socket.recvmsg_into(
+            [self.buffers[index]], self.ancillary_size, flags)
+        if msg_flags & getattr(socket, 'MSG_TRUNC', 0):
+            self.truncated += 1
+        for level, kind, data in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= DROP_COUNTER.size:
+                # the kernel reports a running total for the socket
+                self.kernel_drops = DROP_COUNTER.unpack_from(data)[0]
+        return nbytes
+
+    def wait(self):
+        '''Waits until a datagram can be read, raising socket.timeout if none
+        arrives within the timeout.
+        '''
+        if not self.selector.select(self.timeout):
+            raise socket.timeout('timed out')
+
+    def close(self):
+        '''Releases the selector. The socket is left to its owner.'''
+        self.selector.close()
+
+    def recv_batch(self):
+        '''Waits for a datagram and then collects any others already queued,
+        up to the batch size, without blocking again. Returns a list of
+        memoryviews over the received data. The views are only valid until
+        the next call, as the same buffers are reused.
+        '''
+        packets = []
+        for index in range(len(self.buffers)):
+            try:
+                nbytes = self.receive(index, 0)
+            except (BlockingIOError, InterruptedError):
+                if packets:
+                    break
+                self.wait()
+                nbytes = self.receive(index, 0)
+            packets.append(self.views[index][:nbytes])
+        self.packets += len(packets)
+        self.batches += 1
+        return packets
@@ -0,0 +1,297 @@
+import mmap, os, struct, time
+from collections import deque
+from threading import Thread, Condition
+
+from playout import unwrap_timestamp
+from session import SessionListener
+
+# Index entry of one frame: extended RTP timestamp, sequence number, offset
+# and length in the data file, payload type and marker.
+INDEX_ENTRY = struct.Struct('<qIQIBB')
+INDEX_MAGIC = b'RTPIDX1\n'
+
+def segment_paths(directory, number):
+    '''Returns the data and index file paths of a segment.'''
+    base = os.path.join(directory, '%06d' % number)
+    return base + '.dat', base + '.idx'
+
+def write_all(file, data):
+    '''Writes all of data to an unbuffered file, whose write() may write
+    only part of it.
+    '''
+    with memoryview(data) as view:
+        written = 0
+        while written < len(view):
+            written += file.write(view[written:])
+
+class Recorder(SessionListener):
+    def __init__(self, directory, segment_size=0x10000000, segment_seconds=None,
+                 write_size=0x100000, flush_interval=0.5, max_pending=256):
+        '''Session listener that records the frames played to segmented files
+        in a directory. Each segment is a data file with the frames one
+        after another and an index file with a fixed-size entry per frame
+        (INDEX_ENTRY), so a reader can seek by timestamp without scanning.
+
+        Frames are only queued by frame_received; a background thread
+        gathers them into writes of about write_size bytes, so the playout
+        thread never waits for the disk and many streams can share one.
+        Buffered frames are written at least every flush_interval seconds.
+        If the disk falls behind by more than max_pending frames, new
+        frames are dropped and counted.
+
+        - segment_size: Bytes of frame data after which a new segment is
+          started.
+        - segment_seconds: If set, a new segment is also started after
+          this many seconds of recording.
+        '''
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_seconds = segment_seconds
+        self.write_size = write_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+
+        self.queue = deque()
+        self.condition = Condition()
+        self.closed = False
+        self.ts_ref = None
+        self.segment = None
+        self.data_file = None
+        self.index_file = None
+        self.segment_bytes = 0
+        self.segment_start = None
+
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.segments = 0
+        self.exception = None
+
+        existing = [int(name[:-4]) for name in os.listdir(directory)
+                    if name.endswith('.idx') and name[:-4].isdigit()]
+        self.next_segment = max(existing) + 1 if existing else 0
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def frame_received(self, frame):
+        if frame is None:
+            # stream closed: write out what is buffered
+            with self.condition:
+                self.queue.append(None)
+                self.condition.notify()
+            return
+        with self.condition:
+            if len(self.queue) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.queue.append(frame)
+            self.condition.notify()
+
+    def run(self):
+        data = bytearray()
+        index = bytearray()
+        deadline = None
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.closed:
+                        timeout = None if deadline is None else deadline - time.monotonic()
+                        if timeout is not None and timeout <= 0:
+                            break
+                        self.condition.wait(timeout)
+                    frames = list(self.queue)
+                    self.queue.clear()
+                    closed = self.closed
+                flush = closed or (deadline is not None and time.monotonic() >= deadline)
+                for frame in frames:
+                    if frame is None:
+                        flush = True
+                        continue
+                    if self.segment is None or self.segment_full():
+                        self.write(data, index)
+                        self.open_segment()
+                    self.add(frame, data, index)
+                    if len(data) >= self.write_size:
+                        self.write(data, index)
+                if data and deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if flush:
+                    self.write(data, index)
+                if not data:
+                    deadline = None
+                if closed:
+                    break
+        except OSError as exception:
+            self.exception = exception
+        finally:
+            self.close_segment()
+
+    def segment_full(self):
+        if self.segment_bytes >= self.segment_size:
+            return True
+        return (self.segment_seconds is not None and
+                time.monotonic() - self.segment_start >= self.segment_seconds)
+
+    def add(self, frame, data, index):
+        '''Appends a frame to the pending data and index buffers.'''
+        if self.ts_ref is None:
+            self.ts_ref = frame.timestamp
+        timestamp = unwrap_timestamp(frame.timestamp, self.ts_ref)
+        if timestamp > self.ts_ref:
+            self.ts_ref = timestamp
+        payload = frame.payload
+        index += INDEX_ENTRY.pack(timestamp, frame.sequence_number & 0xFFFFFFFF,
+                                  self.segment_bytes, len(payload),
+                                  frame.payload_type & 0xFF, 1 if frame.marker else 0)
+        data += payload
+        self.segment_bytes += len(payload)
+        self.frames += 1
+        self.bytes += len(payload)
+
+    def write(self, data, index):
+        '''Writes the pending buffers. The data goes first, so the index on
+        disk never points past the end of the data file.
+        '''
+        if data:
+            write_all(self.data_file, data)
+            data.clear()
+        if index:
+            write_all(self.index_file, index)
+            index.clear()
+
+    def open_segment(self):
+        self.close_segment()
+        self.segment = self.next_segment
+        self.next_segment += 1
+        data_path, index_path = segment_paths(self.directory, self.segment)
+        self.data_file = open(data_path, 'wb', buffering=0)
+        self.index_file = open(index_path, 'wb', buffering=0)
+        write_all(self.index_file, INDEX_MAGIC)
+        self.segment_bytes = 0
+        self.segment_start = time.monotonic()
+        self.segments += 1
+
+    def close_segment(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = self.index_file = None
+
+    def close(self):
+        '''Writes every queued frame and stops the writer thread.'''
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+class Segment:
+    def __init__(self, directory, number):
+        '''One recorded segment, with its data and index files mapped in
+        memory. Only the frames whose index entries were complete when the
+        segment was opened are visible.
+        '''
+        self.number = number
+        data_path, index_path = segment_paths(directory, number)
+        with open(index_path, 'rb') as index_file:
+            magic = index_file.read(len(INDEX_MAGIC))
+            # an empty index is a segment just being created
+            if magic and magic != INDEX_MAGIC[:len(magic)]:
+                raise ValueError(f'{index_path} is not a recording index')
+            size = os.fstat(index_file.fileno()).st_size
+            self.count = max(0, size - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+            self.index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+        with open(data_path, 'rb') as data_file:
+            size = os.fstat(data_file.fileno()).st_size
+            self.data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self.data) if self.data is not None else None
+        # a frame whose data was not yet written when the files were mapped
+        while self.count and self.entry(self.count - 1)[2] + self.entry(self.count - 1)[3] > size:
+            self.count -= 1
+
+    def entry(self, i):
+        '''Returns (timestamp, sequence number, offset, length, payload type,
+        marker) of the i-th frame.
+        '''
+        return INDEX_ENTRY.unpack_from(self.index, len(INDEX_MAGIC) + i * INDEX_ENTRY.size)
+
+    def timestamp(self, i):
+        return struct.unpack_from('<q', self.index, len(INDEX_MAGIC) + i * INDEX_ENTRY.size)[0]
+
+    def find(self, timestamp):
+        '''Index of the last frame at or before the timestamp (0 if every
+        frame is later).
+        '''
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return max(0, low - 1)
+
+    def frame(self, i):
+        '''Returns (timestamp, sequence number, payload type, marker,
+        payload) of the i-th frame. The payload is a memoryview over the
+        mapped file, not a copy.
+        '''
+        timestamp, seq_num, offset, length, payload_type, marker = self.entry(i)
+        return timestamp, seq_num, payload_type, bool(marker), self.view[offset:offset + length]
+
+    def close(self):
+        '''Unmaps the files. Frames still referenced keep their mapping
+        alive until they are released.
+        '''
+        try:
+            if self.view is not None:
+                self.view.release()
+            for mapping in (self.index, self.data):
+                if mapping is not None:
+                    mapping.close()
+        except BufferError:
+            pass
+
+class RecordingReader:
+    def __init__(self, directory):
+        '''Reads a recording made by Recorder. Segments are memory-mapped, so
+        seeking is a binary search over the index and frames are served
+        without copying. Call refresh() to see frames recorded since.
+        '''
+        self.directory = directory
+        self.segments = []
+        self.refresh()
+
+    def refresh(self):
+        '''Maps the segments again, picking up new frames and segments.'''
+        self.close()
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                         if name.endswith('.idx') and name[:-4].isdigit())
+        self.segments = [s for s in (Segment(self.directory, n) for n in numbers) if s.count]
+
+    def __len__(self):
+        return sum(s.count for s in self.segments)
+
+    def seek(self, timestamp):
+        '''Returns the position (segment, frame) of the last frame at or
+        before the given extended RTP timestamp.
+        '''
+        for i in range(len(self.segments) - 1, -1, -1):
+            if self.segments[i].timestamp(0) <= timestamp or i == 0:
+                return i, self.segments[i].find(timestamp)
+        return 0, 0
+
+    def frames(self, timestamp=None):
+        '''Yields every frame, as returned by Segment.frame, starting at the
+        last frame at or before the given timestamp, or at the beginning.
+        '''
+        segment, i = self.seek(timestamp) if timestamp is not None else (0, 0)
+        for s in self.segments[segment:]:
+            for j in range(i, s.count):
+                yield s.frame(j)
+            i = 0
+
+    def close(self):
+        for s in self.segments:
+            s.close()
+        self.segments = []
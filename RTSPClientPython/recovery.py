@@ -0,0 +1,153 @@
+import random, time
+from collections import deque
+from threading import Thread, Event, Lock
+
+class Backoff:
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.1):
+        '''Exponential backoff between reconnection attempts: the first one
+        is immediate, then the delay starts at initial seconds and is
+        multiplied by factor up to maximum, give or take a random jitter
+        fraction so that many clients do not retry in step.
+        '''
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        if attempt == 0:
+            return 0.0
+        delay = min(self.maximum, self.initial * self.factor ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+class StreamRebase:
+    def __init__(self, last_seq, last_timestamp, resume_timestamp):
+        '''Renumbers the packets of a stream set up again after a connection
+        loss, so that they follow the packets received before it and the
+        jitter buffer, the depacketizer and the playout clock can keep
+        their state. The new server session picks its own sequence
+        numbers, timestamps and SSRC: sequence numbers are shifted to
+        continue from last_seq, and timestamps so that the first packet
+        lands on resume_timestamp, the last frame played, from where the
+        new stream was requested. Packets of frames up to last_timestamp
+        are already buffered and are dropped.
+        '''
+        self.last_seq = last_seq
+        self.last_timestamp = last_timestamp
+        self.resume_timestamp = resume_timestamp
+        self.seq_offset = None
+        self.ts_offset = None
+        self.skipped = 0
+        self.resumed = None  # monotonic time of the first packet kept
+
+    def translate(self, packet):
+        '''Renumbers a parsed packet in place. Returns False if it must be
+        dropped.
+        '''
+        if self.ts_offset is None:
+            self.ts_offset = 0 if self.resume_timestamp is None else self.resume_timestamp - packet.timestamp
+        timestamp = (packet.timestamp + self.ts_offset) & 0xFFFFFFFF
+        if self.last_timestamp is not None and (timestamp - self.last_timestamp) & 0xFFFFFFFF >= 0x80000000 \
+                or timestamp == self.last_timestamp:
+            self.skipped += 1
+            return False
+        if self.seq_offset is None:
+            self.seq_offset = 0 if self.last_seq is None else self.last_seq + 1 - packet.sequence_number
+            self.resumed = time.monotonic()
+        packet.sequence_number = (packet.sequence_number + self.seq_offset) & 0xFFFF
+        packet.timestamp = timestamp
+        return True
+
+class SessionRecovery:
+    def __init__(self, session, backoff=None, max_attempts=10):
+        '''Brings a session's stream back after its connection is lost:
+        reconnects, with backoff between attempts, sets the stream up
+        again and resumes playing where it stopped (see
+        Connection.reconnect). Listeners are told when the connection is
+        lost and when it is recovered; after max_attempts attempts
+        without the stream resuming (None for no limit), recovery is
+        given up and a ConnectionError thrown to them.
+        '''
+        self.session = session
+        self.backoff = backoff or Backoff()
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = None
+        self.attempt = 0          # attempts since the stream last resumed
+        self.given_up = None      # connection recovery was given up for
+        self.last_rebase = None
+
+        self.losses = 0
+        self.recoveries = 0
+        self.attempts = 0
+        self.failures = 0
+        self.times = deque(maxlen=100)  # seconds from loss to the first packet played again
+
+    def trigger(self, connection, reason):
+        '''Starts recovering a lost connection, unless that is under way.'''
+        with self.lock:
+            if self.stopped.is_set() or connection is self.given_up:
+                return
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.losses += 1
+            if self.last_rebase is not None and self.last_rebase.resumed is not None:
+                # the previous recovery worked: this is a new loss
+                self.attempt = 0
+            self.thread = Thread(target=self.run, args=(connection, reason), daemon=True)
+            self.thread.start()
+
+    def run(self, connection, reason):
+        lost_at = time.monotonic()
+        if connection.state == 'PLAYING':
+            # the time to notice the loss counts too
+            lost_at = min(lost_at, connection.last_arrival)
+        self.session.notify('connection_lost', reason)
+        while True:
+            if self.max_attempts is not None and self.attempt >= self.max_attempts:
+                self.failures += 1
+                self.given_up = connection
+                self.session.notify('exception_thrown',
+                                    ConnectionError(f'Could not recover the connection: {reason}'))
+                return
+            if self.stopped.wait(self.backoff.delay(self.attempt)):
+                return
+            if connection is not self.session.connection:
+                return
+            self.attempt += 1
+            self.attempts += 1
+            try:
+                connection.reconnect()
+            except Exception as exception:
+                reason = exception
+                continue
+            break
+        self.recoveries += 1
+        self.last_rebase = connection.rebase
+        self.session.notify('connection_recovered', time.monotonic() - lost_at)
+        Thread(target=self.measure, args=(connection.rebase, lost_at), daemon=True).start()
+
+    def measure(self, rebase, lost_at):
+        '''Records the time to recover once packets flow again.'''
+        while not self.stopped.is_set() and self.last_rebase is rebase:
+            if rebase is None or rebase.resumed is not None:
+                self.times.append((rebase.resumed if rebase else time.monotonic()) - lost_at)
+                return
+            if self.stopped.wait(0.05):
+                return
+
+    def statistics(self):
+        times = list(self.times)
+        return {
+            'losses': self.losses,
+            'recoveries': self.recoveries,
+            'attempts': self.attempts,
+            'failures': self.failures,
+            'recovering': self.thread is not None and self.thread.is_alive(),
+            'mean_time_to_recover': sum(times) / len(times) if times else None,
+            'last_time_to_recover': times[-1] if times else None,
+        }
+
+    def close(self):
+        self.stopped.set()
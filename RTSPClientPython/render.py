@@ -0,0 +1,101 @@
+from threading import Lock
+
+from PIL import ImageTk
+
+CLEAR = object()  # posted to blank the display
+
+class FrameMailbox:
+    def __init__(self):
+        '''Single-slot mailbox holding the latest frame posted by any thread.
+        Posting replaces a frame not yet taken, which is then counted as
+        dropped, so the reader only ever sees the newest one.
+        '''
+        self.lock = Lock()
+        self.item = None
+        self.posted = 0
+        self.dropped = 0
+
+    def post(self, item):
+        with self.lock:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.posted += 1
+
+    def take(self):
+        '''Returns the latest item and empties the slot, or None.'''
+        with self.lock:
+            item, self.item = self.item, None
+            return item
+
+class RenderPump:
+    def __init__(self, label, interval=16):
+        '''Shows images on a Tk label from the Tk thread. Other threads post
+        PIL images with post(); every interval milliseconds the Tk main
+        loop takes the latest one (after()) and pastes it into a single
+        PhotoImage, which is only replaced when the image size or mode
+        changes.
+        '''
+        self.label = label
+        self.interval = interval
+        self.mailbox = FrameMailbox()
+        self.photo = None
+        self.mode = None
+        self.rendered = 0
+        self.allocated = 0
+        self.job = None
+
+    @property
+    def dropped(self):
+        return self.mailbox.dropped
+
+    def start(self):
+        if self.job is None:
+            self.job = self.label.after(self.interval, self.pump)
+
+    def stop(self):
+        if self.job is not None:
+            self.label.after_cancel(self.job)
+            self.job = None
+
+    def post(self, image, trace=None):
+        '''Hands an image to the Tk thread. May be called from any thread.
+        The frame's trace, if given, is stamped when the image is shown.
+        '''
+        self.mailbox.post((image, trace))
+
+    def clear(self):
+        '''Blanks the label at the next pump. May be called from any thread.'''
+        self.mailbox.post(CLEAR)
+
+    def pump(self):
+        self.job = self.label.after(self.interval, self.pump)
+        item = self.mailbox.take()
+        if item is None:
+            return
+        if item is CLEAR:
+            self.label['image'] = ''
+            self.photo = None
+            return
+        image, trace = item
+        if image.mode not in ('RGB', 'RGBA', 'L', '1'):
+            image = image.convert('RGB')
+        photo = self.photo
+        if photo is None or photo.width() != image.width or photo.height() != image.height or self.mode != image.mode:
+            self.photo = ImageTk.PhotoImage(image)
+            self.mode = image.mode
+            self.allocated += 1
+            self.label['image'] = self.photo
+        else:
+            photo.paste(image)
+        self.rendered += 1
+        if trace is not None:
+            trace.mark('rendered')
+
+    def statistics(self):
+        return {
+            'rendered': self.rendered,
+            'dropped': self.mailbox.dropped,
+            'posted': self.mailbox.posted,
+            'images_allocated': self.allocated,
+        }
@@ -0,0 +1,115 @@
+import struct
+
+RTP_VERSION = 2
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_HEADER_SIZE = RTP_HEADER.size
+EXTENSION_HEADER = struct.Struct('!HH')
+
+class RTPParseError(Exception):
+    pass
+
+class RTPPacket:
+    '''A parsed RTP packet (RFC 3550). The payload is a memoryview over the
+    data the packet was parsed from, with the CSRC list, header extension
+    and padding removed.
+    '''
+    __slots__ = ('payload_type', 'marker', 'sequence_number', 'timestamp', 'ssrc',
+                 'csrcs', 'extension_profile', 'extension', 'payload')
+
+    def __init__(self, payload_type, marker, sequence_number, timestamp, ssrc,
+                 csrcs, extension_profile, extension, payload):
+        self.payload_type = payload_type
+        self.marker = marker
+        self.sequence_number = sequence_number
+        self.timestamp = timestamp
+        self.ssrc = ssrc
+        self.csrcs = csrcs
+        self.extension_profile = extension_profile
+        self.extension = extension
+        self.payload = payload
+
+    def as_frame(self):
+        '''Returns the tuple (payload_type, marker, sequence_number, timestamp,
+        payload) stored in the jitter buffer, with the payload copied out
+        of the receive buffer.
+        '''
+        return (self.payload_type, self.marker, self.sequence_number, self.timestamp, bytes(self.payload))
+
+def parse_packet(data):
+    '''Parses an RTP packet from a bytes-like object. Raises RTPParseError if
+    the packet is malformed.
+    '''
+    length = len(data)
+    if length < RTP_HEADER_SIZE:
+        raise RTPParseError('Packet shorter than the RTP header')
+    first, second, sequence_number, timestamp, ssrc = RTP_HEADER.unpack_from(data)
+    if first >> 6 != RTP_VERSION:
+        raise RTPParseError(f'Unsupported RTP version {first >> 6}')
+
+    offset = RTP_HEADER_SIZE
+    csrc_count = first & 0x0F
+    csrcs = ()
+    if csrc_count:
+        end = offset + 4 * csrc_count
+        if end > length:
+            raise RTPParseError('Packet shorter than its CSRC list')
+        csrcs = struct.unpack_from(f'!{csrc_count}I', data, offset)
+        offset = end
+
+    extension_profile = None
+    extension = None
+    if first & 0x10:
+        if offset + EXTENSION_HEADER.size > length:
+            raise RTPParseError('Packet shorter than its header extension')
+        extension_profile, words = EXTENSION_HEADER.unpack_from(data, offset)
+        offset += EXTENSION_HEADER.size
+        end = offset + 4 * words
+        if end > length:
+            raise RTPParseError('Packet shorter than its header extension')
+        extension = memoryview(data)[offset:end]
+        offset = end
+
+    if first & 0x20:
+        padding = data[length - 1]
+        if padding == 0 or offset + padding > length:
+            raise RTPParseError('Invalid RTP padding length')
+        length -= padding
+
+    return RTPPacket(second & 0x7F, second >> 7, sequence_number, timestamp, ssrc,
+                     csrcs, extension_profile, extension, memoryview(data)[offset:length])
+
+class RTPParser:
+    def __init__(self, ssrc=None, lock_ssrc=True):
+        '''Parses RTP packets of a single stream. Packets from a different
+        synchronization source than ssrc are rejected. If ssrc is None and
+        lock_ssrc is set, the parser locks onto the source of the first
+        valid packet.
+        '''
+        self.ssrc = ssrc
+        self.lock_ssrc = lock_ssrc
+        self.invalid = 0
+        self.foreign = 0
+
+    def parse(self, data):
+        '''Parses one packet. Returns None, and counts the packet, if it is
+        malformed or comes from a foreign source.
+        '''
+        try:
+            packet = parse_packet(data)
+        except RTPParseError:
+            self.invalid += 1
+            return None
+        if self.ssrc is None:
+            if self.lock_ssrc:
+                self.ssrc = packet.ssrc
+        elif packet.ssrc != self.ssrc:
+            self.foreign += 1
+            return None
+        return packet
+
+    def parse_batch(self, packets):
+        '''Parses a sequence of packets, returning a list with the valid ones
+        from the expected source, in order.
+        '''
+        parse = self.parse
+        return [p for p in map(parse, packets) if p is not None]
@@ -1,107 +1,307 @@
-import io, socket, time
-from threading import Thread, Event, Timer
-import _thread
-
-MESSAGE_ENDLINE = '\r\n\r\n'
-RTP_HEADER_SIZE = 12
+import io, random, re, socket, time
+from collections import deque
+from threading import Thread, Event, Timer, Lock, RLock, Condition
+
+from interleaved import InterleavedReader
+from jitter import JitterBuffer
+from payload import DepacketizerRegistry, DEPACKETIZERS
+from playout import PlayoutClock, PlayoutDelay
+from receiver import RTPReceiver
+from recovery import StreamRebase
+from rtpparse import RTPParser
+from stats import ReceiveStats
+
+def format_request(command, video_name, cseq, session_id=None, transport=None, port=None, extra_headers=None):
+    '''Generates the text of an RTSP request. SETUP requests carry the
+    transport and client port (none for interleaved transports), all
+    others carry the session identifier if it is known.
+    '''
+    if command == 'SETUP':
+        request = command + " " + video_name + " " + "RTSP/1.0\n" + "CSeq: " + str(cseq) + "\nTransport: " + transport
+        if port is not None:
+            request += "; client_port= " + str(port)
+        request += "\n"
+    else:
+        request = command + " " + video_name + " " + "RTSP/1.0\n" + "Cseq: " + str(cseq) + "\n"
+        if session_id is not None:
+            request += "Session: " + str(session_id) + "\n"
+    for name, value in (extra_headers or {}).items():
+        request += name + ": " + str(value) + "\n"
+    return request + "\n"
 
 class RTSPException(Exception):
     def __init__(self, response):
         super().__init__(f'Server error: {response.message} (error code: {response.response_code})')
+        self.response = response
 
 class Response:
     def __init__(self, reader):
-        '''Reads and parses the data associated to an RTSP response'''
-        print('parsing')
-        first_line = reader.readline().split(' ', 2)
-        print(first_line)
-        if len(first_line) != 3:
+        '''Reads and parses the data associated to an RTSP response, from a
+        binary file-like object. If the response has a Content-Length
+        header, its body is read as well, so that the reader is left at
+        the start of the next response.
+        '''
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the server')
+        first_line = line.decode().strip().split(' ', 2)
+        if len(first_line) < 2:
             raise Exception('Invalid response format. Expected first line with version, code and message')
-        self.version, _, self.message = first_line
+        self.version = first_line[0]
+        self.message = first_line[2] if len(first_line) == 3 else ''
         if self.version != 'RTSP/1.0':
             raise Exception('Invalid response version. Expected RTSP/1.0')
         self.response_code = int(first_line[1])
         self.headers = {}
-        
+        self.cseq = None
+        self.session_id = None
+        self.body = b''
+
         while True:
-            line = reader.readline().strip()
-            if not line or ':' not in line: break
+            line = reader.readline().decode().strip()
+            if not line: break
+            if ':' not in line: continue
             hdr_name, hdr_value = line.split(':', 1)
-            self.headers[hdr_name.lower()] = hdr_value
-            if hdr_name.lower() == 'cseq':
-                self.cseq = int(hdr_value)
-            elif hdr_name.lower() == 'session':
-                self.session_id = int(hdr_value)
-        
+            self.headers[hdr_name.strip().lower()] = hdr_value.strip()
+
+        if 'cseq' in self.headers:
+            self.cseq = int(self.headers['cseq'])
+        if 'session' in self.headers:
+            # the session identifier may be followed by ;timeout=...
+            self.session_id = self.headers['session'].split(';', 1)[0].strip()
+        length = int(self.headers.get('content-length', 0))
+        if length:
+            self.body = reader.read(length)
+            if len(self.body) != length:
+                raise ConnectionError('Connection closed in the middle of a response')
+
         if self.response_code != 200:
-            print('raise exception')
             raise RTSPException(self)
 
-        print(self.cseq)
-        print(self.session_id)
-    
+class ControlChannel:
+    def __init__(self, sock):
+        '''Wraps the RTSP connection socket with a single buffered reader that
+        lives as long as the connection, so no data read ahead is lost
+        between responses. Requests can be pipelined: several are sent at
+        once and their responses are matched by CSeq as they arrive.
+        With start_demux, the connection also carries interleaved RTP.
+        '''
+        self.socket = sock
+        self.reader = sock.makefile('rb')
+        self.cseq = 0
+        self.lock = RLock()
+        self.arrived = Condition(self.lock)
+        self.outstanding = deque()  # CSeqs sent and not answered, in order
+        self.responses = {}         # responses read while waiting for another CSeq
+        self.demuxer = None
+        self.packets_received = None
+        self.lost = None
+        self.idle = None
+        self.error = None
+        self.closed = False
+
+    def next_cseq(self):
+        with self.lock:
+            self.cseq += 1
+            return self.cseq
+
+    def send(self, requests):
+        '''Sends a list of requests, given as (cseq, text) pairs, with a
+        single write.
+        '''
+        with self.lock:
+            self.outstanding.extend(cseq for cseq, _ in requests)
+            self.socket.sendall(''.join(text for _, text in requests).encode())
+
+    def read_response(self, reader=None):
+        '''Reads the next response from the connection, or from the given
+        reader. A response with an error code is returned as the
+        RTSPException it raised.
+        '''
+        try:
+            return Response(reader or self.reader)
+        except RTSPException as exception:
+            return exception
+
+    def store(self, response):
+        '''Keeps a response until its request is waited for. Must be called
+        with the lock held.
+        '''
+        received = response.response if isinstance(response, RTSPException) else response
+        # servers that do not echo CSeq answer requests in order
+        if received.cseq in self.outstanding:
+            key = received.cseq
+        elif self.outstanding:
+            key = self.outstanding[0]
+        else:
+            return
+        self.outstanding.remove(key)
+        self.responses[key] = response
+
+    def start_demux(self, packets_received, lost=None, idle=None):
+        '''Starts reading the connection from a background thread that
+        separates interleaved binary packets ($-framed, RFC 2326 section
+        10.12) from RTSP responses. packets_received is called with a
+        list of (channel, memoryview) pairs after every read; the views
+        are only valid during the call. From then on, responses are
+        handed to receive() by that thread, and the buffered reader is
+        no longer used. Must be called before any request whose response
+        may be followed by binary data. lost is called with the exception
+        if the connection fails before it is closed, and idle every time
+        a read times out (if the socket has a timeout).
+        '''
+        with self.lock:
+            self.packets_received = packets_received
+            self.lost = lost
+            self.idle = idle
+            if self.demuxer is None:
+                self.demuxer = InterleavedReader(self.socket)
+                Thread(target=self.demux, daemon=True).start()
+
+    def demux(self):
+        try:
+            while True:
+                try:
+                    self.demuxer.fill()
+                except socket.timeout:
+                    if self.idle is not None:
+                        self.idle()
+                    continue
+                packets = []
+                for channel, data in self.demuxer.messages():
+                    if channel is not None:
+                        packets.append((channel, data))
+                        continue
+                    with self.lock:
+                        self.store(self.read_response(io.BytesIO(data)))
+                        self.arrived.notify_all()
+                if packets:
+                    self.packets_received(packets)
+        except Exception as exception:
+            with self.lock:
+                self.error = exception
+                self.arrived.notify_all()
+            if not self.closed and self.lost is not None:
+                self.lost(exception)
+
+    def receive(self, cseq):
+        '''Returns the response to the request with the given CSeq, reading
+        (and keeping for later) any responses that arrive before it.
+        Raises RTSPException if the server answered with an error.
+        '''
+        with self.lock:
+            while cseq not in self.responses:
+                if self.demuxer is None:
+                    self.store(self.read_response())
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    self.arrived.wait()
+            response = self.responses.pop(cseq)
+        if isinstance(response, RTSPException):
+            raise response
+        return response
+
+    def close(self):
+        self.closed = True
+        self.reader.close()
+
 class Connection:
 
-    def __init__(self, session, address):
+    def __init__(self, session, address, interleaved=False, adaptive=False, min_delay=0.02, max_delay=1.0,
+                 tracer=None):
         '''Establishes a new connection with an RTSP server. No message is
-	sent at this point, and no stream is set up.
+	sent at this point, and no stream is set up. If interleaved is
+	set, RTP is requested over this same TCP connection instead of
+	UDP, which gets through NATs and avoids loss on bad links at the
+	cost of some latency. If adaptive is set, frames are played as
+	soon as the measured jitter allows, with a playout delay kept
+	between min_delay and max_delay seconds, instead of after
+	buffering BUFFER_THRESHOLD / 2 packets. A LatencyTracer, if
+	given, is told about every packet and frame played.
         '''
         self.BUFFER_LENGTH = 0x10000
         self.BUFFER_THRESHOLD = 120 # one second for now
-        self.PLAYBACK_RATE = 1/25
+        self.BUFFER_CAPACITY = 1024
+        self.RECEIVE_BATCH = 16
+        self.RECEIVE_BUFFER_SIZE = 0x400000 # requested SO_RCVBUF, capped by the system
+        self.PLAYBACK_RATE = 1/25 # used until the stream's clock rate is known
+        self.INTERLEAVED_CHANNELS = (0, 1) # RTP and RTCP channels requested
+        self.RTP_TIMEOUT = 2.0 # seconds without RTP while playing taken as a lost connection
+        self.DEPACKETIZERS = dict(DEPACKETIZERS) # payload type -> depacketizer class
         self.session = session
-        self.cseq = None
-        self.buffer = []
-        self.playback_buffer = []
+        self.session_id = None
+        self.pipelining = False # the server answered a Pipelined-Requests header
+        self.buffer = JitterBuffer(self.BUFFER_CAPACITY)
+        self.playout = PlayoutClock(self.PLAYBACK_RATE)
+        self.depacketizer = DepacketizerRegistry(self.DEPACKETIZERS)
+        self.adaptive = adaptive
+        self.delay = PlayoutDelay(min_delay, max_delay)
+        self.tracer = tracer
+        self.rebase = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.last_played = None
+        self.last_arrival = 0.0
+        self.stream_lost = False
+        self.arrived = Event()
+        self.video_name = None
+        self.standby = False
+        self.standby_lock = Lock()
+        self.last_frame = None
         self.state = 'INIT'
+        self.signalTeardown = False
         self.is_rtp_running = False
+        self.interleaved = interleaved
+        self.rtp_socket = None
+        self.rtp_channel = self.INTERLEAVED_CHANNELS[0]
         self.address = address[0]
         self.port = int(address[1])
 
-        # statistics counters
-        self.out_of_order_pkts = 0
-        self.total_pkts = 0
-        self.lost_pkts = 0
-        self.frame_seqnum = -1
-        self.max_seqnum = 0
         self.playback_seq_no = -1
-        self.early_packets = 0
-        self.late_packets = 0
-        self.start_time = 0
-        self.end_time = 0
-    
-        self.stat_flag = 1
+        self.stats = ReceiveStats()
+        self.stats.attach(self.buffer, self.playout, self.depacketizer, delay=self.delay if adaptive else None)
+        self.stats.on_report = self.session.statistics_updated
+
         self.enable_buffer_playout = False
-        
+        self.connect()
+
+    def connect(self):
+        '''Opens the RTSP connection with the server.'''
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         connection = (self.address, self.port)
         self.socket.connect(connection)
-        
+        if self.interleaved:
+            # RTCP and requests sent during the stream must not wait behind
+            # Nagle's algorithm
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.channel = ControlChannel(self.socket)
 
-    def send_request(self, command, include_session=True, extra_headers=None):
+    def send_request(self, command, include_session=True, extra_headers=None, **parameters):
         '''Helper function that generates an RTSP request and sends it to the
-        RTSP connection.
+        RTSP connection. Returns the CSeq of the request. Several requests
+        can be sent in one write by passing lists of commands and
+        parameter dicts to send_requests instead.
         '''
-        if self.cseq is None:
-            req = command[0]
-            self.cseq = 1
-            transport = command[1]
-            port = command[2]
-            if req != "SETUP":
-                # error handling
-                return
-            request = req + " " + self.session.video_name + " " + "RTSP/1.0\n" + "CSeq: " + str(self.cseq) + "\nTransport: " + transport + "; client_port= " + str(port) + "\n\n"
-            print(request + 'sent')
-            self.socket.send(request.encode())
-            return
-        else:
-            req = command
-            self.cseq = self.cseq + 1
-            session = self.session_id
-            request = req + " " + self.session.video_name + " " + "RTSP/1.0\n" + "Cseq: " + str(self.cseq) + "\nSession: " + str(session) + "\n\n"
-            print(request + 'sent')
-            self.socket.send(request.encode())
-            return
+        return self.send_requests([(command, include_session, extra_headers, parameters)])[0]
+
+    def send_requests(self, requests):
+        '''Sends a list of (command, include_session, extra_headers,
+        parameters) requests in a single write, without waiting for any
+        response. Returns the list of their CSeqs.
+        '''
+        formatted = []
+        for command, include_session, extra_headers, parameters in requests:
+            cseq = self.channel.next_cseq()
+            session_id = self.session_id if include_session else None
+            formatted.append((cseq, format_request(command, self.video_name, cseq, session_id,
+                                                   extra_headers=extra_headers, **parameters)))
+        self.channel.send(formatted)
+        return [cseq for cseq, _ in formatted]
+
+    def request(self, command, include_session=True, extra_headers=None, **parameters):
+        '''Sends a request and waits for its response.'''
+        return self.channel.receive(self.send_request(command, include_session, extra_headers, **parameters))
 
     def start_rtp_timer(self):
         '''Starts a thread that reads RTP packets repeatedly and process the
@@ -112,136 +312,267 @@ class Connection:
 	the resulting data. In case of timeout no exception should be
 	thrown.
         '''
+        # each thread keeps the event it was started with, so threads left
+        # from a stream already torn down never read for the next one
         self.playEvent = Event()
-        Thread(target=self.listen_for_rtp).start()
-        Timer(1.0, self.process_frames).start()
-        self.playEvent.clear()
-
-    def listen_for_rtp(self):
+        self.start_receiving()
+        if self.adaptive:
+            Thread(target=self.process_adaptive, args=(self.playEvent,)).start()
+        else:
+            Timer(1.0, self.process_frames, (self.playEvent,)).start()
+        self.is_rtp_running = True
+
+    def start_receiving(self):
+        '''Starts the thread that reads RTP from the datagram socket. It has
+        its own event, as it is replaced on its own when the connection
+        is recovered. Interleaved packets are read by the control
+        channel's thread instead.
+        '''
+        self.receiveEvent = Event()
+        self.last_arrival = time.monotonic()
+        self.stream_lost = False
+        if not self.interleaved:
+            Thread(target=self.listen_for_rtp, args=(self.receiveEvent,)).start()
+
+    def listen_for_rtp(self, play_event):
+        receiver = self.receiver
         while True:
             try:
-                data, addr = self.rtp_socket.recvfrom(self.BUFFER_LENGTH)
-                if data:
-                    rtp_header = bytearray(data[:RTP_HEADER_SIZE])
-                    rtp_payload = data[RTP_HEADER_SIZE:]
-                    
-                    marker = int(rtp_header[1] >> 7)
-                    payload_type = int(rtp_header[1] & 0x7F)
-                    seq_num = int(rtp_header[2] << 8 | rtp_header[3])
-                    timestamp = int(rtp_header[4] << 24 | rtp_header[5] << 16 | rtp_header[6] << 8 | rtp_header[7])
-                    if seq_num < self. playback_seq_no:
-                        continue
-                    frame = (payload_type, marker, seq_num, timestamp, rtp_payload)
-                    self.insert_frame(frame)
-                    # # self.buffer.append(frame)
-                    # self.total_pkts += 1
-                    # if self.frame_seqnum + 1 != seq_num:
-                    #     self.out_of_order_pkts += 1
-                    #     print('out of order')
-                    #     print(self.frame_seqnum)
-                    #     print(seq_num)
-                    #     if self.frame_seqnum + 1 > seq_num:
-                    #         self.late_packets += 1
-                    #     else:
-                    #         self.early_packets += 1
-
-                    # self.frame_seqnum = seq_num
-                    # if seq_num > self.max_seqnum:
-                    #     self.max_seqnum = seq_num
-                
-                    # self.session.process_frame(payload_type, marker, seq_num, timestamp, rtp_payload)
-            except Exception as e:
-                print(e)
-                self.end_time = time.time()
-                total_time = int(self.end_time - self.start_time) - 1
-
-                pkts_lost = (self.max_seqnum + 1) - self.total_pkts
-                frame_rate = self.total_pkts / (total_time)
-                pkt_lost_rate = pkts_lost / (total_time)
-
-                print('Total Frame Rate: ' + str(frame_rate))
-                print('Packet Loss Rate: ' + str(pkt_lost_rate))
-                print('Number of Out Of Order Packets: ' + str(self.out_of_order_pkts))
-                print('Number of Early Packets: ' + str(self.early_packets))
-                print('Number of Late Packets: ' + str(self.late_packets))
-
-                self.stat_flag = 0
-
-                if self.signalTeardown == True:
-                    self.rtp_socket.shutdown(socket.SHUT_RDWR)
-                    self.rtp_socket.close()
-                    break
-                if self.playEvent.is_set():
+                packets = receiver.recv_batch()
+            except (socket.timeout, BlockingIOError):
+                # expected while paused or when the stream ends
+                if play_event.is_set() or self.signalTeardown == True:
                     break
-                
+                self.check_stream()
+                continue
+            except (OSError, ValueError) as exception:
+                # the socket (or its selector) was closed, or failed
+                if not play_event.is_set() and self.signalTeardown != True:
+                    self.session.connection_lost(self, exception)
+                break
+            try:
+                self.packets_received(self.parser.parse_batch(packets))
+            except Exception as exception:
+                self.session.handle_exception(exception)
+
+    def check_stream(self):
+        '''Tells the session the connection is lost if no RTP arrived for
+        RTP_TIMEOUT seconds while playing. Reported once, until packets
+        arrive again.
+        '''
+        if (self.state == 'PLAYING' and not self.stream_lost
+                and time.monotonic() - self.last_arrival >= self.RTP_TIMEOUT):
+            self.stream_lost = True
+            self.session.connection_lost(self, ConnectionError(f'No RTP packet received for {self.RTP_TIMEOUT:g} seconds'))
+
+    def control_lost(self, exception):
+        '''Called by the control channel when the RTSP connection fails.'''
+        if self.state != 'INIT' and not self.signalTeardown:
+            self.session.connection_lost(self, exception)
+
+    def interleaved_received(self, packets):
+        '''Called by the control channel with the binary packets read from
+        the RTSP connection. Only RTP is kept (RTCP is ignored), and only
+        while playing.
+        '''
+        if not self.is_rtp_running:
+            return
+        try:
+            self.packets_received(self.parser.parse_batch(
+                data for channel, data in packets if channel == self.rtp_channel))
+        except Exception as exception:
+            self.session.handle_exception(exception)
+
+    def packets_received(self, packets):
+        '''Feeds a batch of parsed RTP packets, received together, to the
+        playout clock, the statistics and the jitter buffer.
+        '''
+        stats = self.stats
+        tracer = self.tracer
+        rebase = self.rebase
+        arrival = time.monotonic()
+        clock_rate = self.playout.clock_rate
+        for packet in packets:
+            if rebase is not None and not rebase.translate(packet):
+                continue
+            if self.first_timestamp is None:
+                self.first_timestamp = packet.timestamp
+            self.last_timestamp = packet.timestamp
+            if tracer is not None:
+                tracer.packet(self.video_name, packet.timestamp, arrival)
+            self.playout.observe(packet.timestamp, arrival)
+            stats.packet_received(packet.sequence_number, packet.timestamp,
+                                  len(packet.payload), arrival, clock_rate)
+            if self.adaptive:
+                self.delay.observe(packet.sequence_number, packet.timestamp, arrival,
+                                   packet.marker, clock_rate)
+            self.insert_frame(packet.as_frame())
+        if packets:
+            self.last_arrival = arrival
+            self.stream_lost = False
+            self.arrived.set()
+        stats.maybe_report(arrival)
+
     def insert_frame(self, frame):
-        seq_no = frame[2]
-        for e in range(len(self.buffer)):
-            if self.buffer[e][2] > seq_no:
-                self.buffer.insert(e, frame)
-                return
-        self.buffer.insert(len(self.buffer) - 1, frame)
-        return
+        '''Adds a received packet to the jitter buffer. Duplicates and packets
+        that arrive after their turn in the playback are discarded by the
+        buffer.
+        '''
+        self.buffer.insert(frame[2], frame)
 
-    def process_frames(self):
-        start_time = time.time()
+    def process_frames(self, play_event=None):
+        play_event = play_event or self.playEvent
         while True:
-            if self.playEvent.is_set() or self.signalTeardown == True:
-                self.buffer = []
+            if play_event.is_set() or self.signalTeardown == True:
+                self.buffer.clear()
                 break
             if self.enable_buffer_playout == False and len(self.buffer) > self.BUFFER_THRESHOLD / 2:
-                self.start_time = time.time()
                 self.enable_buffer_playout = True
+                self.playout.restart()
             if len(self.buffer) == 0:
                 self.enable_buffer_playout = False
             if self.enable_buffer_playout:
-                frame = self.buffer[0]
-                while (frame[2] < self.playback_seq_no) and (len(self.buffer) != 0):
-                    frame = self.buffer.pop(0)
-                if frame[2] != self.playback_seq_no:
-                    self.playback_seq_no += 1
-                    time.sleep(self.PLAYBACK_RATE)
+                entry = self.buffer.pop()
+                if entry is None:
                     continue
-
-                payload_type = frame[0]
-                marker = frame[1]
-                seq_num = frame[2]
-                timestamp = frame[3]
-                rtp_payload = frame[4]
-                self.playback_seq_no += 1
-                self.session.process_frame(payload_type, marker, seq_num, timestamp, rtp_payload)
-
-                time.sleep(self.PLAYBACK_RATE)
-                self.total_pkts += 1
-                if self.frame_seqnum + 1 != seq_num:
-                    self.out_of_order_pkts += 1
-                    print('out of order')
-                    print(self.frame_seqnum)
-                    print(seq_num)
-                    if self.frame_seqnum + 1 > seq_num:
-                        self.late_packets += 1
+                self.playback_seq_no, packet = entry
+                if packet is None:
+                    # packet lost: the frame it belongs to is dropped, and the
+                    # next frame takes its place in the schedule
+                    self.depacketizer.lost()
+                    continue
+                frame = self.depacketizer.push(packet)
+                # a packet can complete two frames: the second is held back
+                # by the depacketizer and played right after the first
+                while frame is not None:
+                    payload_type = frame[0]
+                    marker = frame[1]
+                    seq_num = frame[2]
+                    timestamp = frame[3]
+                    rtp_payload = frame[4]
+                    trace = None if self.tracer is None else self.tracer.frame(self.video_name, timestamp)
+                    deadline = self.playout.wait(timestamp, play_event)
+                    if play_event.is_set():
+                        break
+                    self.playout.delivered(deadline, seq_num)
+                    self.stats.frame_played(len(rtp_payload))
+                    self.deliver(payload_type, marker, seq_num, timestamp, rtp_payload, trace)
+                    frame = self.depacketizer.pop()
+            else:
+                play_event.wait(self.PLAYBACK_RATE)
+
+    def process_adaptive(self, play_event=None):
+        '''Playout loop of the adaptive mode. Packets are taken from the
+        jitter buffer as soon as they arrive, and each complete frame is
+        played at the deadline given by the adaptive delay. A missing
+        packet is waited for as long as the current delay before it is
+        given up. When no frame is ready a frame interval after the
+        previous deadline, an underrun is reported to the session and
+        the delay grows; playback resuming is reported as well.
+        '''
+        play_event = play_event or self.playEvent
+        delay = self.delay
+        last_deadline = None
+        stalled_at = None
+        gap_since = None
+        while True:
+            if play_event.is_set() or self.signalTeardown == True:
+                self.buffer.clear()
+                break
+            self.arrived.clear()
+            now = time.monotonic()
+            if len(self.buffer) == 0:
+                timeout = self.PLAYBACK_RATE
+                if last_deadline is not None and stalled_at is None:
+                    stall_at = last_deadline + 1.5 * (delay.frame_interval or self.PLAYBACK_RATE)
+                    if now >= stall_at:
+                        stalled_at = now
+                        delay.underrun()
+                        if not self.standby:
+                            self.session.playback_stalled(delay.target)
                     else:
-                        self.early_packets += 1
-
-                self.frame_seqnum = seq_num
-                if seq_num > self.max_seqnum:
-                    self.max_seqnum = seq_num
+                        timeout = stall_at - now
+                self.arrived.wait(timeout)
+                continue
+            if self.buffer.peek() is None:
+                # the next packet is missing, but later ones are here
+                if gap_since is None:
+                    gap_since = now
+                remaining = gap_since + delay.target - now
+                if remaining > 0:
+                    self.arrived.wait(remaining)
+                    continue
+                self.buffer.pop()
+                self.depacketizer.lost()
+                gap_since = None
+                continue
+            gap_since = None
+            self.playback_seq_no, packet = self.buffer.pop()
+            frame = self.depacketizer.push(packet)
+            # a packet can complete two frames: the second is held back by
+            # the depacketizer and played after the first
+            while frame is not None:
+                payload_type, marker, seq_num, timestamp, rtp_payload = frame
+                trace = None if self.tracer is None else self.tracer.frame(self.video_name, timestamp)
+                deadline = delay.deadline(timestamp, now)
+                if deadline is None:
+                    deadline = now
+                self.playout.sleep_until(deadline, play_event)
+                if play_event.is_set():
+                    break
+                last_deadline = max(deadline, time.monotonic())
+                self.playout.delivered(deadline, seq_num)
+                self.stats.frame_played(len(rtp_payload))
+                self.deliver(payload_type, marker, seq_num, timestamp, rtp_payload, trace)
+                if stalled_at is not None and not self.standby:
+                    self.session.playback_resumed(time.monotonic() - stalled_at, delay.target)
+                    stalled_at = None
+                frame = self.depacketizer.pop()
+
+    def deliver(self, payload_type, marker, seq_num, timestamp, payload, trace=None):
+        '''Hands a frame to the session, or, on a standby connection, only
+        keeps it as the latest frame.
+        '''
+        self.last_played = timestamp
+        with self.standby_lock:
+            if self.standby:
+                self.last_frame = (payload_type, marker, seq_num, timestamp, payload)
+                return
+        if trace is not None:
+            trace.mark('delivered')
+        self.session.process_frame(payload_type, marker, seq_num, timestamp, payload, trace)
+
+    def set_standby(self, standby):
+        '''Turns standby on or off. A standby connection keeps receiving and
+        scheduling frames, if it is playing, but does not pass them or its
+        statistics on to the session. When it becomes active again, the
+        latest frame it played is delivered at once, so the picture
+        appears without waiting for the buffer to fill.
+        '''
+        if standby:
+            with self.standby_lock:
+                self.standby = True
+                self.last_frame = None
+            self.stats.on_report = None
+            return
+        self.stats.on_report = self.session.statistics_updated
+        with self.standby_lock:
+            self.standby = False
+            frame, self.last_frame = self.last_frame, None
+            # delivered with the lock held, so the playout thread cannot
+            # deliver a newer frame before it
+            if frame is not None:
+                self.session.process_frame(*frame)
 
     def stop_rtp_timer(self):
         '''Stops the thread that reads RTP packets'''
 
+        self.is_rtp_running = False
         self.playEvent.set()
+        self.receiveEvent.set()
+        self.arrived.set()
 
-    def recv_response(self):
-        resp_string = self.socket.recv(2048)
-        resp_string = resp_string.decode()
-        while not MESSAGE_ENDLINE in resp_string:
-            recv_buf = self.socket.recv(2048)
-            if not recv_buf: break
-            resp_string += recv_buf
-        return resp_string
-
-    def setup(self):
+    def setup(self, play=False, video_name=None):
         '''Sends a SETUP request to the server. This method is responsible for
 	sending the SETUP request, receiving the response and
 	retrieving the session identification to be used in future
@@ -251,36 +582,145 @@ class Connection:
 	UDP port number, and the port number used in that connection
 	has to be sent to the RTSP server for setup. This datagram
 	socket should also be defined to timeout after 1 second if no
-	packet is received.
+	packet is received. If play is set, the stream is played as
+	well. The SETUP request carries a Pipelined-Requests header
+	(RFC 7826 section 18.33); once the server has shown it supports
+	them by sending the header back, the PLAY request is sent right
+	after the SETUP, without waiting for its response, which saves a
+	round trip. Otherwise it is sent with the session identifier
+	once the SETUP has succeeded. For interleaved connections no
+	socket is created: RTP is
+	read from the RTSP connection itself. The video set up is the
+	session's, unless video_name is given.
         '''
-        print(self.state)
         if self.state == 'INIT':
+            self.video_name = video_name if video_name is not None else self.session.video_name
             self.signalTeardown = False
-            self.cseq = None
-
-            self.rtp_socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-            self.rtp_socket.settimeout(1)
-            self.rtp_socket.bind((self.address, 0))
-            self.rtp_port = self.rtp_socket.getsockname()[1]
-            print(self.rtp_port)
-
-            command_input = ('SETUP', 'RTP/UDP', self.rtp_port)
-            self.send_request(command_input)
-
-            resp = Response(self.socket.makefile("r"))
-            self.session_id = resp.session_id
-            self.state = 'READY'
-            self.out_of_order_pkts = 0
-            self.total_pkts = 0
+            self.session_id = None
+
+            transport = self.open_transport()
+            self.parser = RTPParser()
+            self.rebase = None
+            self.first_timestamp = self.last_timestamp = self.last_played = None
+            self.buffer.clear()
+            self.playout = PlayoutClock(self.PLAYBACK_RATE)
+            self.depacketizer = DepacketizerRegistry(self.DEPACKETIZERS)
+            self.delay.reset()
             self.playback_seq_no = 0
-            self.lost_pkts = 0
-            self.frame_seqnum = -1
-            self.max_seqnum = 0
-            self.early_packets = 0
-            self.late_packets = 0
-            self.start_time = 0
-            self.end_time = 0
-
+            self.stats.reset()
+            self.stats.attach(self.buffer, self.playout, self.depacketizer, self.receiver, self.parser,
+                              self.delay if self.adaptive else None)
+
+            # identifies the requests of this session until the server
+            # has given its own identifier
+            pipelined = {'Pipelined-Requests': random.randrange(1, 100000000)}
+            requests = [('SETUP', False, pipelined, {'transport': transport, 'port': self.rtp_port})]
+            pipeline = play and self.pipelining
+            if pipeline:
+                requests.append(('PLAY', False, pipelined, {}))
+                self.start_rtp_timer()
+            try:
+                cseqs = self.send_requests(requests)
+                resp = self.channel.receive(cseqs[0])
+            except Exception:
+                if pipeline:
+                    self.stop_rtp_timer()
+                self.close_rtp()
+                raise
+            self.set_up(resp)
+            self.pipelining = 'pipelined-requests' in resp.headers
+            self.state = 'READY'
+            if pipeline:
+                try:
+                    self.channel.receive(cseqs[1])
+                except Exception:
+                    self.stop_rtp_timer()
+                    raise
+                self.state = 'PLAYING'
+            elif play:
+                self.play()
+
+    def open_transport(self):
+        '''Prepares to receive the stream, and returns the transport to ask
+        for in the SETUP request.
+        '''
+        if self.interleaved:
+            self.rtp_socket = None
+            self.receiver = None
+            self.rtp_port = None
+            self.rtp_channel = self.INTERLEAVED_CHANNELS[0]
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECEIVE_BUFFER_SIZE)
+            # reads time out, so that a stream that stops is noticed
+            self.socket.settimeout(1)
+            self.channel.start_demux(self.interleaved_received, self.control_lost, self.check_stream)
+            return 'RTP/AVP/TCP;interleaved=%d-%d' % self.INTERLEAVED_CHANNELS
+        self.rtp_socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.rtp_socket.settimeout(1)
+        self.rtp_socket.bind((self.address, 0))
+        self.rtp_port = self.rtp_socket.getsockname()[1]
+        self.receiver = RTPReceiver(self.rtp_socket, self.BUFFER_LENGTH,
+                                    self.RECEIVE_BATCH, self.RECEIVE_BUFFER_SIZE)
+        return 'RTP/UDP'
+
+    def set_up(self, response):
+        '''Takes the session identifier and channels from a SETUP response.'''
+        self.session_id = response.session_id
+        if self.interleaved:
+            # the server may pick other channels than those requested
+            match = re.search(r'interleaved=(\d+)', response.headers.get('transport', ''))
+            if match:
+                self.rtp_channel = int(match.group(1))
+
+    def position(self):
+        '''Returns the position of the last frame played, in seconds from
+        the start of the stream (normal play time), or None.
+        '''
+        if self.last_played is None or self.first_timestamp is None:
+            return None
+        clock_rate = self.playout.clock_rate or 90000
+        return ((self.last_played - self.first_timestamp) & 0xFFFFFFFF) / clock_rate
+
+    def reconnect(self):
+        '''Replaces a lost RTSP connection: connects again, sets the stream
+        up again and, if it was playing, plays it from the last frame
+        played (with a Range header). The jitter buffer, the depacketizer
+        and the playout thread are kept, so the frames already received
+        are still played, and the packets of the new stream are
+        renumbered to follow them (see StreamRebase). May be called
+        again if it fails.
+        '''
+        playing = self.state == 'PLAYING'
+        if playing:
+            self.receiveEvent.set()
+        self.channel.close()
+        try:
+            # wakes up the control channel's thread, if it is reading
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.close_rtp()
+        self.connect()
+        if self.state == 'INIT':
+            return
+        transport = self.open_transport()
+        self.parser = RTPParser()
+        self.stats.attach(self.buffer, self.playout, self.depacketizer, self.receiver, self.parser,
+                          self.delay if self.adaptive else None)
+        self.set_up(self.request('SETUP', False, transport=transport, port=self.rtp_port))
+        if not playing:
+            return
+        position = self.position()
+        self.rebase = StreamRebase(None if self.buffer.highest is None else self.buffer.highest & 0xFFFF,
+                                   self.last_timestamp, self.last_played)
+        if self.adaptive:
+            self.delay.reset()
+        if self.playEvent.is_set():
+            self.start_rtp_timer()
+        else:
+            self.start_receiving()
+        self.is_rtp_running = True
+        self.request('PLAY', extra_headers=None if position is None else {'Range': f'npt={position:.3f}-'})
 
     def play(self):
         '''Sends a PLAY request to the server. This method is responsible for
@@ -290,9 +730,11 @@ class Connection:
         '''
         if self.state == 'READY':
             self.start_rtp_timer()
-            self.send_request('PLAY')
-            
-            resp = Response(self.socket.makefile("r"))
+            try:
+                self.request('PLAY')
+            except Exception:
+                self.stop_rtp_timer()
+                raise
             self.state = 'PLAYING'
 
     def pause(self):
@@ -304,9 +746,7 @@ class Connection:
 
         if self.state == 'PLAYING':
             self.stop_rtp_timer()
-            self.send_request('PAUSE')
-
-            resp = Response(self.socket.makefile("r"))
+            self.request('PAUSE')
             self.state = 'READY'
 
     def teardown(self):
@@ -320,16 +760,19 @@ class Connection:
 	cancelled.
         '''
         if self.state == 'READY' or self.state == 'PLAYING':
-            self.send_request('TEARDOWN')
-            resp = Response(self.socket.makefile("r"))
+            self.request('TEARDOWN')
             if self.state == 'PLAYING':
                 self.signalTeardown = True
-            else:
-                print("Closing the RTP socket here")
-                self.rtp_socket.shutdown(socket.SHUT_RDWR)
-                self.rtp_socket.close()
+                self.stop_rtp_timer()
+            self.close_rtp()
             self.state = 'INIT'
 
+    def close_rtp(self):
+        '''Closes the RTP socket, if the stream has one.'''
+        if self.rtp_socket is not None:
+            self.receiver.close()
+            self.rtp_socket.close()
+
 
     def close(self):
         '''Closes the connection with the RTSP server. This method should also
@@ -337,6 +780,8 @@ class Connection:
 	the RTP connection, if it is still open.
         '''
         self.signalTeardown = True
+        self.close_rtp()
+        self.channel.close()
         self.socket.shutdown(socket.SHUT_RDWR)
         self.socket.close()
         
@@ -1,7 +1,10 @@
 import io
-from PIL import Image, ImageTk
 
+from dispatch import ListenerDispatcher, DROP_OLDEST
+from h264 import START_CODE
+from recovery import SessionRecovery
 from rtsp import Connection
+from standby import StandbyPool
 
 class SessionListener:
     '''Interface for listener methods for session events.'''
@@ -14,11 +17,26 @@ class SessionListener:
     def video_name_changed(self, name):
         pass
 
+    def statistics_updated(self, statistics):
+        pass
+
+    def playback_stalled(self, delay):
+        pass
+
+    def playback_resumed(self, stall, delay):
+        pass
+
+    def connection_lost(self, reason):
+        pass
+
+    def connection_recovered(self, seconds):
+        pass
+
 class VideoFrame:
-    def __init__(self, payload_type, marker, sequence_number, timestamp, payload):
+    def __init__(self, payload_type, marker, sequence_number, timestamp, payload, trace=None):
         '''Creates a new frame.
 	- payload_type: The numeric type of payload found in the frame. The most
-	  common type is 26 (JPEG).
+	  common type is 26 (JPEG); H.264 streams usually use 96.
 	- marker: An indication if the frame is an important frame when compared
 	  to other frames in the stream.
 	- sequence_number: A sequential number corresponding to the ordering of the
@@ -26,45 +44,118 @@ class VideoFrame:
           for each frame following that.
 	- timestamp: The number of milliseconds after the logical start of the
 	  stream when this frame is expected to be played.
-	- payload: A byte array containing the payload (contents) of the frame.
+	- payload: A byte array containing the payload (contents) of the frame:
+	  a JPEG image, or for H.264 an access unit as an Annex-B byte stream.
+	- trace: The FrameTrace stamped as the frame goes through the client,
+	  if latency tracing is on, or None.
         '''
         self.payload_type = payload_type
         self.marker = marker
         self.sequence_number = sequence_number
         self.timestamp = timestamp
         self.payload = payload
+        self.trace = trace
 
-    def get_image(self):
-        '''Creates an Image based on the payload of the frame.'''
+    def decode(self, size=None):
+        '''Decodes the payload of the frame into a PIL Image. If a size
+        (width, height) is given, the image is shrunk to fit in it, and
+        JPEG payloads are decoded directly at the smallest scale that is
+        still at least that large. Requires Pillow, which is only imported
+        the first time a frame is decoded. H.264 access units cannot be
+        decoded on their own (they need a video decoder that keeps the
+        reference pictures), and raise ValueError.
+        '''
+        if self.payload[:4] == START_CODE:
+            raise ValueError('H.264 access units need a video decoder')
+        from PIL import Image
+        trace = self.trace
+        if trace is not None:
+            trace.mark('decode_start')
         image = Image.open(io.BytesIO(self.payload))
-        return ImageTk.PhotoImage(image)
+        if size:
+            image.draft(image.mode, size)
+            image.thumbnail(size)
+        else:
+            image.load()
+        if trace is not None:
+            trace.mark('decoded')
+        return image
+
+    def get_image(self, size=None):
+        '''Creates an Image based on the payload of the frame. Requires
+        tkinter, and a Tk root window to exist.
+        '''
+        from PIL import ImageTk
+        return ImageTk.PhotoImage(self.decode(size))
     
 class Session:
-    def __init__(self, address):
+    def __init__(self, address, interleaved=False, adaptive=False, min_delay=0.02, max_delay=1.0,
+                 max_standby=2, standby_timeout=60.0, standby_bitrate=None, tracer=None, recover=False,
+                 max_recovery_attempts=10):
         '''Creates a new RTSP session. This constructor will also create a
         new network connection with the server. No stream setup is
-        established at this point.
+        established at this point. If interleaved is set, RTP is
+        received over the RTSP connection (TCP) instead of UDP. If
+        adaptive is set, the playout delay follows the measured network
+        jitter, between min_delay and max_delay seconds, and listeners
+        are told when playback stalls and resumes.
+
+        Up to max_standby other videos can be kept ready with prepare()
+        for fast switching; standbys unused for standby_timeout seconds,
+        or beyond standby_bitrate bits per second in total, are closed.
+
+        If a LatencyTracer is given, every frame is traced from its first
+        packet to its decoding and display (see tracing.py).
+
+        If recover is set, a connection lost while a video is open (the
+        RTSP connection failing, or no RTP for Connection.RTP_TIMEOUT
+        seconds while playing) is reconnected automatically, and the
+        video resumed where it stopped (see recovery.py).
         '''
-        self.connection = Connection(self, address)
+        self.address = address
+        self.tracer = tracer
+        self.recovery = SessionRecovery(self, max_attempts=max_recovery_attempts) if recover else None
+        self.connection_options = (interleaved, adaptive, min_delay, max_delay, tracer)
+        self.connection = Connection(self, address, *self.connection_options)
+        self.standby = StandbyPool(max_standby, standby_timeout, standby_bitrate)
         self.video_name = None
         self.listeners = []
+        self.dispatchers = []
 
-    def add_listener(self, listener):
+    def add_listener(self, listener, policy=DROP_OLDEST, max_queue=8):
         '''Adds a new listener interface to be called every time a session
 	event (such as a change in video name or a new frame)
 	happens. Any interaction with user interfaces is done through
-	these listeners.
+	these listeners. Each listener is called from its own thread,
+	through a queue of at most max_queue frames; the policy says
+	which frames are dropped when it is full (see dispatch.py). With
+	policy None, the listener is called directly from the playout
+	thread and must return quickly.
         '''
+        dispatcher = ListenerDispatcher(listener, policy, max_queue)
         self.listeners.append(listener)
-        listener.video_name_changed(self.video_name)
+        self.dispatchers.append(dispatcher)
+        dispatcher.post('video_name_changed', self.video_name)
+
+    def remove_listener(self, listener):
+        '''Removes a listener, after delivering the events queued for it.'''
+        i = self.listeners.index(listener)
+        del self.listeners[i]
+        self.dispatchers.pop(i).close()
 
-    def open(self, video_name):
-        '''Opens a new video file in the interface.'''
+    def notify(self, method, *args):
+        '''Queues a call to the given method of every listener.'''
+        for d in self.dispatchers:
+            d.post(method, *args)
+
+    def open(self, video_name, play=False):
+        '''Opens a new video file in the interface. If play is set, playback
+        is requested together with the setup, saving a round trip.
+        '''
         try:
             self.video_name = video_name
-            self.connection.setup()
-            for l in self.listeners:
-                l.video_name_changed(video_name)
+            self.connection.setup(play)
+            self.notify('video_name_changed', video_name)
         except Exception as exception:
             self.handle_exception(exception)
 
@@ -80,6 +171,8 @@ class Session:
             self.connection.play()
         except Exception as exception:
             self.handle_exception(exception)
+            if isinstance(exception, OSError):
+                self.connection_lost(self.connection, exception)
 
     def pause(self):
         '''Pauses the playback the existing file. It should only be called
@@ -92,6 +185,8 @@ class Session:
             self.connection.pause()
         except Exception as exception:
             self.handle_exception(exception)
+            if isinstance(exception, OSError):
+                self.connection_lost(self.connection, exception)
 
     def teardown(self):
         '''Closes the currently open file. It should only be called once a
@@ -100,9 +195,57 @@ class Session:
         try:
             self.connection.teardown()
             self.video_name = None
-            for l in self.listeners:
-                l.frame_received(None)
-                l.video_name_changed(None)
+            self.notify('frame_received', None)
+            self.notify('video_name_changed', None)
+        except Exception as exception:
+            self.handle_exception(exception)
+
+    def prepare(self, video_name, prebuffer=True):
+        '''Sets up a video on a standby connection, so that a later switch
+        to it is immediate. If prebuffer is set, the standby also plays
+        in the background (without showing frames), so the first frame
+        is shown as soon as the switch happens; otherwise only the PLAY
+        round trip is saved.
+        '''
+        if video_name == self.video_name or video_name in self.standby:
+            return
+        try:
+            connection = Connection(self, self.address, *self.connection_options)
+            connection.set_standby(True)
+            try:
+                connection.setup(prebuffer, video_name)
+            except Exception:
+                connection.close()
+                raise
+            self.standby.add(video_name, connection)
+        except Exception as exception:
+            self.handle_exception(exception)
+
+    def switch(self, video_name):
+        '''Starts playing another video. If it was prepared, its standby
+        connection becomes the active one, and the current video is kept
+        as a standby in turn so switching back is just as fast. Otherwise
+        the current video is closed and the new one set up and played.
+        '''
+        try:
+            connection = self.standby.take(video_name)
+            if connection is None:
+                self.connection.teardown()
+                self.video_name = video_name
+                self.connection.setup(play=True)
+            else:
+                previous = self.connection
+                previous.set_standby(True)
+                self.connection = connection
+                self.video_name = video_name
+                if connection.state == 'READY':
+                    connection.play()
+                connection.set_standby(False)
+                if previous.state == 'INIT':
+                    previous.close()
+                else:
+                    self.standby.add(previous.video_name, previous)
+            self.notify('video_name_changed', video_name)
         except Exception as exception:
             self.handle_exception(exception)
 
@@ -111,27 +254,71 @@ class Session:
 	should not be used anymore after this point.
         '''
         try:
+            if self.recovery:
+                self.recovery.close()
+            self.standby.close()
             self.connection.close()
-            for l in self.listeners:
-                l.video_name_changed(None)
-                l.frame_received(None)
+            self.notify('video_name_changed', None)
+            self.notify('frame_received', None)
+            for d in self.dispatchers:
+                d.close()
         except Exception as exception:
             self.handle_exception(exception)
 
+    def statistics(self):
+        '''Returns a snapshot (a dict) of the receive statistics of the
+        current stream. Listeners are also sent one every second through
+        statistics_updated while packets are being received. The
+        'listeners' entry has the queue counters of each listener.
+        '''
+        statistics = self.connection.stats.snapshot()
+        statistics['listeners'] = [d.statistics() for d in self.dispatchers]
+        if self.recovery:
+            statistics['recovery'] = self.recovery.statistics()
+        return statistics
+
+    def statistics_updated(self, statistics):
+        '''Called by the connection with a new statistics snapshot.'''
+        statistics['listeners'] = [d.statistics() for d in self.dispatchers]
+        if self.recovery:
+            statistics['recovery'] = self.recovery.statistics()
+        self.notify('statistics_updated', statistics)
+
     def handle_exception(self, exception):
         '''Helper function that notifies the main window that an exception has
         happened.
         '''
-        for l in self.listeners:
-            l.exception_thrown(exception)
+        self.notify('exception_thrown', exception)
         
-    def process_frame(self, payload_type, marker, sequence_number, timestamp, payload):
+    def process_frame(self, payload_type, marker, sequence_number, timestamp, payload, trace=None):
         '''Creates and processes a frame received from the RTSP server. This
 	method will direct the frame to the user interface to be
 	processed and presented to the user. A description of the
 	parameters can be found on the VideoFrame class comments.
         '''
-        frame = VideoFrame(payload_type, marker, sequence_number, timestamp, payload)
+        frame = VideoFrame(payload_type, marker, sequence_number, timestamp, payload, trace)
         if (self.video_name):
-            for l in self.listeners:
-                l.frame_received(frame)
+            self.notify('frame_received', frame)
+
+    def playback_stalled(self, delay):
+        '''Called by the connection when no frame was ready in time. delay
+        is the new target playout delay, in seconds.
+        '''
+        self.notify('playback_stalled', delay)
+
+    def playback_resumed(self, stall, delay):
+        '''Called by the connection when a frame is played again after a
+        stall that lasted stall seconds.
+        '''
+        self.notify('playback_resumed', stall, delay)
+
+    def connection_lost(self, connection, reason):
+        '''Called by a connection whose server stopped answering or sending.
+        Standby connections are left for the pool to evict.
+        '''
+        if connection is not self.connection:
+            return
+        if self.recovery:
+            self.recovery.trigger(connection, reason)
+        else:
+            self.handle_exception(reason)
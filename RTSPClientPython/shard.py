@@ -0,0 +1,396 @@
+import itertools, multiprocessing, os
+from multiprocessing import resource_tracker
+from threading import Thread, Event, Lock
+
+from session import Session, SessionListener
+from sharedring import SharedFramePublisher, SharedFrameSubscriber
+
+COMMANDS = ('open', 'play', 'pause', 'teardown', 'remove', 'stats')
+
+class StreamErrors(SessionListener):
+    '''Records the exceptions of a session as they are thrown.'''
+    def __init__(self):
+        self.count = 0
+        self.last = None
+
+    def exception_thrown(self, exception):
+        self.count += 1
+        self.last = f'{type(exception).__name__}: {exception}'
+
+class ShardWorker:
+    def __init__(self, connection, session_options, decode=False, size=None):
+        '''Runs in a worker process. Owns the sessions of one shard, carries
+        out the commands the supervisor sends on connection (a Pipe), and
+        publishes the frames of each stream into the shared memory ring
+        the supervisor created for it.
+        '''
+        self.connection = connection
+        self.session_options = session_options
+        self.decode = decode
+        self.size = size
+        self.streams = {}  # stream id -> (session, publisher, errors)
+
+    def run(self):
+        parent = multiprocessing.parent_process()
+        try:
+            while True:
+                if not self.connection.poll(1.0):
+                    if parent is not None and not parent.is_alive():
+                        return
+                    continue
+                try:
+                    command, args = self.connection.recv()
+                except EOFError:
+                    return
+                if command == 'exit':
+                    self.connection.send((True, None))
+                    return
+                try:
+                    if command not in COMMANDS:
+                        raise ValueError(f'Unknown command {command!r}')
+                    reply = (True, getattr(self, command)(*args))
+                except Exception as exception:
+                    reply = (False, f'{type(exception).__name__}: {exception}')
+                self.connection.send(reply)
+        finally:
+            for stream_id in list(self.streams):
+                self.remove(stream_id)
+
+    def check(self, stream_id, method, *args):
+        '''Calls a session method, raising the exception it reported.'''
+        errors = self.streams[stream_id][2]
+        count = errors.count
+        method(*args)
+        if errors.count > count:
+            raise RuntimeError(errors.last)
+
+    def open(self, stream_id, address, video_name, ring_name, play):
+        session = Session(address, **self.session_options)
+        errors = StreamErrors()
+        session.add_listener(errors, policy=None)
+        publisher = SharedFramePublisher(ring_name, decode=self.decode, size=self.size, create=False)
+        session.add_listener(publisher)
+        self.streams[stream_id] = (session, publisher, errors)
+        if video_name is not None:
+            try:
+                self.check(stream_id, session.open, video_name, play)
+            except Exception:
+                self.remove(stream_id)
+                raise
+
+    def play(self, stream_id):
+        self.check(stream_id, self.streams[stream_id][0].play)
+
+    def pause(self, stream_id):
+        self.check(stream_id, self.streams[stream_id][0].pause)
+
+    def teardown(self, stream_id):
+        self.check(stream_id, self.streams[stream_id][0].teardown)
+
+    def remove(self, stream_id):
+        entry = self.streams.pop(stream_id, None)
+        if entry is None:
+            return
+        session, publisher, _ = entry
+        try:
+            session.teardown()
+            session.close()
+        finally:
+            publisher.close()
+
+    def stats(self):
+        times = os.times()
+        streams = {}
+        for stream_id, (session, publisher, errors) in self.streams.items():
+            try:
+                statistics = session.statistics()
+            except Exception as exception:
+                # one stream being torn down or reconnecting must not hide
+                # the others
+                statistics = {'error': f'{type(exception).__name__}: {exception}'}
+            statistics['state'] = session.connection.state
+            statistics['published'] = publisher.published
+            statistics['errors'] = errors.count
+            statistics['last_error'] = errors.last
+            streams[stream_id] = statistics
+        return {'pid': os.getpid(), 'cpu_seconds': times.user + times.system, 'streams': streams}
+
+def run_worker(connection, cpu, session_options, decode, size):
+    '''Entry point of a worker process.'''
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    ShardWorker(connection, session_options, decode, size).run()
+
+class ShardStream:
+    def __init__(self, stream_id, address, video_name, worker, ring):
+        '''A stream as the supervisor knows it: enough to open it again
+        on a restarted worker.
+        '''
+        self.stream_id = stream_id
+        self.address = address
+        self.video_name = video_name
+        self.worker = worker
+        self.ring = ring
+        self.state = 'INIT'
+        self.error = None
+
+class WorkerHandle:
+    def __init__(self, index):
+        '''The supervisor's side of one worker process.'''
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.lock = Lock()          # one request at a time on the pipe
+        self.restart_lock = Lock()
+        self.generation = 0         # incremented on every (re)start
+        self.restarts = 0
+        self.streams = set()
+        self.report = None          # last answer to 'stats'
+
+class ShardSupervisor:
+    def __init__(self, workers=None, pin=False, decode=False, size=None, slot_count=32, slot_size=0x200000,
+                 health_interval=1.0, reply_timeout=10.0, **session_options):
+        '''Spreads many sessions over a number of worker processes (one per
+        CPU by default), so that receiving, depacketizing and decoding
+        use every core instead of one interpreter's. Each stream is
+        placed on the least loaded worker (by reported bitrate), or on a
+        given one; with pin set, worker i is also bound to CPU i.
+
+        Frames come back through one SharedFramePublisher ring per
+        stream, created and owned here: read them with subscribe(). If
+        decode is set, workers publish decoded pixels (at size, if given)
+        instead of encoded frames. session_options are passed to every
+        Session.
+
+        Every health_interval seconds each worker is asked for its
+        statistics. A worker that exited, or that does not answer within
+        reply_timeout seconds, is killed and started again, and its
+        streams are opened again in the state they were in. Their rings
+        are kept, so subscribers just see a gap.
+        '''
+        self.pin = pin
+        self.decode = decode
+        self.size = size
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.health_interval = health_interval
+        self.reply_timeout = reply_timeout
+        self.session_options = session_options
+        self.context = multiprocessing.get_context()
+        self.streams = {}
+        self.ids = itertools.count(1)
+        self.lock = Lock()
+        self.stopped = Event()
+        # workers must share this process's resource tracker, or their own
+        # would remove the rings when they exit
+        resource_tracker.ensure_running()
+        self.workers = [WorkerHandle(i) for i in range(workers or os.cpu_count() or 1)]
+        for worker in self.workers:
+            self.start_worker(worker)
+        self.monitor = Thread(target=self.watch, daemon=True)
+        self.monitor.start()
+
+    def start_worker(self, worker):
+        connection, child = self.context.Pipe()
+        cpu = worker.index % (os.cpu_count() or 1) if self.pin else None
+        process = self.context.Process(target=run_worker, name=f'shard-{worker.index}', daemon=True,
+                                       args=(child, cpu, self.session_options, self.decode, self.size))
+        process.start()
+        child.close()
+        with worker.lock:
+            worker.process, worker.connection = process, connection
+            worker.generation += 1
+            worker.report = None
+
+    def request(self, worker, command, args):
+        '''Sends a command to a worker and returns its reply. Raises
+        EOFError, OSError or TimeoutError if the worker is gone or hung.
+        '''
+        with worker.lock:
+            worker.connection.send((command, args))
+            if not worker.connection.poll(self.reply_timeout):
+                raise TimeoutError(f'Shard worker {worker.index} did not answer {command}')
+            ok, result = worker.connection.recv()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def call(self, worker, command, *args):
+        '''Runs a command on a worker. If the worker failed, it is restarted
+        and ConnectionError is raised.
+        '''
+        generation = worker.generation
+        try:
+            return self.request(worker, command, args)
+        except (EOFError, OSError, TimeoutError) as exception:
+            self.restart(worker, generation)
+            raise ConnectionError(f'Shard worker {worker.index} failed during {command} and was restarted') from exception
+
+    def restart(self, worker, generation):
+        '''Replaces a failed worker process, unless that was already done
+        since generation, and opens its streams again.
+        '''
+        with worker.restart_lock:
+            if worker.generation != generation or self.stopped.is_set():
+                return
+            worker.process.kill()
+            worker.process.join(1.0)
+            worker.connection.close()
+            self.start_worker(worker)
+            worker.restarts += 1
+            with self.lock:
+                streams = [self.streams[i] for i in sorted(worker.streams)]
+            for stream in streams:
+                video_name = stream.video_name if stream.state != 'INIT' else None
+                try:
+                    self.request(worker, 'open', (stream.stream_id, stream.address, video_name,
+                                                  stream.ring.name, stream.state == 'PLAYING'))
+                    if stream.state == 'PAUSED':
+                        stream.state = 'READY'
+                    stream.error = None
+                except Exception as exception:
+                    stream.error = f'{type(exception).__name__}: {exception}'
+
+    def watch(self):
+        '''Health monitor: polls every worker and restarts failed ones.'''
+        while not self.stopped.wait(self.health_interval):
+            for worker in self.workers:
+                generation = worker.generation
+                try:
+                    if not worker.process.is_alive():
+                        raise EOFError
+                    worker.report = self.request(worker, 'stats', ())
+                except (EOFError, OSError, TimeoutError):
+                    self.restart(worker, generation)
+                except Exception:
+                    pass
+
+    def place(self):
+        '''Returns the worker with the least load. Streams not reported yet
+        count for the average bitrate of those that are.
+        '''
+        reported = {}
+        for worker in self.workers:
+            if worker.report is not None:
+                for stream_id, statistics in worker.report['streams'].items():
+                    reported[stream_id] = statistics.get('bitrate', 0)
+        average = sum(reported.values()) / len(reported) if reported else 0
+        def load(worker):
+            return (sum(reported.get(i, average) for i in worker.streams), len(worker.streams))
+        return min(self.workers, key=load)
+
+    def open(self, address, video_name, play=True, worker=None):
+        '''Opens a session with the server at address on a worker (the least
+        loaded one, or the given index), sets up the video, and plays it
+        if play is set. Returns the stream identifier.
+        '''
+        stream_id = next(self.ids)
+        ring = SharedFramePublisher(f'rtpshard-{os.getpid()}-{stream_id}', self.slot_count, self.slot_size)
+        with self.lock:
+            target = self.place() if worker is None else self.workers[worker]
+            stream = ShardStream(stream_id, tuple(address), video_name, target.index, ring)
+            stream.state = 'PLAYING' if play else 'READY'
+            self.streams[stream_id] = stream
+            target.streams.add(stream_id)
+        try:
+            self.call(target, 'open', stream_id, stream.address, video_name, ring.name, play)
+        except Exception:
+            self.forget(stream_id)
+            try:
+                self.call(target, 'remove', stream_id)
+            except Exception:
+                pass
+            ring.close()
+            raise
+        return stream_id
+
+    def command(self, stream_id, command, state):
+        stream = self.streams[stream_id]
+        self.call(self.workers[stream.worker], command, stream_id)
+        stream.state = state
+
+    def play(self, stream_id):
+        self.command(stream_id, 'play', 'PLAYING')
+
+    def pause(self, stream_id):
+        self.command(stream_id, 'pause', 'PAUSED')
+
+    def teardown(self, stream_id):
+        self.command(stream_id, 'teardown', 'INIT')
+
+    def forget(self, stream_id):
+        with self.lock:
+            stream = self.streams.pop(stream_id)
+            self.workers[stream.worker].streams.discard(stream_id)
+        return stream
+
+    def remove(self, stream_id):
+        '''Closes a stream and its ring, and forgets about it.'''
+        stream = self.forget(stream_id)
+        try:
+            self.call(self.workers[stream.worker], 'remove', stream_id)
+        finally:
+            stream.ring.close()
+
+    def ring_name(self, stream_id):
+        '''Name of the shared memory ring a stream's frames are published in,
+        for subscribers in other processes.
+        '''
+        return self.streams[stream_id].ring.name
+
+    def subscribe(self, stream_id, from_start=False):
+        '''Returns a SharedFrameSubscriber reading the frames of a stream.'''
+        return SharedFrameSubscriber(self.ring_name(stream_id), from_start)
+
+    def stats(self):
+        '''Returns a dict with counters aggregated over every stream, the
+        state of each worker under 'workers', and the per-stream counters
+        under 'streams'.
+        '''
+        workers = []
+        streams = {}
+        for worker in self.workers:
+            entry = {'index': worker.index, 'pid': worker.process.pid, 'alive': worker.process.is_alive(),
+                     'restarts': worker.restarts, 'streams': sorted(worker.streams)}
+            try:
+                report = worker.report = self.call(worker, 'stats')
+                entry['cpu_seconds'] = report['cpu_seconds']
+                streams.update(report['streams'])
+            except Exception as exception:
+                entry['error'] = str(exception)
+            workers.append(entry)
+        for stream_id, stream in list(self.streams.items()):
+            statistics = streams.setdefault(stream_id, {'state': None})
+            statistics['worker'] = stream.worker
+            statistics['ring'] = stream.ring.name
+            if stream.error:
+                statistics['last_error'] = stream.error
+        total = {key: sum(s.get(key, 0) for s in streams.values())
+                 for key in ('packets', 'bytes', 'lost_packets', 'frames', 'late_frames', 'dropped_frames',
+                             'buffered_packets', 'duplicate_packets', 'late_packets', 'bitrate')}
+        total['sessions'] = len(streams)
+        total['playing'] = sum(1 for s in streams.values() if s['state'] == 'PLAYING')
+        total['restarts'] = sum(w.restarts for w in self.workers)
+        total['workers'] = workers
+        total['streams'] = streams
+        return total
+
+    def close(self):
+        '''Closes every stream, stops the workers and removes the rings.'''
+        self.stopped.set()
+        self.monitor.join()
+        for worker in self.workers:
+            try:
+                self.request(worker, 'exit', ())
+            except Exception:
+                pass
+            worker.process.join(self.reply_timeout)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.connection.close()
+        with self.lock:
+            streams = list(self.streams.values())
+            self.streams.clear()
+        for stream in streams:
+            stream.ring.close()
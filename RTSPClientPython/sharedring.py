@@ -0,0 +1,261 @@
+import multiprocessing, struct, time, weakref
+from multiprocessing import shared_memory
+
+from session import SessionListener
+
+RING_MAGIC = b'RTPRING1'
+# magic, slot count, slot size, frames published, closed
+RING_HEADER = struct.Struct('<8sIIQB')
+RING_HEADER_SIZE = 64
+# begin and end (index of the frame being written / last written, a seqlock),
+# sequence number, timestamp, payload type, marker, kind, image mode, width,
+# height, payload length, publish time
+SLOT_HEADER = struct.Struct('<QQIIBBB4sHHId')
+SLOT_HEADER_SIZE = 64
+
+ENCODED = 0  # the payload as received (a JPEG image for payload type 26)
+RAW = 1      # decoded pixels, as given by PIL's Image.tobytes()
+
+created = set()  # names of the blocks created by this process
+
+def attach_memory(name):
+    '''Opens an existing shared memory block without letting this process's
+    resource tracker destroy it at exit.
+    '''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before Python 3.13 every attached block is tracked. Processes
+        # started by multiprocessing share their parent's tracker, which
+        # must keep the block registered for its creator.
+        memory = shared_memory.SharedMemory(name)
+        if multiprocessing.parent_process() is None and name not in created:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+class SharedFramePublisher(SessionListener):
+    def __init__(self, name=None, slot_count=32, slot_size=0x200000, decode=False, size=None, create=True):
+        '''Session listener that publishes frames into a ring of slots in a
+        shared memory block, which SharedFrameSubscriber reads from other
+        processes. The writer never waits for readers: slot_count frames
+        later, a slot is simply overwritten, and readers that fell behind
+        skip ahead. Each slot is guarded by a sequence lock (a counter
+        written before and after the frame), so readers can tell when a
+        frame changed under them.
+
+        - name: Name of the shared memory block; None picks a free one.
+          Subscribers attach by this name (the name attribute).
+        - slot_size: Largest frame, in bytes. Larger frames are counted in
+          oversized and not published.
+        - decode: If set, frames are decoded (at size, if given) and their
+          pixels are published instead of the encoded payload.
+        - create: If not set, publishing continues in the existing ring
+          with the given name (whose size is then used), for example
+          after the process that published before was restarted. The
+          ring is then left in place by close().
+        '''
+        self.decode = decode
+        self.size = size
+        self.create = create
+        if create:
+            self.memory = shared_memory.SharedMemory(name, create=True,
+                                                     size=RING_HEADER_SIZE + slot_count * (SLOT_HEADER_SIZE + slot_size))
+            created.add(self.memory.name)
+            RING_HEADER.pack_into(self.memory.buf, 0, RING_MAGIC, slot_count, slot_size, 0, 0)
+            published = 0
+        else:
+            self.memory = attach_memory(name)
+            magic, slot_count, slot_size, published, _ = RING_HEADER.unpack_from(self.memory.buf, 0)
+            if magic != RING_MAGIC:
+                self.memory.close()
+                raise ValueError(f'{name} is not a frame ring')
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER_SIZE + slot_size
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.published = published
+        self.oversized = 0
+        self.failed = 0
+
+    def frame_received(self, frame):
+        if frame is None:
+            return
+        kind, mode, width, height, payload = ENCODED, b'', 0, 0, frame.payload
+        if self.decode:
+            try:
+                image = frame.decode(self.size)
+            except Exception:
+                self.failed += 1
+                return
+            kind, mode, (width, height), payload = RAW, image.mode.encode(), image.size, image.tobytes()
+        self.publish(frame.sequence_number, frame.timestamp, frame.payload_type, frame.marker,
+                     payload, kind, mode, width, height)
+
+    def publish(self, seq_num, timestamp, payload_type, marker, payload, kind=ENCODED, mode=b'',
+                width=0, height=0):
+        '''Writes one frame into the next slot. Returns False if it is too
+        large for a slot.
+        '''
+        length = len(payload)
+        if length > self.slot_size:
+            self.oversized += 1
+            return False
+        index = self.published + 1
+        offset = RING_HEADER_SIZE + (index % self.slot_count) * self.stride
+        buffer = self.buffer
+        # begin first: a reader that sees begin != end knows the slot is
+        # being rewritten
+        struct.pack_into('<Q', buffer, offset, index)
+        data = offset + SLOT_HEADER_SIZE
+        buffer[data:data + length] = payload
+        SLOT_HEADER.pack_into(buffer, offset, index, index, seq_num & 0xFFFFFFFF,
+                              timestamp & 0xFFFFFFFF, payload_type & 0xFF, 1 if marker else 0,
+                              kind, mode, width, height, length, time.time())
+        self.published = index
+        struct.pack_into('<Q', buffer, 16, index)
+        return True
+
+    def close(self):
+        '''Marks the ring as closed, so subscribers stop, and removes it.
+        A publisher that did not create the ring only detaches from it.
+        '''
+        if self.create:
+            struct.pack_into('<B', self.buffer, 24, 1)
+        self.buffer = None
+        self.memory.close()
+        if self.create:
+            self.memory.unlink()
+            created.discard(self.name)
+
+class SharedFrame:
+    def __init__(self, subscriber, index, header, payload):
+        '''A frame read from the ring. payload is a memoryview over the
+        shared memory: it is not copied, and the publisher may overwrite
+        it once the ring wraps around. Check valid() after using it, or
+        take a copy() first.
+        '''
+        self.subscriber = subscriber
+        self.index = index
+        (_, _, self.sequence_number, self.timestamp, self.payload_type, marker,
+         self.kind, mode, self.width, self.height, _, self.published) = header
+        self.marker = bool(marker)
+        self.mode = mode.rstrip(b'\0').decode()
+        self.payload = payload
+
+    def valid(self):
+        '''Whether the payload still holds this frame.'''
+        return self.subscriber.slot_index(self.index) == self.index
+
+    def copy(self):
+        '''Returns the payload as bytes, or None if it was overwritten.'''
+        data = bytes(self.payload)
+        return data if self.valid() else None
+
+    def image(self):
+        '''Returns a PIL image of the frame (copied out of the ring).'''
+        import io
+        from PIL import Image
+        if self.kind == RAW:
+            image = Image.frombytes(self.mode, (self.width, self.height), bytes(self.payload))
+        else:
+            image = Image.open(io.BytesIO(bytes(self.payload)))
+            image.load()
+        return image
+
+class SharedFrameSubscriber:
+    def __init__(self, name, from_start=False, poll_interval=0.001):
+        '''Reads the frames published by a SharedFramePublisher with the
+        given name, from another process. Reading starts with the next
+        frame published, or with the oldest still in the ring if
+        from_start is set. Frames overwritten before they were read are
+        counted in missed.
+        '''
+        self.memory = attach_memory(name)
+        self.buffer = self.memory.buf
+        magic, self.slot_count, self.slot_size, published, _ = RING_HEADER.unpack_from(self.buffer, 0)
+        if magic != RING_MAGIC:
+            self.memory.close()
+            raise ValueError(f'{name} is not a frame ring')
+        self.stride = SLOT_HEADER_SIZE + self.slot_size
+        self.poll_interval = poll_interval
+        self.next = max(1, published - self.slot_count + 2) if from_start else published + 1
+        self.missed = 0
+        self.received = 0
+        self.frames = weakref.WeakSet()  # frames whose views close() releases
+
+    def published(self):
+        return struct.unpack_from('<Q', self.buffer, 16)[0]
+
+    def closed(self):
+        return self.buffer[24] != 0
+
+    def slot_index(self, index):
+        '''Index of the frame whose write was last completed in the slot of
+        the given frame, or None while the slot is being written.
+        '''
+        begin, end = struct.unpack_from('<QQ', self.buffer, RING_HEADER_SIZE + (index % self.slot_count) * self.stride)
+        return end if begin == end else None
+
+    def poll(self):
+        '''Returns the next frame if it is available, or None.'''
+        published = self.published()
+        if published < self.next:
+            return None
+        # the slot after the newest one may be being rewritten already
+        oldest = published - self.slot_count + 2
+        if self.next < oldest:
+            self.missed += oldest - self.next
+            self.next = oldest
+        index = self.next
+        offset = RING_HEADER_SIZE + (index % self.slot_count) * self.stride
+        header = SLOT_HEADER.unpack_from(self.buffer, offset)
+        length = header[10]
+        payload = self.buffer[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length]
+        self.next += 1
+        frame = SharedFrame(self, index, header, payload)
+        if header[0] != index or header[1] != index or not frame.valid():
+            # overwritten while reading the header
+            self.missed += 1
+            return self.poll()
+        self.received += 1
+        self.frames.add(frame)
+        return frame
+
+    def read(self, timeout=None):
+        '''Waits for the next frame and returns it. Returns None on timeout
+        or when the publisher closes the ring.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            frame = self.poll()
+            if frame is not None:
+                return frame
+            if self.closed() or (deadline is not None and time.monotonic() >= deadline):
+                return None
+            time.sleep(self.poll_interval)
+
+    def latest(self):
+        '''Skips to the newest frame and returns it, or None.'''
+        published = self.published()
+        if published >= self.next:
+            self.missed += published - self.next
+            self.next = published
+        return self.poll()
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def close(self):
+        '''Detaches from the ring. The payloads of frames read before can
+        no longer be used afterwards.
+        '''
+        for frame in list(self.frames):
+            frame.payload.release()
+        self.buffer = None
+        self.memory.close()
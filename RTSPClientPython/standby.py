@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from threading import Lock, Timer
+
+class StandbyPool:
+    def __init__(self, max_size=2, idle_timeout=60.0, max_bitrate=None):
+        '''Keeps connections that are already set up (and possibly playing)
+        for videos that are not being shown, so switching to them is
+        immediate. Connections are evicted, least recently used first,
+        when there are more than max_size, when they were not used for
+        idle_timeout seconds, or while the standby streams together
+        receive more than max_bitrate bits per second. Evicted connections
+        are torn down and closed.
+        '''
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_bitrate = max_bitrate
+        self.entries = OrderedDict()  # video name -> (connection, time added)
+        self.lock = Lock()
+        self.timer = None
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, video_name):
+        return video_name in self.entries
+
+    def add(self, video_name, connection):
+        '''Adds a standby connection for a video, replacing (and closing) any
+        other for the same video, then enforces the budget.
+        '''
+        with self.lock:
+            previous = self.entries.pop(video_name, None)
+            self.entries[video_name] = (connection, time.monotonic())
+        if previous is not None:
+            self.release(previous[0])
+        self.evict()
+
+    def take(self, video_name):
+        '''Removes and returns the standby connection for a video, or None.'''
+        with self.lock:
+            entry = self.entries.pop(video_name, None)
+        return entry[0] if entry else None
+
+    def evict(self):
+        '''Closes the connections over budget, and schedules the next check
+        for idle connections.
+        '''
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for video_name, (connection, added) in list(self.entries.items()):
+                if self.idle_timeout is not None and now - added >= self.idle_timeout:
+                    evicted.append(self.entries.pop(video_name)[0])
+            while len(self.entries) > self.max_size:
+                evicted.append(self.entries.popitem(last=False)[1][0])
+            if self.max_bitrate is not None:
+                while self.entries and sum(c.stats.bitrate(now) for c, _ in self.entries.values()) > self.max_bitrate:
+                    evicted.append(self.entries.popitem(last=False)[1][0])
+            self.schedule(now)
+        for connection in evicted:
+            self.evicted += 1
+            self.release(connection)
+
+    def schedule(self, now):
+        '''Arms the timer for the next idle or bitrate check. Must be called
+        with the lock held.
+        '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.entries:
+            return
+        delays = []
+        if self.idle_timeout is not None:
+            delays.append(min(added for _, added in self.entries.values()) + self.idle_timeout - now)
+        if self.max_bitrate is not None:
+            delays.append(1.0)
+        if delays:
+            self.timer = Timer(max(0.0, min(delays)), self.evict)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def release(self, connection):
+        try:
+            connection.teardown()
+        except Exception:
+            pass
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        '''Closes every standby connection.'''
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            connections = [c for c, _ in self.entries.values()]
+            self.entries.clear()
+        for connection in connections:
+            self.release(connection)
@@ -0,0 +1,154 @@
+import json, time
+from collections import deque
+
+from jitter import SEQ_HALF, SEQ_MOD
+
+class ReceiveStats:
+    def __init__(self, bitrate_window=2.0, report_interval=1.0):
+        '''Live counters for the RTP packets and frames of one stream. The
+        update methods are called from the receive and playout threads
+        and only touch plain numbers; snapshot() copies them into a dict.
+
+        - bitrate_window: Seconds over which the receive bitrate is
+          averaged.
+        - report_interval: Least number of seconds between two calls to
+          on_report, if it is set.
+        '''
+        self.bitrate_window = bitrate_window
+        self.report_interval = report_interval
+        self.on_report = None
+        self.buffer = None
+        self.playout = None
+        self.depacketizer = None
+        self.receiver = None
+        self.parser = None
+        self.delay = None
+        self.reset()
+
+    def attach(self, buffer=None, playout=None, depacketizer=None, receiver=None, parser=None, delay=None):
+        '''Sets the pipeline stages whose own counters are included in
+        snapshots.
+        '''
+        self.buffer = buffer
+        self.playout = playout
+        self.depacketizer = depacketizer
+        self.receiver = receiver
+        self.parser = parser
+        self.delay = delay
+
+    def reset(self):
+        self.start_time = time.monotonic()
+        self.packets = 0
+        self.bytes = 0
+        self.base_seq = None
+        self.highest_seq = None
+        self.reordered = 0
+        self.max_reorder_depth = 0
+        self.jitter = 0.0          # seconds, RFC 3550 section 6.4.1
+        self.last_transit = None
+        self.frames = 0
+        self.frame_bytes = 0
+        self.window = deque()      # (arrival time, bytes) per packet
+        self.window_bytes = 0
+        self.last_arrival = None
+        self.last_report = self.start_time
+
+    def packet_received(self, seq_num, timestamp, size, arrival, clock_rate=None):
+        '''Records one RTP packet received at the given monotonic time.
+        Interarrival jitter is only measured once the clock rate of the
+        stream is known.
+        '''
+        self.packets += 1
+        self.bytes += size
+        self.window_bytes += size
+        self.last_arrival = arrival
+        self.window.append((arrival, size))
+        while self.window[0][0] < arrival - self.bitrate_window:
+            self.window_bytes -= self.window.popleft()[1]
+
+        if self.highest_seq is None:
+            self.base_seq = self.highest_seq = seq_num
+        else:
+            delta = (seq_num - self.highest_seq) & (SEQ_MOD - 1)
+            if delta >= SEQ_HALF:
+                delta -= SEQ_MOD
+            if delta > 0:
+                self.highest_seq += delta
+            elif delta < 0:
+                self.reordered += 1
+                if -delta > self.max_reorder_depth:
+                    self.max_reorder_depth = -delta
+
+        if clock_rate:
+            transit = arrival - timestamp / clock_rate
+            if self.last_transit is not None:
+                d = abs(transit - self.last_transit)
+                # timestamps wrap every 2^32 ticks; ignore that jump
+                if d < 2 ** 31 / clock_rate:
+                    self.jitter += (d - self.jitter) / 16
+            self.last_transit = transit
+
+    def frame_played(self, size):
+        self.frames += 1
+        self.frame_bytes += size
+
+    def bitrate(self, now=None):
+        '''Bits per second received over the last bitrate_window seconds.'''
+        now = time.monotonic() if now is None else now
+        # the window is only trimmed by the receiving thread, when packets
+        # arrive; if none arrived for a whole window, nothing is flowing
+        if self.last_arrival is None or self.last_arrival < now - self.bitrate_window:
+            return 0.0
+        elapsed = min(self.bitrate_window, now - self.start_time)
+        return 8 * self.window_bytes / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self, now):
+        '''Calls on_report with a snapshot if report_interval has elapsed.'''
+        if self.on_report and now - self.last_report >= self.report_interval:
+            self.last_report = now
+            self.on_report(self.snapshot(now))
+
+    def snapshot(self, now=None):
+        '''Returns a dict with the current value of every counter.'''
+        now = time.monotonic() if now is None else now
+        expected = 0 if self.highest_seq is None else self.highest_seq - self.base_seq + 1
+        elapsed = now - self.start_time
+        result = {
+            'elapsed': elapsed,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'expected_packets': expected,
+            'lost_packets': max(0, expected - self.packets),
+            'loss_fraction': max(0, expected - self.packets) / expected if expected else 0.0,
+            'reordered_packets': self.reordered,
+            'max_reorder_depth': self.max_reorder_depth,
+            'jitter': self.jitter,
+            'bitrate': self.bitrate(now),
+            'frames': self.frames,
+            'frame_rate': self.frames / elapsed if elapsed > 0 else 0.0,
+            'frame_bytes': self.frame_bytes,
+        }
+        if self.buffer is not None:
+            result['buffered_packets'] = len(self.buffer)
+            result['duplicate_packets'] = self.buffer.duplicates
+            result['late_packets'] = self.buffer.late
+        if self.playout is not None:
+            result['late_frames'] = self.playout.late_frames
+            result['max_playout_offset'] = self.playout.max_offset
+            result['clock_rate'] = self.playout.clock_rate
+        if self.depacketizer is not None:
+            result['dropped_frames'] = self.depacketizer.dropped
+        if self.receiver is not None:
+            result['kernel_drops'] = self.receiver.kernel_drops
+            result['receive_buffer'] = self.receiver.receive_buffer
+        if self.parser is not None:
+            result['invalid_packets'] = self.parser.invalid
+            result['foreign_packets'] = self.parser.foreign
+        if self.delay is not None:
+            result['playout_delay'] = self.delay.current
+            result['target_delay'] = self.delay.target
+            result['underruns'] = self.delay.underruns
+        return result
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
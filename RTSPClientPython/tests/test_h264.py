@@ -0,0 +1,110 @@
+from h264 import H264Depacketizer, START_CODE
+from payload import DepacketizerRegistry
+
+SPS = bytes((0x67, 1, 2, 3))
+PPS = bytes((0x68, 4, 5))
+IDR = bytes((0x65,)) + bytes(range(256)) * 4
+SLICE = bytes((0x41,)) + b'p' * 50
+
+def fu_a(nal, size=300):
+    indicator = (nal[0] & 0xE0) | 28
+    body = nal[1:]
+    payloads = []
+    for offset in range(0, len(body), size):
+        header = nal[0] & 0x1F
+        if offset == 0:
+            header |= 0x80
+        if offset + size >= len(body):
+            header |= 0x40
+        payloads.append(bytes((indicator, header)) + body[offset:offset + size])
+    return payloads
+
+def stap_a(*nals):
+    return bytes((24,)) + b''.join(len(n).to_bytes(2, 'big') + n for n in nals)
+
+class Stream:
+    '''Feeds RTP payloads to a depacketizer with consecutive sequence
+    numbers, collecting the access units it returns.
+    '''
+    def __init__(self, depacketizer):
+        self.depacketizer = depacketizer
+        self.seq_num = 0
+        self.units = []
+
+    def packet(self, payload, timestamp, marker):
+        self.seq_num += 1
+        unit = self.depacketizer.push((96, marker, self.seq_num, timestamp, payload))
+        while unit is not None:
+            self.units.append(unit)
+            unit = self.depacketizer.pop()
+
+    def send(self, payloads, timestamp, marker=True):
+        for i, payload in enumerate(payloads):
+            self.packet(payload, timestamp, marker and i == len(payloads) - 1)
+
+def test_waits_for_a_keyframe():
+    stream = Stream(H264Depacketizer())
+    stream.send([SLICE], 0)
+    assert stream.units == []
+    assert stream.depacketizer.dropped == 1
+
+def test_single_nal_stap_a_and_fu_a():
+    stream = Stream(H264Depacketizer())
+    stream.send([stap_a(SPS, PPS)] + fu_a(IDR), 3000)
+    stream.send([SLICE], 6000)
+    keyframe, delta = stream.units
+    assert keyframe[1] and keyframe[3] == 3000
+    assert keyframe[4] == START_CODE + SPS + START_CODE + PPS + START_CODE + IDR
+    assert keyframe[2] == stream.seq_num - 1
+    assert not delta[1] and delta[4] == START_CODE + SLICE
+
+def test_parameter_sets_are_put_before_keyframes_without_them():
+    stream = Stream(H264Depacketizer(parameter_sets=[SPS, PPS]))
+    stream.send(fu_a(IDR), 0)
+    assert stream.units[0][4] == START_CODE + SPS + START_CODE + PPS + START_CODE + IDR
+
+def test_loss_drops_until_the_next_keyframe():
+    stream = Stream(H264Depacketizer())
+    stream.send(fu_a(IDR), 0)
+    fragments = fu_a(IDR)
+    stream.send(fragments[:2], 3000, marker=False)
+    stream.depacketizer.lost()
+    stream.send([SLICE], 6000)
+    assert len(stream.units) == 1
+    stream.send(fu_a(IDR), 9000)
+    assert [u[3] for u in stream.units] == [0, 9000]
+
+def test_fragment_without_start_is_dropped():
+    stream = Stream(H264Depacketizer(wait_for_keyframe=False))
+    stream.send(fu_a(IDR)[1:], 0)
+    assert stream.units == []
+    assert stream.depacketizer.dropped == 1
+
+def test_unit_without_marker_ends_at_the_next_timestamp():
+    stream = Stream(H264Depacketizer(wait_for_keyframe=False))
+    stream.send([SLICE], 0, marker=False)
+    last = stream.seq_num
+    stream.send(fu_a(IDR), 3000)
+    assert [(u[2], u[3]) for u in stream.units] == [(last, 0), (stream.seq_num, 3000)]
+
+def test_packet_completing_two_units_returns_both():
+    stream = Stream(H264Depacketizer(wait_for_keyframe=False))
+    stream.send([SLICE], 0, marker=False)
+    stream.send([SLICE], 3000)
+    assert [(u[2], u[3]) for u in stream.units] == [(1, 0), (2, 3000)]
+    assert stream.depacketizer.frames == 2
+    assert stream.depacketizer.dropped == 0
+    assert stream.depacketizer.pop() is None
+
+def test_interleaved_mode_is_unsupported():
+    depacketizer = H264Depacketizer(wait_for_keyframe=False)
+    assert depacketizer.push((96, True, 1, 0, bytes((25, 0, 0)))) is None
+    assert depacketizer.unsupported == 1
+
+def test_registry_routes_by_payload_type():
+    registry = DepacketizerRegistry()
+    stream = Stream(registry)
+    stream.send(fu_a(IDR), 0)
+    assert len(stream.units) == 1
+    assert registry.push((33, True, 9, 0, b'raw')) == (33, True, 9, 0, b'raw')
+    assert registry.frames == 2
@@ -0,0 +1,69 @@
+from jitter import JitterBuffer
+
+def drain(buffer):
+    entries = []
+    while True:
+        entry = buffer.pop()
+        if entry is None:
+            return entries
+        entries.append(entry)
+
+def test_plays_in_sequence_order():
+    buffer = JitterBuffer(16)
+    for seq_num in (3, 1, 2, 4):
+        assert buffer.insert(seq_num, seq_num)
+    assert [packet for _, packet in drain(buffer)] == [1, 2, 3, 4]
+
+def test_sequence_number_wraparound():
+    buffer = JitterBuffer(16)
+    for seq_num in (65534, 0, 65535, 1):
+        buffer.insert(seq_num, seq_num)
+    entries = drain(buffer)
+    assert [packet for _, packet in entries] == [65534, 65535, 0, 1]
+    assert [ext for ext, _ in entries] == [65534, 65535, 65536, 65537]
+
+def test_extend_picks_the_closest_value():
+    buffer = JitterBuffer(16)
+    buffer.insert(65535, None)
+    assert buffer.extend(2) == 65538
+    assert buffer.extend(65530) == 65530
+
+def test_missing_packets_are_returned_as_gaps():
+    buffer = JitterBuffer(16)
+    buffer.insert(10, 'a')
+    buffer.insert(12, 'c')
+    assert buffer.depth() == 3
+    assert buffer.peek() == 'a'
+    assert drain(buffer) == [(10, 'a'), (11, None), (12, 'c')]
+
+def test_duplicates_and_late_packets_are_discarded():
+    buffer = JitterBuffer(16)
+    buffer.insert(5, 'a')
+    buffer.insert(6, 'b')
+    assert not buffer.insert(6, 'b')
+    assert buffer.duplicates == 1
+    buffer.pop()
+    assert not buffer.insert(5, 'a')
+    assert buffer.late == 1
+    assert len(buffer) == 1
+
+def test_reordering_before_playout_starts_moves_the_head_back():
+    buffer = JitterBuffer(16)
+    buffer.insert(5, 'b')
+    buffer.insert(4, 'a')
+    assert drain(buffer) == [(4, 'a'), (5, 'b')]
+
+def test_overflow_skips_the_oldest_packets():
+    buffer = JitterBuffer(4)
+    for seq_num in range(6):
+        buffer.insert(seq_num, seq_num)
+    assert buffer.overflows == 2
+    assert [packet for _, packet in drain(buffer)] == [2, 3, 4, 5]
+
+def test_clear_forgets_the_history():
+    buffer = JitterBuffer(16)
+    buffer.insert(100, 'a')
+    buffer.pop()
+    buffer.clear()
+    assert buffer.insert(5, 'b')
+    assert drain(buffer) == [(5, 'b')]
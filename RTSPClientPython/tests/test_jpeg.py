@@ -0,0 +1,97 @@
+import io
+
+import pytest
+
+from jpeg import (JPEGDepacketizer, JPEG_HEADER, JPEG_PAYLOAD_TYPE, LUMA_QUANTIZER, CHROMA_QUANTIZER,
+                  QUANT_HEADER, RESTART_HEADER, make_headers, make_tables)
+
+Image = pytest.importorskip('PIL.Image')
+testserver = pytest.importorskip('testserver')
+
+WIDTH, HEIGHT, QUALITY = 128, 96, 75
+
+@pytest.fixture(scope='module')
+def jpeg():
+    return testserver.synthetic_frames(1, WIDTH, HEIGHT, QUALITY)[0]
+
+def packets(payloads, timestamp=0, first_seq=0):
+    return [(JPEG_PAYLOAD_TYPE, i == len(payloads) - 1, first_seq + i, timestamp, p)
+            for i, p in enumerate(payloads)]
+
+def push_all(depacketizer, frames):
+    return [f for f in map(depacketizer.push, frames) if f is not None]
+
+def test_tables_at_q50_are_the_reference_tables():
+    luma, chroma = make_tables(50)
+    assert luma == bytes(LUMA_QUANTIZER)
+    assert chroma == bytes(CHROMA_QUANTIZER)
+
+def test_tables_are_clamped():
+    luma, chroma = make_tables(99)
+    assert min(luma) == 1 and min(chroma) == 1
+    luma, chroma = make_tables(1)
+    assert max(luma) == 255
+
+def test_headers_describe_the_frame():
+    tables = b''.join(make_tables(75))
+    header = make_headers(1, WIDTH, HEIGHT, tables, dri=4)
+    assert header.startswith(b'\xff\xd8')
+    assert header.count(b'\xff\xdb') == 2
+    assert b'\xff\xdd\x00\x04\x00\x04' in header
+    sof = header.index(b'\xff\xc0')
+    assert header[sof + 5:sof + 9] == bytes((0, HEIGHT, 0, WIDTH))
+    assert header.endswith(bytes((0, 63, 0)))
+
+def test_reassembled_frame_decodes_like_the_original(jpeg):
+    payloads = testserver.packetize(testserver.scan_data(jpeg), WIDTH, HEIGHT, QUALITY, 200)
+    assert len(payloads) > 2
+    frames = push_all(JPEGDepacketizer(), packets(payloads, timestamp=3000, first_seq=7))
+    assert len(frames) == 1
+    payload_type, marker, seq_num, timestamp, data = frames[0]
+    assert (payload_type, seq_num, timestamp) == (JPEG_PAYLOAD_TYPE, 7 + len(payloads) - 1, 3000)
+    original = Image.open(io.BytesIO(jpeg))
+    rebuilt = Image.open(io.BytesIO(data))
+    assert rebuilt.size == original.size
+    assert rebuilt.tobytes() == original.tobytes()
+
+def test_missing_fragment_drops_the_frame(jpeg):
+    payloads = testserver.packetize(testserver.scan_data(jpeg), WIDTH, HEIGHT, QUALITY, 200)
+    depacketizer = JPEGDepacketizer()
+    frames = packets(payloads)
+    del frames[1]
+    assert push_all(depacketizer, frames) == []
+    assert depacketizer.dropped == 1
+    # the next frame is not affected
+    assert len(push_all(depacketizer, packets(payloads, timestamp=3000))) == 1
+    assert depacketizer.frames == 1
+
+def test_lost_packet_drops_the_frame_in_progress(jpeg):
+    payloads = testserver.packetize(testserver.scan_data(jpeg), WIDTH, HEIGHT, QUALITY, 200)
+    depacketizer = JPEGDepacketizer()
+    frames = packets(payloads)
+    depacketizer.push(frames[0])
+    depacketizer.lost()
+    assert push_all(depacketizer, frames[1:]) == []
+    assert depacketizer.dropped == 1
+
+def test_in_band_tables_and_restart_interval():
+    tables = bytes(range(1, 129))
+    payload = (JPEG_HEADER.pack(0, 0, 0, 65, 255, WIDTH // 8, HEIGHT // 8)
+               + RESTART_HEADER.pack(8, 0xFFFF)
+               + QUANT_HEADER.pack(0, 0, len(tables)) + tables + b'scan')
+    frame = JPEGDepacketizer().push((JPEG_PAYLOAD_TYPE, True, 0, 0, payload))
+    data = frame[4]
+    assert data.startswith(make_headers(65, WIDTH, HEIGHT, tables, dri=8))
+    assert data.endswith(b'scan\xff\xd9')
+
+def test_tables_never_received():
+    payload = JPEG_HEADER.pack(0, 0, 0, 1, 200, WIDTH // 8, HEIGHT // 8) + QUANT_HEADER.pack(0, 0, 0) + b'scan'
+    depacketizer = JPEGDepacketizer()
+    assert depacketizer.push((JPEG_PAYLOAD_TYPE, True, 0, 0, payload)) is None
+    assert depacketizer.dropped == 1
+
+def test_complete_images_pass_through(jpeg):
+    depacketizer = JPEGDepacketizer()
+    frame = (JPEG_PAYLOAD_TYPE, True, 1, 0, jpeg)
+    assert depacketizer.push(frame) == frame
+    assert depacketizer.pop() is None
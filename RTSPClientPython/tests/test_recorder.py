@@ -0,0 +1,80 @@
+import os
+
+from recorder import INDEX_ENTRY, INDEX_MAGIC, Recorder, RecordingReader, segment_paths, write_all
+from session import VideoFrame
+
+def record(directory, frames, **options):
+    recorder = Recorder(str(directory), **options)
+    for frame in frames:
+        recorder.frame_received(frame)
+    recorder.close()
+    assert recorder.exception is None
+    return recorder
+
+def frames(count, start=0, step=3000):
+    return [VideoFrame(26, i % 10 == 0, i, (start + i * step) & 0xFFFFFFFF, bytes([i % 256]) * (100 + i))
+            for i in range(count)]
+
+def test_frames_read_back_in_order(tmp_path):
+    recorded = frames(50)
+    recorder = record(tmp_path, recorded)
+    assert recorder.frames == 50
+    reader = RecordingReader(str(tmp_path))
+    read = [(f[0], f[1], f[2], f[3], bytes(f[4])) for f in reader.frames()]
+    assert read == [(f.timestamp, f.sequence_number, 26, f.marker, f.payload) for f in recorded]
+    reader.close()
+
+def test_segments_roll_over(tmp_path):
+    recorder = record(tmp_path, frames(50), segment_size=1000, write_size=500)
+    reader = RecordingReader(str(tmp_path))
+    assert recorder.segments == len(reader.segments) > 1
+    assert len(reader) == 50
+    reader.close()
+
+def test_seek_finds_the_last_frame_at_or_before(tmp_path):
+    record(tmp_path, frames(50), segment_size=1000)
+    reader = RecordingReader(str(tmp_path))
+    assert next(reader.frames(30 * 3000))[1] == 30
+    assert next(reader.frames(30 * 3000 + 1))[1] == 30
+    assert next(reader.frames(-1))[1] == 0
+    assert reader.seek(10 ** 9) == (len(reader.segments) - 1, reader.segments[-1].count - 1)
+    reader.close()
+
+def test_timestamps_are_unwrapped(tmp_path):
+    record(tmp_path, frames(10, start=0xFFFFFFFF - 4 * 3000))
+    reader = RecordingReader(str(tmp_path))
+    timestamps = [f[0] for f in reader.frames()]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[-1] > 0xFFFFFFFF
+    reader.close()
+
+def test_index_past_the_data_is_not_read(tmp_path):
+    record(tmp_path, frames(10))
+    data_path, index_path = segment_paths(str(tmp_path), 0)
+    assert os.path.getsize(index_path) == len(INDEX_MAGIC) + 10 * INDEX_ENTRY.size
+    # as if the last frame's data were not written yet
+    os.truncate(data_path, os.path.getsize(data_path) - 1)
+    reader = RecordingReader(str(tmp_path))
+    assert len(reader) == 9
+    reader.close()
+
+def test_recording_continues_in_a_new_segment(tmp_path):
+    record(tmp_path, frames(5))
+    record(tmp_path, frames(5, start=5 * 3000))
+    reader = RecordingReader(str(tmp_path))
+    assert [s.number for s in reader.segments] == [0, 1]
+    assert len(reader) == 10
+    reader.close()
+
+def test_short_writes_are_retried():
+    class ShortFile:
+        def __init__(self):
+            self.written = bytearray()
+        def write(self, data):
+            self.written += bytes(data[:3])
+            return min(3, len(data))
+    file = ShortFile()
+    data = bytearray(b'0123456789')
+    write_all(file, data)
+    data.clear()
+    assert file.written == b'0123456789'
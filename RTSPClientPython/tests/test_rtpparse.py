@@ -0,0 +1,64 @@
+import struct
+
+import pytest
+
+from rtpparse import RTPParser, RTPParseError, parse_packet
+
+def header(seq_num=1, timestamp=90000, ssrc=0x1234, payload_type=26, marker=False,
+           csrcs=(), extension=False, padding=False):
+    first = 0x80 | len(csrcs) | (0x10 if extension else 0) | (0x20 if padding else 0)
+    second = payload_type | (0x80 if marker else 0)
+    return struct.pack('!BBHII', first, second, seq_num, timestamp, ssrc) + \
+        b''.join(struct.pack('!I', c) for c in csrcs)
+
+def test_fixed_header():
+    packet = parse_packet(header(seq_num=65535, timestamp=0xFFFFFFFF, marker=True) + b'data')
+    assert packet.payload_type == 26
+    assert packet.marker
+    assert packet.sequence_number == 65535
+    assert packet.timestamp == 0xFFFFFFFF
+    assert packet.ssrc == 0x1234
+    assert bytes(packet.payload) == b'data'
+    assert packet.as_frame() == (26, 1, 65535, 0xFFFFFFFF, b'data')
+
+def test_csrcs_extension_and_padding_are_removed():
+    data = (header(csrcs=(7, 8), extension=True, padding=True)
+            + struct.pack('!HH', 0xBEDE, 1) + b'\x01\x02\x03\x04'
+            + b'payload' + b'\x00\x00\x03')
+    packet = parse_packet(data)
+    assert packet.csrcs == (7, 8)
+    assert packet.extension_profile == 0xBEDE
+    assert bytes(packet.extension) == b'\x01\x02\x03\x04'
+    assert bytes(packet.payload) == b'payload'
+
+def test_payload_is_a_view():
+    data = bytearray(header() + b'abc')
+    packet = parse_packet(data)
+    data[-1] = ord('z')
+    assert bytes(packet.payload) == b'abz'
+
+@pytest.mark.parametrize('data', [
+    b'\x80\x1a\x00',                                        # shorter than the header
+    b'\x40' + header()[1:] + b'data',                       # version 1
+    header(csrcs=(1, 2))[:-4],                              # CSRC list cut short
+    header(extension=True) + struct.pack('!HH', 0, 2) + b'\x00' * 4,  # extension cut short
+    header(padding=True) + b'ab\x00',                       # zero padding length
+    header(padding=True) + b'ab\x09',                       # padding longer than the packet
+])
+def test_malformed_packets(data):
+    with pytest.raises(RTPParseError):
+        parse_packet(data)
+
+def test_parser_locks_onto_the_first_source():
+    parser = RTPParser()
+    packets = [header(seq_num=1, ssrc=5), header(seq_num=2, ssrc=6), b'junk', header(seq_num=3, ssrc=5)]
+    parsed = parser.parse_batch(packets)
+    assert [p.sequence_number for p in parsed] == [1, 3]
+    assert parser.ssrc == 5
+    assert parser.foreign == 1
+    assert parser.invalid == 1
+
+def test_parser_without_lock_accepts_every_source():
+    parser = RTPParser(lock_ssrc=False)
+    assert len(parser.parse_batch([header(ssrc=5), header(ssrc=6)])) == 2
+    assert parser.foreign == 0
@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+from sharedring import RING_HEADER_SIZE, SharedFramePublisher, SharedFrameSubscriber
+
+@pytest.fixture
+def ring():
+    publisher = SharedFramePublisher(slot_count=4, slot_size=64)
+    subscriber = SharedFrameSubscriber(publisher.name)
+    yield publisher, subscriber
+    subscriber.close()
+    publisher.close()
+
+def publish(publisher, count, start=0):
+    for i in range(start, start + count):
+        assert publisher.publish(i, i * 3000, 26, i % 2 == 0, bytes([i]) * 10)
+
+def test_frames_are_read_in_order(ring):
+    publisher, subscriber = ring
+    assert subscriber.poll() is None
+    publish(publisher, 3)
+    read = [subscriber.poll() for _ in range(3)]
+    assert [(f.sequence_number, f.timestamp, f.marker) for f in read] == [(0, 0, True), (1, 3000, False), (2, 6000, True)]
+    assert [f.copy() for f in read] == [bytes([i]) * 10 for i in range(3)]
+    assert subscriber.poll() is None
+    assert subscriber.missed == 0
+
+def test_slow_reader_skips_overwritten_frames(ring):
+    publisher, subscriber = ring
+    publish(publisher, 10)
+    frame = subscriber.poll()
+    # frames are numbered from 1, and the slot after the newest one may be
+    # being rewritten: frames 8 to 10 are left
+    assert frame.sequence_number == 7
+    assert subscriber.missed == 7
+
+def test_overwritten_frame_is_no_longer_valid(ring):
+    publisher, subscriber = ring
+    publish(publisher, 1)
+    frame = subscriber.poll()
+    assert frame.valid()
+    publish(publisher, 4, start=1)
+    assert not frame.valid()
+    assert frame.copy() is None
+
+def test_slot_being_written_is_skipped(ring):
+    publisher, subscriber = ring
+    publish(publisher, 2)
+    # the slot of frame 1 being rewritten: begin ahead of end
+    offset = RING_HEADER_SIZE + (1 % publisher.slot_count) * publisher.stride
+    struct.pack_into('<Q', publisher.buffer, offset, 5)
+    assert subscriber.slot_index(1) is None
+    frame = subscriber.poll()
+    assert frame.sequence_number == 1
+    assert subscriber.missed == 1
+
+def test_oversized_frames_are_refused(ring):
+    publisher, subscriber = ring
+    assert not publisher.publish(0, 0, 26, True, bytes(65))
+    assert publisher.oversized == 1
+    assert subscriber.poll() is None
+
+def test_reader_stops_when_the_ring_closes():
+    publisher = SharedFramePublisher(slot_count=4, slot_size=64)
+    subscriber = SharedFrameSubscriber(publisher.name)
+    publish(publisher, 2)
+    publisher.close()
+    assert [f.sequence_number for f in subscriber] == [0, 1]
+    subscriber.close()
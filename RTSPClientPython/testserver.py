@@ -0,0 +1,295 @@
+#! /usr/bin/python3
+'''Stand-in RTSP server for testing the client without a camera. It speaks
+the SETUP/PLAY/PAUSE/TEARDOWN dialect of Connection and streams synthetic
+MJPEG over RTP (RFC 2435), over UDP or interleaved in the RTSP connection,
+with optional packet loss, reordering and jitter.
+
+    python3 testserver.py --port 8554 --fps 30 --size 640x480 --loss 0.01
+'''
+import argparse, heapq, io, random, re, socket, struct, time
+from threading import Thread, Event, Lock, Timer
+
+from jpeg import JPEG_PAYLOAD_TYPE, JPEG_HEADER
+
+RTP_CLOCK_RATE = 90000
+
+def synthetic_frames(count, width, height, quality):
+    '''Encodes count distinct JPEG images of the given size (a moving
+    gradient), with the standard tables and 4:2:0 subsampling that
+    RFC 2435 type 1 expects. Requires Pillow.
+    '''
+    from PIL import Image
+    base = Image.linear_gradient('L').resize((width, height))
+    frames = []
+    for i in range(count):
+        shift = i * width // count
+        red = base.transform(base.size, Image.AFFINE, (1, 0, shift, 0, 1, 0))
+        image = Image.merge('RGB', (red, base.transpose(Image.FLIP_TOP_BOTTOM), base))
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, subsampling=2, optimize=False)
+        frames.append(output.getvalue())
+    return frames
+
+def scan_data(jpeg):
+    '''Returns the entropy-coded data of a baseline JPEG image, that is,
+    everything after the SOS header without the final EOI marker.
+    '''
+    sos = jpeg.index(b'\xff\xda')
+    length = struct.unpack_from('!H', jpeg, sos + 2)[0]
+    end = len(jpeg) - 2 if jpeg.endswith(b'\xff\xd9') else len(jpeg)
+    return jpeg[sos + 2 + length:end]
+
+def packetize(scan, width, height, quality, packet_size):
+    '''Splits the scan data of a frame into RTP/JPEG payloads of at most
+    packet_size bytes.
+    '''
+    chunk = packet_size - JPEG_HEADER.size
+    payloads = []
+    for offset in range(0, len(scan), chunk):
+        header = JPEG_HEADER.pack(0, offset >> 16, offset & 0xFFFF, 1, quality, width // 8, height // 8)
+        payloads.append(header + scan[offset:offset + chunk])
+    return payloads
+
+class Stream:
+    def __init__(self, server, address, port, handler=None, channel=None):
+        '''RTP sender for one client session. If a client handler and channel
+        are given, packets are sent interleaved in its RTSP connection
+        instead of to the UDP address and port.
+        '''
+        self.server = server
+        self.destination = (address, port)
+        self.handler = handler
+        self.channel = channel
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.seq_num = random.randrange(0x10000)
+        self.ssrc = random.getrandbits(32)
+        self.frame_index = 0
+        self.stop_event = Event()
+        self.thread = None
+        self.sent = 0
+
+    def play(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def pause(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+    def close(self):
+        self.pause()
+        self.socket.close()
+
+    def run(self):
+        '''Sends frames at the configured rate. Every packet is scheduled at
+        the frame's nominal time plus random jitter, and a reordered
+        packet is held back until after the next one.
+        '''
+        options = self.server.options
+        rng = random.Random()
+        interval = 1 / options.fps
+        queue = []
+        held = None
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_frame:
+                # RTP timestamps follow the wall clock, so that clients on the
+                # same machine can measure end-to-end latency
+                timestamp = int(time.time() * RTP_CLOCK_RATE) & 0xFFFFFFFF
+                frame = self.server.payloads[self.frame_index % len(self.server.payloads)]
+                self.frame_index += 1
+                for i, payload in enumerate(frame):
+                    marker = 0x80 if i == len(frame) - 1 else 0
+                    packet = struct.pack('!BBHII', 0x80, marker | JPEG_PAYLOAD_TYPE, self.seq_num,
+                                         timestamp, self.ssrc) + payload
+                    self.seq_num = (self.seq_num + 1) & 0xFFFF
+                    if rng.random() < options.loss:
+                        continue
+                    send_at = next_frame + rng.uniform(0, options.jitter)
+                    if held is not None:
+                        heapq.heappush(queue, (max(send_at, held[0]), self.sent, held[1]))
+                        self.sent += 1
+                        held = None
+                    if rng.random() < options.reorder:
+                        held = (send_at, packet)
+                        continue
+                    heapq.heappush(queue, (send_at, self.sent, packet))
+                    self.sent += 1
+                next_frame += interval
+                if now - next_frame > 1:
+                    next_frame = now
+            while queue and queue[0][0] <= now:
+                packet = heapq.heappop(queue)[2]
+                try:
+                    if self.handler:
+                        self.handler.send(struct.pack('!BBH', 0x24, self.channel, len(packet)) + packet)
+                    else:
+                        self.socket.sendto(packet, self.destination)
+                except OSError:
+                    pass
+            wake = min(next_frame, queue[0][0]) if queue else next_frame
+            self.stop_event.wait(max(0, wake - time.monotonic()))
+
+class ClientHandler:
+    def __init__(self, server, connection, address):
+        '''Answers the RTSP requests of one client connection.'''
+        self.server = server
+        self.connection = connection
+        self.address = address
+        self.stream = None
+        self.session_id = None
+        self.send_lock = Lock()
+        self.timer = None
+
+    def disconnect(self):
+        '''Drops the connection, as a crashing server or a broken link would.'''
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send(self, data):
+        '''Writes to the connection; responses and interleaved packets come
+        from different threads.
+        '''
+        with self.send_lock:
+            self.connection.sendall(data)
+
+    def run(self):
+        reader = self.connection.makefile('rb')
+        try:
+            while True:
+                lines = []
+                while True:
+                    line = reader.readline()
+                    if not line:
+                        return
+                    line = line.decode().strip()
+                    if not line:
+                        break
+                    lines.append(line)
+                if lines:
+                    self.handle(lines)
+        except OSError:
+            pass
+        finally:
+            if self.timer:
+                self.timer.cancel()
+            if self.stream:
+                self.stream.close()
+            self.connection.close()
+
+    def handle(self, lines):
+        command = lines[0].split(' ', 1)[0]
+        headers = dict(l.split(':', 1) for l in lines[1:] if ':' in l)
+        headers = {k.strip().lower(): v.strip() for k, v in headers.items()}
+        code, message = 200, 'OK'
+        extra = ''
+        if command == 'SETUP':
+            transport = headers.get('transport', '')
+            match = re.search(r'client_port=\s*(\d+)', transport)
+            channels = re.search(r'interleaved=(\d+)(?:-(\d+))?', transport)
+            if not match and not channels:
+                code, message = 461, 'Unsupported Transport'
+            else:
+                if self.stream:
+                    self.stream.close()
+                self.session_id = random.randrange(100000, 1000000)
+                if channels:
+                    channel = int(channels.group(1))
+                    self.stream = Stream(self.server, None, None, self, channel)
+                    extra = f'Transport: RTP/AVP/TCP;unicast;interleaved={channel}-{channel + 1}\r\n'
+                else:
+                    self.stream = Stream(self.server, self.address[0], int(match.group(1)))
+                if self.server.options.pipelining and 'pipelined-requests' in headers:
+                    extra += f'Pipelined-Requests: {headers["pipelined-requests"]}\r\n'
+        elif self.stream is None:
+            code, message = 455, 'Method Not Valid In This State'
+        elif command == 'PLAY':
+            start = re.search(r'npt=\s*([\d.]+)', headers.get('range', ''))
+            if start:
+                self.stream.frame_index = int(float(start.group(1)) * self.server.options.fps)
+                extra = f'Range: npt={start.group(1)}-\r\n'
+            self.stream.play()
+            if self.server.options.disconnect_after and self.timer is None:
+                self.timer = Timer(self.server.options.disconnect_after, self.disconnect)
+                self.timer.daemon = True
+                self.timer.start()
+        elif command == 'PAUSE':
+            self.stream.pause()
+        elif command == 'TEARDOWN':
+            self.stream.close()
+            self.stream = None
+        else:
+            code, message = 501, 'Not Implemented'
+        response = f'RTSP/1.0 {code} {message}\r\nCSeq: {headers.get("cseq", "0")}\r\nSession: {self.session_id or 0}\r\n{extra}\r\n'
+        self.send(response.encode())
+
+class TestServer:
+    def __init__(self, options):
+        '''Creates the server and encodes the synthetic frames. options
+        holds the attributes parsed by parse_args().
+        '''
+        self.options = options
+        width, height = (int(v) // 8 * 8 for v in options.size.split('x'))
+        jpegs = synthetic_frames(options.frames, width, height, options.quality)
+        self.payloads = [packetize(scan_data(j), width, height, options.quality, options.packet_size)
+                         for j in jpegs]
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((options.host, options.port))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                return
+            # responses and interleaved packets are small: Nagle's algorithm
+            # would hold them back until the previous one is acknowledged
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Thread(target=ClientHandler(self, connection, address).run, daemon=True).start()
+
+    def start(self):
+        '''Serves clients in a background thread.'''
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.socket.close()
+
+def add_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--size', default='640x480', help='frame size, WIDTHxHEIGHT')
+    parser.add_argument('--quality', type=int, default=75, help='JPEG Q factor (1-99)')
+    parser.add_argument('--frames', type=int, default=25, help='distinct frames to cycle through')
+    parser.add_argument('--packet-size', type=int, default=1400, help='largest RTP payload in bytes')
+    parser.add_argument('--loss', type=float, default=0, help='probability of dropping a packet')
+    parser.add_argument('--reorder', type=float, default=0, help='probability of swapping a packet with the next')
+    parser.add_argument('--jitter', type=float, default=0, help='largest extra delay per packet, in seconds')
+    parser.add_argument('--disconnect-after', type=float, default=0,
+                        help='drop each client connection this many seconds after it starts playing')
+    parser.add_argument('--pipelining', action='store_true',
+                        help='answer Pipelined-Requests headers, so clients pipeline PLAY after SETUP')
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    add_arguments(parser)
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    options = parse_args()
+    server = TestServer(options)
+    print(f'Serving on {options.host}:{server.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
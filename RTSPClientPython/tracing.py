@@ -0,0 +1,205 @@
+import bisect, json, os, time
+from collections import deque
+from threading import Lock
+
+# Events stamped on a frame as it goes through the client, in order
+EVENTS = ('first_packet', 'last_packet', 'dequeued', 'delivered', 'dispatched', 'decode_start', 'decoded',
+          'rendered')
+# Stages measured between two events
+STAGES = (
+    ('receive', 'first_packet', 'last_packet'),   # packets of the frame arriving
+    ('buffer', 'last_packet', 'dequeued'),        # waiting in the jitter buffer
+    ('playout', 'dequeued', 'delivered'),         # waiting for the playout deadline
+    ('dispatch', 'delivered', 'dispatched'),      # waiting in a listener's queue
+    ('decode_wait', 'dispatched', 'decode_start'),
+    ('decode', 'decode_start', 'decoded'),
+    ('render', 'decoded', 'rendered'),            # waiting for the Tk thread and showing
+    ('total', 'first_packet', 'rendered'),
+)
+ENDING = {}
+for stage, start, end in STAGES:
+    ENDING.setdefault(end, []).append((stage, start))
+
+# Upper bounds of the histogram buckets, in seconds
+BOUNDS = tuple(ms / 1000 for ms in (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000))
+
+class Histogram:
+    def __init__(self, bounds=BOUNDS):
+        '''Counts durations in buckets with the given upper bounds, plus one
+        for longer ones.
+        '''
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''Upper bound of the bucket holding the given fraction of values.'''
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': {f'{b * 1000:g}ms': c for b, c in zip(self.bounds + (float('inf'),), self.counts) if c},
+        }
+
+class FrameTrace:
+    __slots__ = ('tracer', 'stream', 'timestamp', 'stamps')
+
+    def __init__(self, tracer, stream, timestamp):
+        '''The events stamped on one frame, identified by its stream and
+        RTP timestamp.
+        '''
+        self.tracer = tracer
+        self.stream = stream
+        self.timestamp = timestamp
+        self.stamps = {}  # event -> monotonic time
+
+    def mark(self, event, when=None):
+        '''Stamps an event, at the given monotonic time or now. Only the
+        first stamp of an event counts, so that when several listeners
+        decode a frame, the first one is measured.
+        '''
+        if event in self.stamps:
+            return
+        if when is None:
+            when = time.monotonic()
+        self.stamps[event] = when
+        self.tracer.stamped(self, event, when)
+
+class LatencyTracer:
+    def __init__(self, window=30.0, max_pending=1024):
+        '''Follows frames through the client's stages (see STAGES) and
+        keeps a latency histogram for each stage. A tracer is given to a
+        Session to turn tracing on; without one, each stage only costs a
+        check for None.
+
+        The traces of the last window seconds are kept, and can be
+        exported as a Chrome trace (chrome://tracing, or Perfetto) with
+        dump(). Frames still being received are tracked by RTP timestamp;
+        at most max_pending of them, as the ones whose packets were lost
+        are never completed.
+        '''
+        self.window = window
+        self.max_pending = max_pending
+        self.lock = Lock()
+        self.pending = {}     # (stream, timestamp) -> trace of a frame being received
+        self.traces = deque()  # traces started in the last window, oldest first
+        self.histograms = {stage: Histogram() for stage, _, _ in STAGES}
+        self.frames = 0
+
+    def packet(self, stream, timestamp, arrival):
+        '''Called for every RTP packet received.'''
+        trace = self.pending.get((stream, timestamp))
+        if trace is None:
+            trace = FrameTrace(self, stream, timestamp)
+            with self.lock:
+                self.pending[(stream, timestamp)] = trace
+                self.traces.append(trace)
+                self.frames += 1
+                self.expire(arrival)
+            trace.mark('first_packet', arrival)
+        # the receive stage is measured when the frame leaves the buffer
+        trace.stamps['last_packet'] = arrival
+
+    def frame(self, stream, timestamp, when=None):
+        '''Called when a frame leaves the jitter buffer. Returns its trace,
+        or None if its packets were not traced.
+        '''
+        with self.lock:
+            trace = self.pending.pop((stream, timestamp), None)
+        if trace is not None:
+            self.stamped(trace, 'last_packet', trace.stamps['last_packet'])
+            trace.mark('dequeued', when)
+        return trace
+
+    def stamped(self, trace, event, when):
+        stages = ENDING.get(event)
+        if stages is None:
+            return
+        stamps = trace.stamps
+        with self.lock:
+            for stage, start in stages:
+                if start in stamps:
+                    self.histograms[stage].add(when - stamps[start])
+
+    def expire(self, now):
+        '''Forgets the traces older than the window. Must be called with the
+        lock held.
+        '''
+        limit = now - self.window
+        traces = self.traces
+        while traces and traces[0].stamps.get('first_packet', now) < limit:
+            trace = traces.popleft()
+            self.pending.pop((trace.stream, trace.timestamp), None)
+        while len(self.pending) > self.max_pending:
+            del self.pending[next(iter(self.pending))]
+
+    def statistics(self):
+        '''Returns the latency histogram of each stage (in seconds).'''
+        with self.lock:
+            result = {stage: histogram.snapshot() for stage, histogram in self.histograms.items()}
+            result['frames'] = self.frames
+            result['pending'] = len(self.pending)
+        return result
+
+    def reset(self):
+        with self.lock:
+            self.pending.clear()
+            self.traces.clear()
+            self.histograms = {stage: Histogram() for stage, _, _ in STAGES}
+            self.frames = 0
+
+    def chrome_trace(self, start=None, end=None):
+        '''Returns the traces of the frames whose first packet arrived
+        between the monotonic times start and end, as a Chrome trace-event
+        document. Each frame is an async track with one slice per stage,
+        nested in a slice for the whole frame.
+        '''
+        with self.lock:
+            traces = list(self.traces)
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'RTSP client'}}]
+        for trace in traces:
+            stamps = dict(trace.stamps)
+            first = stamps.get('first_packet')
+            if first is None or (start is not None and first < start) or (end is not None and first > end):
+                continue
+            last = max(stamps.values())
+            common = {'cat': str(trace.stream), 'id': f'{trace.stream}:{trace.timestamp}', 'pid': pid, 'tid': 0}
+            events.append(dict(common, name='frame', ph='b', ts=first * 1e6, args={'rtp_timestamp': trace.timestamp}))
+            for stage, begin, finish in STAGES[:-1]:
+                if begin in stamps and finish in stamps:
+                    events.append(dict(common, name=stage, ph='b', ts=stamps[begin] * 1e6))
+                    events.append(dict(common, name=stage, ph='e', ts=stamps[finish] * 1e6))
+            events.append(dict(common, name='frame', ph='e', ts=last * 1e6))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path, seconds=None):
+        '''Writes the traces of the last seconds (of the whole window if
+        None) to a Chrome trace JSON file.
+        '''
+        start = None if seconds is None else time.monotonic() - seconds
+        with open(path, 'w') as output:
+            json.dump(self.chrome_trace(start), output)